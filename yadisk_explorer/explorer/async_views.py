@@ -0,0 +1,320 @@
+import logging
+from urllib.parse import unquote
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.loader import get_template, render_to_string
+from django.utils.html import format_html
+
+from . import metrics, search, stats
+from .auth import TOKEN_KEY, afetch_user_info, token_session_data
+from .blob_cache import blob_cache
+from .cache import download_link_cache, listing_cache
+from .client import async_yandex_client
+from .listing import AsyncFolderLister, Row
+from .metrics import render
+from .previews import preview_cache
+from .views import BulkDownloadView, DownloadView, IndexView, YandexAuthCallbackView
+from .zipstream import stream_zip
+
+logger = logging.getLogger(__name__)
+
+
+async def iterate_in_thread(iterator):
+    """Асинхронно отдаёт элементы синхронного итератора, вызывая next() в пуле потоков.
+
+    Django под ASGI вычитывает синхронный StreamingHttpResponse целиком в
+    память, поэтому синхронные генераторы оборачиваются этой функцией.
+    """
+    sentinel = object()
+    try:
+        while True:
+            item = await sync_to_async(next, thread_sensitive=False)(iterator, sentinel)
+            if item is sentinel:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=False)()
+
+
+class AsyncIndexView(IndexView):
+    """IndexView для ASGI: запросы к API не занимают воркер на время ожидания"""
+
+    async def get(self, request):
+        if not await request.session.ahas_key('yandex_user'):
+            return render(request, 'login.html')
+        return render(request, 'index.html')
+
+    async def post(self, request):
+        user = await request.session.aget('yandex_user')
+        if user is None:
+            return redirect('index')
+
+        public_url = request.POST.get('public_url', '').strip()
+        path = request.POST.get('path', '').strip() or self.ROOT_PATH
+        page = self._get_page(request)
+        recursive = bool(request.POST.get('recursive'))
+        query = self._listing_query(request)
+        public_key = None
+        files = []
+        has_next = False
+        error = None
+        context = {
+            'user': user,
+            'public_url': public_url,
+            'path': path,
+            'page': page,
+            'recursive': recursive,
+            'listing_query': query,
+            'sort_choices': self.SORT_CHOICES,
+        }
+
+        if public_url:
+            try:
+                public_key = self._parse_public_url(public_url)
+                context['public_key'] = public_key
+                context['stats'] = await stats.aget_stats(public_key, path)
+                sort = self._get_sort(query)
+                match = self._get_filter(query)
+
+                async def fetch_page(params):
+                    async def fetch():
+                        logger.debug("Requesting Yandex API with params: %s", params)
+                        response = await async_yandex_client.get_public_resource(params)
+                        data = self._check_listing_response(response)
+                        await sync_to_async(search.index_listing)(public_key, data)
+                        return data
+
+                    return await listing_cache.aget_or_fetch(params, fetch)
+
+                lister = AsyncFolderLister(fetch_page)
+                token = await request.session.aget('yandex_token')
+                if query['all']:
+                    rows = self._aiter_rows(lister, public_key, path, recursive, sort, match)
+                    response, first = await self._astream_listing(request, context, rows)
+                    preview_cache.prefetch([row._asdict() for row in first], token=token)
+                    return response
+
+                items, has_next = await self._alist_page(lister, public_key, path, page, recursive, sort, match)
+                files = [self._parse_item(item, public_key) for item in items]
+                preview_cache.prefetch(items, token=token)
+
+            except Exception as e:
+                error = str(e)
+                logger.error(f"Error processing request: {error}")
+
+        return render(request, 'index.html', dict(
+            context,
+            files=files,
+            public_key=public_key,
+            has_next=has_next,
+            error=error,
+        ))
+
+    async def _alist_page(self, lister, public_key, path, page, recursive, sort=None, match=None):
+        """Асинхронный вариант _list_page"""
+        limit = lister.page_size
+        offset = (page - 1) * limit
+
+        if recursive or match or sort in self.TYPE_SORTS:
+            items = []
+            walker = lister.items(public_key, path, sort=sort, recursive=recursive, match=match)
+            try:
+                position = 0
+                async for item in walker:
+                    if position >= offset:
+                        items.append(item)
+                        if len(items) > limit:
+                            break
+                    position += 1
+            finally:
+                await walker.aclose()
+            return items[:limit], len(items) > limit
+
+        items, total = await lister.page(public_key, path, offset, limit, sort=sort)
+        if total is not None:
+            return items, offset + limit < total
+        return items, len(items) == limit
+
+    async def _aiter_rows(self, lister, public_key, path, recursive, sort, match):
+        walker = lister.items(public_key, path, sort=sort, recursive=recursive, match=match)
+        try:
+            async for item in walker:
+                yield Row.from_item(item, public_key)
+        finally:
+            await walker.aclose()
+
+    async def _astream_listing(self, request, context, rows):
+        """Асинхронный вариант _stream_listing: rows — асинхронный генератор Row"""
+        chunk_size = getattr(settings, 'LISTING_STREAM_CHUNK_SIZE', 200)
+
+        async def next_chunk():
+            chunk = []
+            async for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    break
+            return chunk
+
+        first = await next_chunk()
+        head, tail = render_to_string('index.html', dict(context, streaming=True), request).split(self.ROWS_MARKER)
+        rows_template = get_template('listing_rows.html')
+        rows_context = {name: context[name] for name in ('public_url', 'recursive')}
+
+        async def body():
+            yield head
+            chunk = first
+            try:
+                while chunk:
+                    yield rows_template.render(dict(rows_context, files=chunk), request)
+                    chunk = await next_chunk()
+            except Exception as e:
+                logger.error(f"Error streaming listing: {e}")
+                yield format_html('<tr><td colspan="7" class="text-danger">{}</td></tr>', str(e))
+            finally:
+                await rows.aclose()
+            yield tail
+
+        response = StreamingHttpResponse(body(), content_type='text/html; charset=utf-8')
+        response['X-Accel-Buffering'] = 'no'
+        return response, first
+
+
+class AsyncDownloadView(DownloadView):
+    """DownloadView для ASGI: файл отдаётся асинхронным потоком"""
+
+    http_method_names = ['get', 'options']
+
+    async def get(self, request):
+        user = await request.session.aget('yandex_user')
+        if user is None:
+            return redirect('index')
+
+        file_response = None
+        try:
+            file_path = unquote(request.GET.get('path', ''))
+            public_key = request.GET.get('public_key', '')
+
+            if not file_path or not public_key:
+                raise ValueError("Не указаны path и public_key")
+
+            md5 = await sync_to_async(self._verified_md5)(public_key, file_path, request.GET.get('md5', ''))
+            cached_path = blob_cache.get(md5)
+            if cached_path is not None:
+                return self._cached_file_response(cached_path, file_path)
+
+            token = await request.session.aget('yandex_token')
+            link_params = {
+                'public_key': public_key,
+                'path': file_path,
+                'md5': md5
+            }
+
+            # 1. Получаем временную ссылку для скачивания (из кэша, если есть)
+            async def fetch():
+                response = await async_yandex_client.get_download_link(public_key, file_path, token=token)
+                return self._check_download_link(response)
+
+            download_url = (await download_link_cache.aget_or_fetch(link_params, fetch))['href']
+
+            cacheable = self._is_cacheable(request, md5)
+            if self._download_mode(request) == 'redirect' and not cacheable:
+                return redirect(download_url)
+
+            # 2. Открываем поток по полученной ссылке (с Range/If-Range клиента)
+            file_response = await async_yandex_client.open_download(
+                download_url, token=token, headers=self._range_headers(request)
+            )
+            if file_response.status_code not in self.PASSTHROUGH_STATUSES:
+                await sync_to_async(download_link_cache.invalidate)(link_params)
+                file_response.raise_for_status()
+            if file_response.status_code == 416:
+                await file_response.aclose()
+
+            return self._stream_response(
+                file_response,
+                file_path,
+                self._iter_file(file_response, self._cache_writer(file_response, md5, cacheable))
+            )
+
+        except Exception as e:
+            if file_response is not None:
+                await file_response.aclose()
+            logger.error(f"Download error: {str(e)}")
+            return render(request, 'index.html', {
+                'user': user,
+                'error': str(e)
+            })
+
+    async def _iter_file(self, file_response, writer=None):
+        # Запись в кэш — блокирующий дисковый ввод-вывод, не для цикла событий
+        try:
+            async for chunk in file_response.aiter_bytes(chunk_size=settings.DOWNLOAD_CHUNK_SIZE):
+                if writer is not None:
+                    await sync_to_async(writer.write)(chunk)
+                metrics.record_streamed('download', len(chunk))
+                yield chunk
+            if writer is not None:
+                await sync_to_async(writer.commit)()
+        finally:
+            if writer is not None:
+                await sync_to_async(writer.abort)()
+            await file_response.aclose()
+
+
+class AsyncBulkDownloadView(BulkDownloadView):
+    """BulkDownloadView для ASGI: архив собирается в пуле потоков"""
+
+    async def post(self, request):
+        user = await request.session.aget('yandex_user')
+        if user is None:
+            return redirect('index')
+
+        try:
+            public_key, paths, folder = self._read_selection(request)
+            token = await request.session.aget('yandex_token')
+            members = self._zip_members(public_key, paths, folder, token)
+            return self._zip_response(iterate_in_thread(stream_zip(members)), folder)
+
+        except Exception as e:
+            logger.error(f"Bulk download error: {str(e)}")
+            return render(request, 'index.html', {
+                'user': user,
+                'error': str(e)
+            })
+
+
+class AsyncYandexAuthCallbackView(YandexAuthCallbackView):
+    async def get(self, request):
+        code = request.GET.get('code')
+        if not code:
+            return render(request, 'error.html', {'error': 'Authorization failed'})
+
+        # Получаем токен
+        try:
+            response = await async_yandex_client.exchange_code(code)
+        except httpx.HTTPError as e:
+            logger.error(f"Token request failed: {e}")
+            return render(request, 'error.html', {'error': 'Сервис авторизации Яндекса недоступен'})
+
+        if response.status_code != 200:
+            return render(request, 'error.html', {'error': 'Token request failed'})
+
+        session_data = token_session_data(response.json())
+        await request.session.aupdate(session_data)
+
+        # Получаем информацию о пользователе
+        try:
+            user_info = await afetch_user_info(session_data[TOKEN_KEY])
+        except ValueError as e:
+            logger.error(f"User info request failed: {e}")
+            return render(request, 'error.html', {'error': str(e)})
+
+        await request.session.aset('yandex_user', self._session_user(user_info))
+
+        return redirect('index')
@@ -0,0 +1,151 @@
+import hashlib
+import logging
+import time
+from functools import partial
+
+import httpx
+import requests
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .client import async_yandex_client, yandex_client
+from .exceptions import AuthenticationFailed, UpstreamUnavailable
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Ключи сессии с OAuth-токеном
+TOKEN_KEY = 'yandex_token'
+REFRESH_TOKEN_KEY = 'yandex_refresh_token'
+EXPIRES_KEY = 'yandex_token_expires'
+
+
+def token_session_data(token_data):
+    """Значения сессии из ответа oauth.yandex.ru (код или refresh_token)"""
+    expires_in = token_data.get('expires_in')
+    data = {
+        TOKEN_KEY: token_data['access_token'],
+        EXPIRES_KEY: int(time.time()) + int(expires_in) if expires_in else None,
+    }
+    if token_data.get('refresh_token'):
+        data[REFRESH_TOKEN_KEY] = token_data['refresh_token']
+    return data
+
+
+def _token_key(token):
+    # Токены не храним в памяти в открытом виде
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def fetch_user_info(token):
+    """Профиль пользователя с login.yandex.ru.
+
+    Нужен только при входе: дальше данные пользователя берутся из сессии.
+    401 означает недействительный токен (AuthenticationFailed), прочие
+    сбои — UpstreamUnavailable.
+    """
+    try:
+        response = yandex_client.get_user_info(token)
+    except requests.RequestException as e:
+        raise UpstreamUnavailable(f"Не удалось получить профиль пользователя: {e}") from e
+    return _user_info(response)
+
+
+async def afetch_user_info(token):
+    """Асинхронный вариант fetch_user_info"""
+    try:
+        response = await async_yandex_client.get_user_info(token)
+    except httpx.HTTPError as e:
+        raise UpstreamUnavailable(f"Не удалось получить профиль пользователя: {e}") from e
+    return _user_info(response)
+
+
+def _user_info(response):
+    if response.status_code == 401:
+        raise AuthenticationFailed("OAuth-токен недействителен, войдите заново")
+    if response.status_code != 200:
+        raise UpstreamUnavailable(f"Не удалось получить профиль пользователя ({response.status_code})")
+    return response.json()
+
+
+class TokenRefreshMiddleware:
+    """Обновляет OAuth-токен сессии незадолго до истечения.
+
+    На обычный запрос проверка — сравнение срока из сессии с текущим
+    временем, без обращений к API. За YANDEX_TOKEN_REFRESH_MARGIN секунд до
+    истечения токен обновляется по refresh_token (одновременные обновления
+    одного токена объединяются). Если refresh_token отозван или токен уже
+    истёк и обновить его не удалось, сессия сбрасывается и пользователь
+    входит заново.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.margin = getattr(settings, 'YANDEX_TOKEN_REFRESH_MARGIN', 3600)
+        self._flight = SingleFlight()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        session = request.session
+        expires = session.get(EXPIRES_KEY)
+        if expires and expires - time.time() < self.margin:
+            data = self._refresh(session.get(REFRESH_TOKEN_KEY), expires)
+            if data is None:
+                session.flush()
+            elif data:
+                session.update(data)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        session = request.session
+        expires = await session.aget(EXPIRES_KEY)
+        if expires and expires - time.time() < self.margin:
+            data = await self._arefresh(await session.aget(REFRESH_TOKEN_KEY), expires)
+            if data is None:
+                await session.aflush()
+            elif data:
+                await session.aupdate(data)
+        return await self.get_response(request)
+
+    def _refresh(self, refresh_token, expires):
+        """Новые значения сессии; {} — оставить как есть; None — сбросить сессию"""
+        if not refresh_token:
+            return self._keep_or_drop(expires)
+        try:
+            response, _ = self._flight.do(_token_key(refresh_token), partial(yandex_client.refresh_token, refresh_token))
+        except requests.RequestException as e:
+            logger.warning(f"Token refresh failed: {e}")
+            return self._keep_or_drop(expires)
+        return self._refreshed(response, expires)
+
+    async def _arefresh(self, refresh_token, expires):
+        if not refresh_token:
+            return self._keep_or_drop(expires)
+        try:
+            response, _ = await self._flight.ado(
+                _token_key(refresh_token), partial(async_yandex_client.refresh_token, refresh_token)
+            )
+        except httpx.HTTPError as e:
+            logger.warning(f"Token refresh failed: {e}")
+            return self._keep_or_drop(expires)
+        return self._refreshed(response, expires)
+
+    def _refreshed(self, response, expires):
+        if response.status_code == 200:
+            return token_session_data(response.json())
+        if response.status_code in (400, 401):
+            # refresh_token отозван или истёк
+            logger.info(f"Token refresh rejected ({response.status_code}), session reset")
+            return None
+        logger.warning(f"Token refresh failed with status {response.status_code}")
+        return self._keep_or_drop(expires)
+
+    def _keep_or_drop(self, expires):
+        return {} if expires > time.time() else None
+
@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MD5_RE = re.compile(r'[0-9a-f]{32}')
+
+
+class BlobCache:
+    """Локальный кэш небольших файлов, адресуемый по md5 содержимого.
+
+    Файл сохраняется только если его размер не превышает MAX_CACHE_FILE_SIZE
+    и md5 записанных байтов совпал с заявленным. Запись атомарна (временный
+    файл + os.replace), общий объём ограничен FILE_CACHE_MAX_BYTES: при
+    переполнении удаляются давно не читавшиеся файлы (LRU по mtime,
+    который обновляется при каждом попадании).
+
+    Объём кэша ведётся счётчиком, так что запись файла не обходит каталог.
+    Обход нужен только при первой записи в процессе и при переполнении; он
+    выполняется в фоновом потоке и освобождает место с запасом (до
+    EVICT_TARGET от лимита), поэтому следующий понадобится не скоро.
+    """
+
+    # Доля max_bytes, до которой очистка освобождает кэш
+    EVICT_TARGET = 0.9
+
+    def __init__(self, root=None, max_bytes=None, max_file_size=None, key_re=MD5_RE):
+        self.root = Path(root or getattr(settings, 'FILE_CACHE_DIR', settings.BASE_DIR / 'file_cache'))
+        self.max_bytes = max_bytes or getattr(settings, 'FILE_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+        self.max_file_size = max_file_size or settings.MAX_CACHE_FILE_SIZE
+        # Допустимые ключи (имена файлов); по умолчанию — md5 содержимого
+        self.key_re = key_re
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        # Байт в кэше; None — ещё не посчитано обходом каталога
+        self._total = None
+        self._evicting = None
+
+    def is_cacheable(self, md5, size):
+        """Можно ли сохранить файл с такими md5 и размером"""
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            return False
+        return bool(MD5_RE.fullmatch(md5 or '')) and 0 < size <= self.max_file_size
+
+    def path_for(self, key):
+        return self.root / key[:2] / key
+
+    def get(self, key):
+        """Путь к файлу в кэше или None"""
+        if not self.key_re.fullmatch(key or ''):
+            return None
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def writer(self, key, verify=True):
+        """BlobWriter для сохранения файла по мере его скачивания.
+
+        С verify ключ считается md5 содержимого и проверяется при commit().
+        """
+        return BlobWriter(self, key, verify)
+
+    def added(self, size):
+        """Учитывает опубликованный файл; при переполнении запускает очистку в фоне"""
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+                if self._total <= self.max_bytes:
+                    return
+            if self._evicting is not None and self._evicting.is_alive():
+                return
+            self._evicting = threading.Thread(target=self.evict, name='blob-cache-evict', daemon=True)
+            self._evicting.start()
+
+    def evict(self):
+        """Пересчитывает объём кэша и при переполнении удаляет самые старые
+        файлы, пока он не уложится в EVICT_TARGET от max_bytes"""
+        with self._evict_lock:
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                target = self.max_bytes * self.EVICT_TARGET
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= target:
+                        break
+                    try:
+                        path.unlink()
+                        total -= size
+                    except FileNotFoundError:
+                        pass
+            with self._lock:
+                # Файлы, записанные во время обхода, могут не попасть в
+                # счётчик; это поправит следующий обход
+                self._total = total
+
+    def _scan(self):
+        """(mtime, размер, путь) всех файлов кэша"""
+        entries = []
+        for path in self.root.glob('??/*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+
+class BlobWriter:
+    """Пишет поток байтов во временный файл и публикует его в кэше"""
+
+    def __init__(self, cache, key, verify=True):
+        self.cache = cache
+        self.key = key
+        self.verify = verify
+        self._hasher = hashlib.md5()
+        self._size = 0
+        self._file = None
+        self._done = False
+
+    def write(self, chunk):
+        if self._done:
+            return
+        self._size += len(chunk)
+        if self._size > self.cache.max_file_size:
+            self.abort()
+            return
+        if self._file is None:
+            self.cache.root.mkdir(parents=True, exist_ok=True)
+            self._file = tempfile.NamedTemporaryFile(dir=self.cache.root, prefix='.tmp-', delete=False)
+        if self.verify:
+            self._hasher.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self):
+        """Публикует файл, если поток дочитан до конца и md5 совпал"""
+        if self._done or self._file is None:
+            return
+        self._file.close()
+        if self.verify and self._hasher.hexdigest() != self.key:
+            logger.warning(f"md5 mismatch for cached file {self.key}, discarding")
+            self.abort()
+            return
+
+        target = self.cache.path_for(self.key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            replaced = target.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(self._file.name, target)
+        self._done = True
+        self.cache.added(self._size - replaced)
+
+    def abort(self):
+        """Отбрасывает недописанный файл (после commit ничего не делает)"""
+        if self._done:
+            return
+        self._done = True
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._file.name)
+            except FileNotFoundError:
+                pass
+
+
+blob_cache = BlobCache()
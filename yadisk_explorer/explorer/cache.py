@@ -0,0 +1,399 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from . import metrics
+from .exceptions import ResourceNotFound, UpstreamUnavailable
+from .models import FileCache
+from .singleflight import ProcessLock, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Ограниченный по числу записей и суммарному размеру LRU с TTL.
+
+    Размер записи передаётся снаружи (считается один раз при сохранении),
+    так что чтение не требует ни сериализации, ни копирования. С
+    max_bytes=None лимит только по числу записей.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, size, expires = item
+            if expires <= time.monotonic():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, size=0):
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._bytes
+
+    def _pop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+class ListingCache:
+    """Двухуровневый read-through кэш ответов API листинга.
+
+    Первый уровень — LRU в памяти процесса, второй — FileCache в БД.
+    Запись хранится дольше своего TTL на величину stale_ttl: пока запись
+    свежая, она отдаётся как есть; устаревшая запись тоже отдаётся сразу,
+    а обновление запускается в фоновом потоке (stale-while-revalidate).
+    Ответы 404 кэшируются отдельно на короткий negative_ttl.
+
+    Одновременные промахи по одному ключу объединяются (SingleFlight):
+    запрос к API выполняет один поток или задача, остальные получают его
+    результат. С SINGLE_FLIGHT_LOCK_DIR то же соблюдается между процессами.
+
+    Если API недоступен (UpstreamUnavailable), отдаётся последняя
+    сохранённая запись, даже истёкшая, пока её не удалил clear_expired.
+    """
+
+    KEY_PREFIX = 'listing'
+    KEY_FIELDS = ('public_key', 'path', 'sort', 'offset', 'limit')
+    SERVE_STALE_ON_ERROR = True
+
+    def __init__(self, ttl=None, stale_ttl=None, negative_ttl=None, memory=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'LISTING_CACHE_TTL', 300)
+        self.stale_ttl = stale_ttl if stale_ttl is not None else getattr(settings, 'LISTING_CACHE_STALE_TTL', 3600)
+        self.negative_ttl = (
+            negative_ttl if negative_ttl is not None
+            else getattr(settings, 'LISTING_CACHE_NEGATIVE_TTL', 60)
+        )
+        self.memory = memory if memory is not None else LRUCache(
+            max_entries=getattr(settings, 'LISTING_MEMORY_CACHE_MAX_ENTRIES', 1024),
+            max_bytes=getattr(settings, 'LISTING_MEMORY_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+        )
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._flight = SingleFlight()
+        self._stats = {
+            'hit': 0, 'miss': 0, 'stale': 0, 'memory_hit': 0,
+            'negative_hit': 0, 'refresh_error': 0, 'warm': 0, 'coalesced': 0, 'fallback': 0,
+        }
+
+    def make_key(self, *parts):
+        """Строит ключ кэша по параметрам запроса"""
+        raw = json.dumps(parts)
+        digest = hashlib.sha256(raw.encode('utf-8')).hexdigest()
+        return f'{self.KEY_PREFIX}:{digest}'
+
+    def key_for(self, params):
+        """Ключ кэша для словаря параметров запроса к API"""
+        return self.make_key(*(params.get(field) for field in self.KEY_FIELDS))
+
+    def get_or_fetch(self, params, fetch):
+        """Возвращает листинг из кэша или вызывает fetch() и кэширует результат.
+
+        fetch должен вернуть распарсенный JSON ответа API либо выбросить
+        исключение. Из ошибок кэшируется только ResourceNotFound.
+        """
+        key = self.key_for(params)
+        entry = self._lookup(key)
+
+        if entry is None:
+            self._incr('miss')
+            return self._fetch_and_store(key, fetch)
+
+        if 'not_found' in entry:
+            self._incr('negative_hit')
+            raise ResourceNotFound(entry['not_found'])
+
+        if entry['fresh_until'] > time.time():
+            self._incr('hit')
+        else:
+            self._incr('stale')
+            self._refresh_in_background(key, fetch)
+        return entry['data']
+
+    async def aget_or_fetch(self, params, afetch):
+        """Асинхронный вариант get_or_fetch: afetch — корутинная функция.
+
+        Обращения к FileCache выполняются в пуле потоков, фоновое обновление
+        устаревшей записи запускается задачей в текущем цикле событий.
+        """
+        key = self.key_for(params)
+        entry = self.memory.get(key)
+        if entry is not None and self._is_fresh(entry):
+            self._incr('memory_hit')
+        else:
+            entry = await sync_to_async(self._lookup)(key)
+
+        if entry is None:
+            self._incr('miss')
+            return await self._afetch_and_store(key, afetch)
+
+        if 'not_found' in entry:
+            self._incr('negative_hit')
+            raise ResourceNotFound(entry['not_found'])
+
+        if entry['fresh_until'] > time.time():
+            self._incr('hit')
+        else:
+            self._incr('stale')
+            with self._lock:
+                refreshing = key in self._refreshing
+                self._refreshing.add(key)
+            if not refreshing:
+                asyncio.ensure_future(self._arefresh(key, afetch))
+        return entry['data']
+
+    def warm(self, params, fetch, margin=0):
+        """Обновляет запись заранее: если её нет или она станет устаревшей
+        в ближайшие margin секунд, вызывает fetch() и сохраняет результат.
+
+        Используется прогревом кэша (explorer.warmup) вне запросов
+        пользователей. Возвращает данные листинга.
+        """
+        key = self.key_for(params)
+        entry = self._lookup(key)
+        if entry is not None and 'not_found' not in entry and entry['fresh_until'] - margin > time.time():
+            return entry['data']
+
+        self._incr('warm')
+        return self._fetch_and_store(key, fetch, margin)
+
+    def invalidate(self, params):
+        """Удаляет запись из обоих уровней кэша"""
+        key = self.key_for(params)
+        self.memory.delete(key)
+        FileCache.objects.filter(cache_key=key).delete()
+
+    def stats(self):
+        """Счётчики попаданий/промахов/устаревших записей"""
+        with self._lock:
+            stats = dict(self._stats)
+        total = stats['hit'] + stats['miss'] + stats['stale']
+        stats['hit_ratio'] = (stats['hit'] + stats['stale']) / total if total else 0.0
+        stats['memory_entries'] = len(self.memory)
+        stats['memory_bytes'] = self.memory.total_bytes
+        return stats
+
+    def _lookup(self, key):
+        entry = self.memory.get(key)
+        if entry is not None and self._is_fresh(entry):
+            self._incr('memory_hit')
+            return entry
+
+        # Устаревшую запись в памяти могли уже обновить в БД (другой
+        # процесс или прогрев кэша), поэтому сначала смотрим туда
+        stored = FileCache.get(key)
+        if stored is not None:
+            self._remember(key, stored)
+            return stored
+        return entry
+
+    def _is_fresh(self, entry):
+        return 'not_found' in entry or entry['fresh_until'] > time.time()
+
+    def _fetch_and_store(self, key, fetch, margin=0):
+        data, shared = self._flight.do(key, partial(self._fetch_exclusive, key, fetch, margin))
+        if shared:
+            self._incr('coalesced')
+        return data
+
+    def _fetch_exclusive(self, key, fetch, margin):
+        with ProcessLock(key) as lock:
+            if lock.locked:
+                # Пока ждали блокировку, запись мог обновить другой процесс
+                entry = self._stored_entry(key, margin)
+                if entry is not None:
+                    return self._unwrap(entry)
+
+            try:
+                data = fetch()
+            except ResourceNotFound as e:
+                self._store(key, {'not_found': str(e)}, self.negative_ttl)
+                raise
+            except UpstreamUnavailable:
+                entry = self._fallback_entry(key)
+                if entry is None:
+                    raise
+                return entry['data']
+            self._store(key, {'data': data, 'fresh_until': time.time() + self.ttl}, self.ttl + self.stale_ttl)
+            return data
+
+    async def _afetch_and_store(self, key, afetch, margin=0):
+        data, shared = await self._flight.ado(key, partial(self._afetch_exclusive, key, afetch, margin))
+        if shared:
+            self._incr('coalesced')
+        return data
+
+    async def _afetch_exclusive(self, key, afetch, margin):
+        async with ProcessLock(key) as lock:
+            if lock.locked:
+                entry = await sync_to_async(self._stored_entry)(key, margin)
+                if entry is not None:
+                    return self._unwrap(entry)
+
+            try:
+                data = await afetch()
+            except ResourceNotFound as e:
+                await sync_to_async(self._store)(key, {'not_found': str(e)}, self.negative_ttl)
+                raise
+            except UpstreamUnavailable:
+                entry = await sync_to_async(self._fallback_entry)(key)
+                if entry is None:
+                    raise
+                return entry['data']
+            entry = {'data': data, 'fresh_until': time.time() + self.ttl}
+            await sync_to_async(self._store)(key, entry, self.ttl + self.stale_ttl)
+            return data
+
+    def _stored_entry(self, key, margin):
+        """Запись из FileCache, если она не устареет в ближайшие margin секунд"""
+        entry = FileCache.get(key)
+        if entry is None:
+            return None
+        if 'not_found' not in entry and entry['fresh_until'] - margin <= time.time():
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def _fallback_entry(self, key):
+        """Последняя сохранённая запись с данными для ответа при сбое API"""
+        if not self.SERVE_STALE_ON_ERROR:
+            return None
+        entry = FileCache.get(key, include_expired=True)
+        if entry is None or 'data' not in entry:
+            return None
+        self._incr('fallback')
+        logger.warning(f"Upstream unavailable, serving stale entry {key}")
+        return entry
+
+    def _unwrap(self, entry):
+        if 'not_found' in entry:
+            raise ResourceNotFound(entry['not_found'])
+        return entry['data']
+
+    async def _arefresh(self, key, afetch):
+        try:
+            await self._afetch_and_store(key, afetch)
+        except Exception as e:
+            self._incr('refresh_error')
+            logger.warning(f"Background refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, entry, ttl):
+        self.memory.set(key, entry, ttl, self._sizeof(entry))
+        try:
+            FileCache.set(key, entry, ttl=ttl)
+        except DatabaseError as e:
+            # Кэш в БД — только ускорение: ошибка записи не должна ломать запрос
+            logger.warning(f"FileCache write failed for {key}: {e}")
+
+    def _remember(self, key, entry):
+        if 'not_found' in entry:
+            ttl = self.negative_ttl
+        else:
+            ttl = entry['fresh_until'] + self.stale_ttl - time.time()
+        if ttl > 0:
+            self.memory.set(key, entry, ttl, self._sizeof(entry))
+
+    def _sizeof(self, entry):
+        return len(json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+
+    def _refresh_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        thread = threading.Thread(target=self._refresh, args=(key, fetch), daemon=True)
+        thread.start()
+
+    def _refresh(self, key, fetch):
+        try:
+            self._fetch_and_store(key, fetch)
+        except Exception as e:
+            self._incr('refresh_error')
+            logger.warning(f"Background refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+            connection.close()
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
+        metrics.record_cache(self.KEY_PREFIX, name)
+
+
+class DownloadLinkCache(ListingCache):
+    """Кэш временных ссылок на скачивание (href) по public_key, path и md5.
+
+    Ссылка живёт DOWNLOAD_HREF_TTL секунд — заметно меньше срока действия
+    самой ссылки, поэтому устаревшие ссылки не отдаются.
+    """
+
+    KEY_PREFIX = 'href'
+    KEY_FIELDS = ('public_key', 'path', 'md5')
+    # Истёкшая ссылка на скачивание бесполезна
+    SERVE_STALE_ON_ERROR = False
+
+    def __init__(self, ttl=None, **kwargs):
+        ttl = ttl if ttl is not None else getattr(settings, 'DOWNLOAD_HREF_TTL', 1800)
+        super().__init__(ttl=ttl, stale_ttl=0, **kwargs)
+
+
+class PreviewLinkCache(DownloadLinkCache):
+    """Кэш ссылок на превью файла заданного размера"""
+
+    KEY_PREFIX = 'preview'
+    KEY_FIELDS = ('public_key', 'path', 'preview_size')
+
+
+listing_cache = ListingCache()
+download_link_cache = DownloadLinkCache()
+preview_link_cache = PreviewLinkCache()
@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from .exceptions import UpstreamUnavailable
+from .throttle import api_circuit_breaker, api_rate_limiter, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+BASE_API_URL = "https://cloud-api.yandex.net/v1/disk/public/resources"
+DOWNLOAD_API_URL = "https://cloud-api.yandex.net/v1/disk/public/resources/download"
+OAUTH_TOKEN_URL = "https://oauth.yandex.ru/token"
+USER_INFO_URL = "https://login.yandex.ru/info"
+
+# Имена запросов к API в метриках
+ENDPOINT_NAMES = {
+    BASE_API_URL: 'resources',
+    DOWNLOAD_API_URL: 'download_link',
+    OAUTH_TOKEN_URL: 'oauth_token',
+    USER_INFO_URL: 'user_info',
+}
+
+# Ответы, которые считаются сбоем API для выключателя
+FAILURE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _record_api_response(response, token, limiter, breaker, max_delay):
+    """Учитывает ответ REST API в выключателе и лимитере.
+
+    Возвращает True, если запрос стоит повторить: 429 или 503 с Retry-After
+    не дольше max_delay секунд. Саму паузу выдерживает лимитер.
+    """
+    if response.status_code not in FAILURE_STATUSES:
+        breaker.record_success()
+        return False
+
+    breaker.record_failure()
+    delay = retry_after_seconds(response.headers)
+    if delay is not None:
+        limiter.retry_after(token, delay)
+    if response.status_code != 429 and delay is None:
+        return False
+    return (delay or 0.0) <= max_delay
+
+
+def _endpoint_name(url):
+    # Прямые ссылки на файлы и превью различаются только хостом
+    return ENDPOINT_NAMES.get(url.split('?', 1)[0]) or urlparse(url).netloc
+
+
+def _api_error(response):
+    try:
+        message = response.json().get('message')
+    except ValueError:
+        message = None
+    return UpstreamUnavailable(
+        f"API Яндекс.Диска недоступен ({response.status_code}): {message or 'повторите позже'}",
+        retry_after=retry_after_seconds(response.headers),
+    )
+
+
+class YandexClient:
+    """Клиент API Яндекса с общим пулом keep-alive соединений.
+
+    Одна requests.Session на процесс: соединения (и TLS-сессии) переиспользуются
+    между запросами, размер пула задаётся YANDEX_HTTP_POOL_SIZE. Адаптер
+    повторяет идемпотентные запросы только при ошибках соединения; ответы
+    5xx и 429 повторяет call_api, чтобы каждая попытка прошла через лимитер
+    и выключатель. Все вызовы по умолчанию ограничены YANDEX_API_TIMEOUT.
+
+    Запросы к REST API Диска проходят через общий лимитер частоты (на
+    процесс и на OAuth-токен) и выключатель: при сбоях API запросы не
+    отправляются, а выбрасывается UpstreamUnavailable. Запросы к OAuth
+    и профилю пользователя ограничены более коротким YANDEX_AUTH_TIMEOUT.
+    """
+
+    def __init__(self, pool_size=None, retries=None, timeout=None, download_timeout=None,
+                 limiter=None, breaker=None, auth_timeout=None, retry_after_max=None):
+        self.pool_size = pool_size or getattr(settings, 'YANDEX_HTTP_POOL_SIZE', 10)
+        self.retries = retries if retries is not None else getattr(settings, 'YANDEX_HTTP_RETRIES', 2)
+        self.timeout = timeout or getattr(settings, 'YANDEX_API_TIMEOUT', 10)
+        self.download_timeout = download_timeout or getattr(settings, 'DOWNLOAD_TIMEOUT', 30)
+        self.auth_timeout = auth_timeout or getattr(settings, 'YANDEX_AUTH_TIMEOUT', 5)
+        self.limiter = limiter or api_rate_limiter
+        self.breaker = breaker or api_circuit_breaker
+        self.retry_after_max = (
+            retry_after_max if retry_after_max is not None else getattr(settings, 'YANDEX_API_RETRY_AFTER_MAX', 2)
+        )
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            metrics.record_upstream(_endpoint_name(url), status, time.perf_counter() - started)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def call_api(self, url, params, token=None):
+        """GET к REST API Диска с лимитом частоты и выключателем.
+
+        Ответ 429 (или 503 с Retry-After) повторяется один раз после
+        паузы, если Retry-After не больше retry_after_max секунд; иначе,
+        или если API продолжает отвечать сбоем, сразу выбрасывается
+        UpstreamUnavailable. Остальные ответы возвращаются как есть.
+        """
+        for attempt in range(2):
+            self.breaker.check()
+            self.limiter.acquire(token)
+            try:
+                response = self.get(url, params=params, headers=self.auth_headers(token))
+            except requests.RequestException as e:
+                self.breaker.record_failure()
+                raise UpstreamUnavailable(f"API Яндекс.Диска недоступен: {e}") from e
+
+            retry = _record_api_response(response, token, self.limiter, self.breaker, self.retry_after_max)
+            if response.status_code not in FAILURE_STATUSES:
+                return response
+            if not retry or attempt:
+                raise _api_error(response)
+            logger.warning(f"API returned {response.status_code}, retrying {url}")
+
+    def get_public_resource(self, params, token=None):
+        """Метаинформация публичного ресурса (листинг папки)"""
+        return self.call_api(BASE_API_URL, params, token)
+
+    def get_download_link(self, public_key, path, token=None):
+        """Временная ссылка на скачивание файла из публичной папки"""
+        return self.call_api(DOWNLOAD_API_URL, {'public_key': public_key, 'path': path}, token)
+
+    def open_download(self, url, token=None, headers=None):
+        """Открывает потоковое скачивание по ссылке из get_download_link"""
+        request_headers = self.auth_headers(token)
+        # Без сжатия: байты отдаются клиенту как есть и совпадают с Content-Length
+        request_headers['Accept-Encoding'] = 'identity'
+        request_headers.update(headers or {})
+        return self.get(url, stream=True, headers=request_headers, timeout=self.download_timeout)
+
+    def exchange_code(self, code):
+        """Обменивает код авторизации на OAuth-токен"""
+        return self.post(OAUTH_TOKEN_URL, data={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'client_id': settings.YANDEX_CLIENT_ID,
+            'client_secret': settings.YANDEX_CLIENT_SECRET
+        }, timeout=self.auth_timeout)
+
+    def refresh_token(self, refresh_token):
+        """Обновляет OAuth-токен по refresh_token"""
+        return self.post(OAUTH_TOKEN_URL, data={
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+            'client_id': settings.YANDEX_CLIENT_ID,
+            'client_secret': settings.YANDEX_CLIENT_SECRET
+        }, timeout=self.auth_timeout)
+
+    def get_user_info(self, token):
+        """Профиль пользователя по OAuth-токену"""
+        return self.get(USER_INFO_URL, headers={'Authorization': f'OAuth {token}'}, timeout=self.auth_timeout)
+
+    def auth_headers(self, token=None):
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = f'OAuth {token}'
+        return headers
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _build_session(self):
+        # Только обрывы соединения: ответы со статусом повторяет call_api
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            backoff_factor=0.3,
+            status_forcelist=(),
+            respect_retry_after_header=False,
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+class AsyncYandexClient:
+    """Асинхронный двойник YandexClient на httpx.
+
+    httpx.AsyncClient привязан к циклу событий, поэтому клиент создаётся
+    лениво для текущего цикла и переиспользуется всеми запросами в нём
+    (под ASGI это один цикл на воркер).
+    """
+
+    def __init__(self, pool_size=None, retries=None, timeout=None, download_timeout=None,
+                 limiter=None, breaker=None, auth_timeout=None, retry_after_max=None):
+        self.pool_size = pool_size or getattr(settings, 'YANDEX_ASYNC_POOL_SIZE', 100)
+        self.retries = retries if retries is not None else getattr(settings, 'YANDEX_HTTP_RETRIES', 2)
+        self.timeout = timeout or getattr(settings, 'YANDEX_API_TIMEOUT', 10)
+        self.download_timeout = download_timeout or getattr(settings, 'DOWNLOAD_TIMEOUT', 30)
+        self.auth_timeout = auth_timeout or getattr(settings, 'YANDEX_AUTH_TIMEOUT', 5)
+        self.limiter = limiter or api_rate_limiter
+        self.breaker = breaker or api_circuit_breaker
+        self.retry_after_max = (
+            retry_after_max if retry_after_max is not None else getattr(settings, 'YANDEX_API_RETRY_AFTER_MAX', 2)
+        )
+        self._client = None
+        self._loop = None
+
+    @property
+    def client(self):
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = self._build_client()
+            self._loop = loop
+        return self._client
+
+    async def request(self, method, url, **kwargs):
+        return await self._send(self.client.build_request(method, url, **kwargs))
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def call_api(self, url, params, token=None):
+        """Асинхронный вариант YandexClient.call_api"""
+        for attempt in range(2):
+            self.breaker.check()
+            await self.limiter.aacquire(token)
+            try:
+                response = await self.get(url, params=params, headers=self.auth_headers(token))
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                raise UpstreamUnavailable(f"API Яндекс.Диска недоступен: {e}") from e
+
+            retry = _record_api_response(response, token, self.limiter, self.breaker, self.retry_after_max)
+            if response.status_code not in FAILURE_STATUSES:
+                return response
+            if not retry or attempt:
+                raise _api_error(response)
+            logger.warning(f"API returned {response.status_code}, retrying {url}")
+
+    async def get_public_resource(self, params, token=None):
+        """Метаинформация публичного ресурса (листинг папки)"""
+        return await self.call_api(BASE_API_URL, params, token)
+
+    async def get_download_link(self, public_key, path, token=None):
+        """Временная ссылка на скачивание файла из публичной папки"""
+        return await self.call_api(DOWNLOAD_API_URL, {'public_key': public_key, 'path': path}, token)
+
+    async def open_download(self, url, token=None, headers=None):
+        """Открывает потоковое скачивание; ответ нужно закрыть через aclose()"""
+        request_headers = self.auth_headers(token)
+        # Без сжатия: байты отдаются клиенту как есть и совпадают с Content-Length
+        request_headers['Accept-Encoding'] = 'identity'
+        request_headers.update(headers or {})
+        request = self.client.build_request(
+            'GET', url, headers=request_headers, timeout=self.download_timeout
+        )
+        return await self._send(request, stream=True)
+
+    async def exchange_code(self, code):
+        """Обменивает код авторизации на OAuth-токен"""
+        return await self.post(OAUTH_TOKEN_URL, data={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'client_id': settings.YANDEX_CLIENT_ID,
+            'client_secret': settings.YANDEX_CLIENT_SECRET
+        }, timeout=self.auth_timeout)
+
+    async def refresh_token(self, refresh_token):
+        """Обновляет OAuth-токен по refresh_token"""
+        return await self.post(OAUTH_TOKEN_URL, data={
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+            'client_id': settings.YANDEX_CLIENT_ID,
+            'client_secret': settings.YANDEX_CLIENT_SECRET
+        }, timeout=self.auth_timeout)
+
+    async def get_user_info(self, token):
+        """Профиль пользователя по OAuth-токену"""
+        return await self.get(
+            USER_INFO_URL, headers={'Authorization': f'OAuth {token}'}, timeout=self.auth_timeout
+        )
+
+    def auth_headers(self, token=None):
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = f'OAuth {token}'
+        return headers
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    async def _send(self, request, stream=False):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = await self.client.send(request, stream=stream, follow_redirects=True)
+            status = response.status_code
+            return response
+        finally:
+            metrics.record_upstream(_endpoint_name(str(request.url)), status, time.perf_counter() - started)
+
+    def _build_client(self):
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+        )
+        transport = httpx.AsyncHTTPTransport(retries=self.retries, limits=limits)
+        return httpx.AsyncClient(transport=transport, timeout=self.timeout, follow_redirects=True)
+
+
+yandex_client = YandexClient()
+async_yandex_client = AsyncYandexClient()
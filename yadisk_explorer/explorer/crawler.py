@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import random
+
+from django.conf import settings
+
+from .client import BASE_API_URL, async_yandex_client
+from .exceptions import ResourceNotFound, UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCrawler:
+    """Параллельный обход дерева публичной папки.
+
+    Запросы идут через общий async_yandex_client.call_api: тот же пул
+    соединений, лимитер частоты и выключатель, что и у запросов
+    пользователей, поэтому обход не выбирает квоту API в обход выключателя.
+    Страницы одной папки и соседние подпапки запрашиваются одновременно,
+    но не более concurrency запросов сразу. Сбои API (UpstreamUnavailable)
+    повторяются с экспоненциальной задержкой. Результат — плоский индекс
+    {путь: элемент}.
+    """
+
+    def __init__(self, token=None, concurrency=None, page_size=None, max_retries=None, backoff=0.5, api=None):
+        self.token = token
+        self.concurrency = concurrency or getattr(settings, 'CRAWLER_CONCURRENCY', 16)
+        self.page_size = page_size or getattr(settings, 'LISTING_PAGE_SIZE', 100)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'CRAWLER_MAX_RETRIES', 4)
+        self.backoff = backoff
+        self.api = api or async_yandex_client
+        self.api_calls = 0
+
+    def run(self, coroutine):
+        """Выполняет корутину в новом цикле событий (asyncio.run).
+
+        Клиент API привязан к циклу, поэтому закрывается вместе с ним.
+        """
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                await self.api.aclose()
+
+        return asyncio.run(main())
+
+    def crawl_sync(self, public_key, path='/'):
+        """Синхронная обёртка над crawl() для вызова из обычного кода"""
+        return self.run(self.crawl(public_key, path))
+
+    async def crawl(self, public_key, path='/'):
+        """Обходит дерево и возвращает плоский индекс {путь: элемент}"""
+        self.start()
+        index = {}
+        await self._crawl_dir(public_key, path, index)
+        return index
+
+    def start(self):
+        """Готовит семафор для нового обхода в текущем цикле событий"""
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def fetch_dir(self, public_key, path):
+        """Все элементы одной папки: (метаинформация папки, элементы).
+
+        Первая страница запрашивается сразу, остальные — параллельно,
+        если API сообщил total, иначе последовательно.
+        """
+        data = await self._fetch_page(public_key, path, 0)
+        embedded = data.get('_embedded', {})
+        items = embedded.get('items', [])
+        total = embedded.get('total')
+
+        pages = [items]
+        if total is not None and total > len(items):
+            pages += await asyncio.gather(*(
+                self._fetch_items(public_key, path, offset)
+                for offset in range(self.page_size, total, self.page_size)
+            ))
+        elif total is None and len(items) == self.page_size:
+            # Без total идём последовательно, пока страницы полные
+            offset = self.page_size
+            while True:
+                page = await self._fetch_items(public_key, path, offset)
+                pages.append(page)
+                if len(page) < self.page_size:
+                    break
+                offset += self.page_size
+
+        return data, [item for page in pages for item in page]
+
+    async def _crawl_dir(self, public_key, path, index):
+        _, items = await self.fetch_dir(public_key, path)
+
+        subdirs = []
+        for item in items:
+            index[item['path']] = self._index_entry(item, path)
+            if item.get('type') == 'dir':
+                subdirs.append(item['path'])
+
+        await asyncio.gather(*(
+            self._crawl_dir(public_key, subdir, index) for subdir in subdirs
+        ))
+
+    async def _fetch_items(self, public_key, path, offset):
+        data = await self._fetch_page(public_key, path, offset)
+        return data.get('_embedded', {}).get('items', [])
+
+    async def _fetch_page(self, public_key, path, offset):
+        params = {
+            'public_key': public_key,
+            'path': path,
+            'offset': offset,
+            'limit': self.page_size,
+        }
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                self.api_calls += 1
+                try:
+                    response = await self.api.call_api(BASE_API_URL, params, token=self.token)
+                except UpstreamUnavailable:
+                    if attempt == self.max_retries:
+                        raise
+                    response = None
+
+            if response is not None:
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code == 404:
+                    raise ResourceNotFound(response.json().get('message', 'Ресурс не найден'))
+                error_msg = response.json().get('message', 'Неизвестная ошибка API')
+                raise ValueError(f"Ошибка API ({response.status_code}): {error_msg}")
+
+            delay = self._retry_delay(attempt)
+            logger.warning(f"Retrying {path} offset={offset} in {delay:.2f}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, attempt):
+        # Retry-After уже учтён лимитером в call_api
+        return self.backoff * (2 ** attempt) * (1 + random.random() / 2)
+
+    def _index_entry(self, item, parent):
+        return {
+            'name': item['name'],
+            'type': item['type'],
+            'parent': parent,
+            'size': item.get('size', 0),
+            'modified': item.get('modified', ''),
+            'mime_type': item.get('mime_type', ''),
+            'media_type': item.get('media_type', ''),
+            'md5': item.get('md5', ''),
+        }
@@ -0,0 +1,15 @@
+class ResourceNotFound(ValueError):
+    """API вернул 404: ресурс не существует или не опубликован"""
+
+
+class UpstreamUnavailable(ValueError):
+    """API недоступен: сбои, ответы 429/5xx или превышен лимит запросов"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        # Через сколько секунд имеет смысл повторить запрос, если известно
+        self.retry_after = retry_after
+
+
+class AuthenticationFailed(ValueError):
+    """OAuth-токен недействителен или его не удалось обновить"""
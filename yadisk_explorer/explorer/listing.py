@@ -0,0 +1,264 @@
+import asyncio
+import contextvars
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import connection
+
+
+class FolderLister:
+    """Постраничный и рекурсивный обход публичной папки.
+
+    fetch_page(params) выполняет один запрос к API public/resources и
+    возвращает распарсенный JSON. Страницы и подпапки запрашиваются
+    параллельно, но не более чем в max_workers потоков; элементы отдаются
+    генератором по мере прихода страниц, без сборки полного списка.
+    """
+
+    def __init__(self, fetch_page, page_size=None, max_workers=None):
+        self.fetch_page = fetch_page
+        self.page_size = page_size or getattr(settings, 'LISTING_PAGE_SIZE', 100)
+        self.max_workers = max_workers or getattr(settings, 'LISTING_MAX_WORKERS', 4)
+
+    def page_many(self, public_keys, path='/', offset=0, limit=None, sort=None):
+        """Одна страница нескольких публичных папок параллельно.
+
+        Запросы идут не более чем в max_workers потоков. Возвращает список
+        в порядке public_keys: (элементы, total) или исключение, если
+        страницу этой папки получить не удалось.
+        """
+        def fetch(public_key):
+            try:
+                return self.page(public_key, path, offset, limit, sort)
+            except Exception as e:
+                return e
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=max(min(self.max_workers, len(public_keys)), 1)) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, fetch, public_key)
+                for public_key in public_keys
+            ]
+            return [future.result() for future in futures]
+
+    def items(self, public_key, path='/', sort=None, recursive=False, match=None):
+        """Генератор элементов папки с сортировкой и фильтром на сервере.
+
+        Сортировка по name, size и modified выполняется API (внутри каждой
+        папки), по type — двумя проходами: сначала папки, затем файлы.
+        match — фильтр элементов (например, ListingFilter).
+        """
+        for pass_sort, item_type in sort_passes(sort):
+            for item in self.walk(public_key, path, sort=pass_sort, recursive=recursive):
+                if (item_type is None or item.get('type') == item_type) and (not match or match(item)):
+                    yield item
+
+    def fetch(self, public_key, path, offset=0, limit=None, sort=None):
+        """Сырой ответ API для одной страницы папки"""
+        return self.fetch_page(self._params(public_key, path, offset, limit or self.page_size, sort))
+
+    def page(self, public_key, path, offset=0, limit=None, sort=None):
+        """Одна страница папки: (элементы, общее число элементов или None)"""
+        data = self.fetch(public_key, path, offset, limit, sort)
+        embedded = data.get('_embedded', {})
+        return embedded.get('items', []), embedded.get('total')
+
+    def walk(self, public_key, path='/', sort=None, recursive=True):
+        """Генератор всех элементов папки (и подпапок, если recursive).
+
+        Порядок выдачи детерминирован: страницы обрабатываются в порядке
+        постановки в очередь, а вперёд запрашивается не более max_workers
+        страниц. Поэтому срез генератора годится для постраничного вывода.
+        """
+        pending = deque([(path, 0)])
+        in_flight = deque()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < self.max_workers:
+                    dir_path, offset = pending.popleft()
+                    # Контекст запроса (метрики) переносится в поток пула
+                    future = executor.submit(
+                        contextvars.copy_context().run, self._fetch_items, public_key, dir_path, offset, sort
+                    )
+                    in_flight.append((future, dir_path, offset))
+
+                future, dir_path, offset = in_flight.popleft()
+                items, total = future.result()
+
+                if offset == 0:
+                    pending.extend(
+                        (dir_path, next_offset)
+                        for next_offset in self._next_offsets(len(items), total)
+                    )
+                elif total is None and len(items) == self.page_size:
+                    pending.append((dir_path, offset + self.page_size))
+
+                for item in items:
+                    if recursive and item.get('type') == 'dir':
+                        pending.append((item['path'], 0))
+                    yield item
+        finally:
+            for future, _, _ in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _next_offsets(self, first_page_len, total):
+        """Смещения остальных страниц после первой"""
+        if total is not None:
+            return range(self.page_size, total, self.page_size)
+        if first_page_len == self.page_size:
+            # Без total идём последовательно, пока страницы полные
+            return [self.page_size]
+        return []
+
+    def _fetch_items(self, public_key, path, offset, sort):
+        try:
+            return self.page(public_key, path, offset, self.page_size, sort)
+        finally:
+            connection.close()
+
+    def _params(self, public_key, path, offset, limit, sort):
+        params = {
+            'public_key': public_key,
+            'path': path,
+            'offset': offset,
+            'limit': limit,
+        }
+        if sort:
+            params['sort'] = sort
+        return params
+
+
+class AsyncFolderLister(FolderLister):
+    """Асинхронный вариант FolderLister: fetch_page — корутинная функция.
+
+    Вместо пула потоков вперёд запускается не более max_workers задач в
+    текущем цикле событий; порядок выдачи тот же, что у FolderLister.walk.
+    """
+
+    async def items(self, public_key, path='/', sort=None, recursive=False, match=None):
+        for pass_sort, item_type in sort_passes(sort):
+            walker = self.walk(public_key, path, sort=pass_sort, recursive=recursive)
+            try:
+                async for item in walker:
+                    if (item_type is None or item.get('type') == item_type) and (not match or match(item)):
+                        yield item
+            finally:
+                await walker.aclose()
+
+    async def page(self, public_key, path, offset=0, limit=None, sort=None):
+        data = await self.fetch_page(self._params(public_key, path, offset, limit or self.page_size, sort))
+        embedded = data.get('_embedded', {})
+        return embedded.get('items', []), embedded.get('total')
+
+    async def walk(self, public_key, path='/', sort=None, recursive=True):
+        pending = deque([(path, 0)])
+        in_flight = deque()
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < self.max_workers:
+                    dir_path, offset = pending.popleft()
+                    task = asyncio.ensure_future(self.page(public_key, dir_path, offset, self.page_size, sort))
+                    in_flight.append((task, dir_path, offset))
+
+                task, dir_path, offset = in_flight.popleft()
+                items, total = await task
+
+                if offset == 0:
+                    pending.extend(
+                        (dir_path, next_offset)
+                        for next_offset in self._next_offsets(len(items), total)
+                    )
+                elif total is None and len(items) == self.page_size:
+                    pending.append((dir_path, offset + self.page_size))
+
+                for item in items:
+                    if recursive and item.get('type') == 'dir':
+                        pending.append((item['path'], 0))
+                    yield item
+        finally:
+            for task, _, _ in in_flight:
+                task.cancel()
+
+
+def sort_passes(sort):
+    """Проходы обхода для сортировки: [(sort для API, тип элементов или None)]"""
+    if sort == 'type':
+        return [('name', 'dir'), ('name', 'file')]
+    if sort == '-type':
+        return [('name', 'file'), ('name', 'dir')]
+    return [(sort or None, None)]
+
+
+class ListingFilter:
+    """Фильтр элементов листинга по имени, типу, размеру и дате изменения.
+
+    Пустой фильтр ложен и пропускает все элементы. Даты — datetime.date,
+    сравниваются с датой из поля modified (граница modified_before не
+    включается).
+    """
+
+    def __init__(self, name=None, type=None, min_size=None, max_size=None,
+                 modified_after=None, modified_before=None):
+        self.name = name.casefold() if name else None
+        self.type = type or None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_after = modified_after.isoformat() if modified_after else None
+        self.modified_before = modified_before.isoformat() if modified_before else None
+
+    def __bool__(self):
+        return any(value is not None for value in (
+            self.name, self.type, self.min_size, self.max_size, self.modified_after, self.modified_before,
+        ))
+
+    def __call__(self, item):
+        if self.name is not None and self.name not in item.get('name', '').casefold():
+            return False
+        if self.type is not None and item.get('type') != self.type:
+            return False
+        if self.min_size is not None or self.max_size is not None:
+            if item.get('type') == 'dir':
+                return False
+            size = item.get('size', 0)
+            if self.min_size is not None and size < self.min_size:
+                return False
+            if self.max_size is not None and size > self.max_size:
+                return False
+        if self.modified_after is not None or self.modified_before is not None:
+            # ISO-даты сравниваются как строки
+            day = item.get('modified', '')[:10]
+            if self.modified_after is not None and day < self.modified_after:
+                return False
+            if self.modified_before is not None and day >= self.modified_before:
+                return False
+        return True
+
+
+class Row(namedtuple('Row', 'name type raw_path size modified media_type md5 preview public_key')):
+    """Компактная запись строки таблицы листинга вместо словаря на элемент"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_item(cls, item, public_key):
+        return cls(
+            item['name'],
+            item['type'],
+            item['path'],
+            item.get('size', 0),
+            item.get('modified', ''),
+            item.get('media_type', 'unknown'),
+            item.get('md5', ''),
+            item.get('preview', ''),
+            public_key,
+        )
+
+    @property
+    def path(self):
+        """Путь, закодированный для URL"""
+        return quote(self.raw_path)
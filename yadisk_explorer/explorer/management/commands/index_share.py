@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.crawler import AsyncCrawler
+from explorer.exceptions import ResourceNotFound
+from explorer.search import index_crawl
+from explorer.views import YandexDiskView
+
+
+class Command(BaseCommand):
+    help = 'Обходит публичную папку целиком и сохраняет её в локальный поисковый индекс'
+
+    def add_arguments(self, parser):
+        parser.add_argument('public_keys', nargs='+', help='public_key или ссылка https://disk.yandex.ru/d/...')
+        parser.add_argument('--token', help='OAuth-токен для запросов к API')
+        parser.add_argument('--concurrency', type=int, help='Число одновременных запросов')
+
+    def handle(self, *args, **options):
+        for value in options['public_keys']:
+            public_key = self._public_key(value)
+            crawler = AsyncCrawler(token=options['token'], concurrency=options['concurrency'])
+            try:
+                index = crawler.crawl_sync(public_key)
+            except (ResourceNotFound, ValueError) as e:
+                raise CommandError(f'{public_key}: {e}')
+
+            count = index_crawl(public_key, index)
+            self.stdout.write(self.style.SUCCESS(
+                f'{public_key}: {count} элементов, {crawler.api_calls} запросов к API'
+            ))
+
+    def _public_key(self, value):
+        if value.startswith('http'):
+            try:
+                return YandexDiskView()._extract_public_key(value)
+            except ValueError as e:
+                raise CommandError(str(e))
+        return value
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.crawler import AsyncCrawler
+from explorer.exceptions import ResourceNotFound
+from explorer.models import IndexedShare
+from explorer.sync import ShareSyncer
+
+
+class Command(BaseCommand):
+    help = 'Инкрементально синхронизирует локальный индекс публичных папок с API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('public_keys', nargs='*', help='public_key папок (по умолчанию — все проиндексированные)')
+        parser.add_argument('--token', help='OAuth-токен для запросов к API')
+        parser.add_argument('--concurrency', type=int, help='Число одновременных запросов')
+
+    def handle(self, *args, **options):
+        public_keys = options['public_keys'] or list(
+            IndexedShare.objects.order_by('synced_at').values_list('public_key', flat=True)
+        )
+        if not public_keys:
+            raise CommandError('Нет проиндексированных папок')
+
+        syncer = ShareSyncer(AsyncCrawler(token=options['token'], concurrency=options['concurrency']))
+        for public_key in public_keys:
+            try:
+                result = syncer.sync(public_key)
+            except (ResourceNotFound, ValueError) as e:
+                self.stderr.write(f'{public_key}: {e}')
+                continue
+
+            self.stdout.write(
+                f'{public_key}: +{len(result.added)} -{len(result.removed)} ~{len(result.changed)}, '
+                f'{result.api_calls} запросов к API'
+            )
@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.warmup import CacheWarmer
+
+
+class Command(BaseCommand):
+    help = 'Прогревает кэш листингов публичных папок и удаляет истёкшие записи кэша'
+
+    def add_arguments(self, parser):
+        parser.add_argument('public_keys', nargs='*', help='public_key папок (по умолчанию — WARM_PUBLIC_KEYS)')
+        parser.add_argument('--concurrency', type=int, help='Число одновременных запросов на папку')
+        parser.add_argument('--margin', type=int, help='Обновлять записи, истекающие в ближайшие N секунд')
+        parser.add_argument('--batch-size', type=int, help='Размер пачки при удалении истёкших записей')
+        parser.add_argument('--loop', action='store_true', help='Повторять каждые WARM_INTERVAL секунд')
+
+    def handle(self, *args, **options):
+        warmer = CacheWarmer(
+            public_keys=options['public_keys'],
+            concurrency=options['concurrency'],
+            margin=options['margin'],
+            batch_size=options['batch_size'],
+        )
+        if not warmer.public_keys:
+            raise CommandError('Не указаны папки для прогрева (аргументы или WARM_PUBLIC_KEYS)')
+
+        while True:
+            warmed, purged = warmer.run_once()
+            for public_key in warmer.public_keys:
+                if public_key in warmed:
+                    self.stdout.write(f'{public_key}: {warmed[public_key]} элементов')
+                else:
+                    self.stderr.write(f'{public_key}: ошибка прогрева')
+            self.stdout.write(f'Удалено истёкших записей: {purged}')
+
+            if not options['loop']:
+                return
+            time.sleep(getattr(settings, 'WARM_INTERVAL', 240))
@@ -0,0 +1,261 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django import shortcuts
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# События ListingCache, которые считаются попаданием и промахом
+CACHE_HITS = ('hit', 'stale', 'negative_hit')
+CACHE_MISSES = ('miss',)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labelnames, key)} {value}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [число наблюдений по корзинам, всего наблюдений, сумма]
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def collect(self):
+        with self._lock:
+            values = {key: (list(counts), count, total) for key, (counts, count, total) in self._values.items()}
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        names = self.labelnames + ('le',)
+        for key, (counts, count, total) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket{_labels(names, key + (repr(float(bound)),))} {bucket_count}'
+            yield f'{self.name}_bucket{_labels(names, key + ("+Inf",))} {count}'
+            yield f'{self.name}_sum{_labels(self.labelnames, key)} {total}'
+            yield f'{self.name}_count{_labels(self.labelnames, key)} {count}'
+
+
+class Registry:
+    """Метрики процесса в текстовом формате Prometheus.
+
+    Значения хранятся в памяти процесса: при нескольких воркерах каждый
+    отдаёт свои, суммирование — на стороне Prometheus.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.histogram(
+    'explorer_http_request_duration_seconds', 'Время обработки запроса', ('view', 'method', 'status'),
+)
+upstream_requests = registry.histogram(
+    'explorer_upstream_request_duration_seconds', 'Время запросов к API Яндекса', ('endpoint', 'status'),
+)
+template_renders = registry.histogram(
+    'explorer_template_render_duration_seconds', 'Время рендеринга шаблонов', ('template',),
+)
+cache_events = registry.counter(
+    'explorer_cache_events_total', 'События кэшей листингов и ссылок', ('cache', 'event'),
+)
+bytes_streamed = registry.counter(
+    'explorer_bytes_streamed_total', 'Байты, отданные клиентам потоком', ('kind',),
+)
+
+
+class RequestMetrics:
+    """Счётчики одного запроса для заголовка Server-Timing"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.upstream_time = 0.0
+        self.api_calls = 0
+        self.render_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
+
+    def add(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def server_timing(self):
+        total = (time.perf_counter() - self.started) * 1000
+        parts = [f'upstream;dur={self.upstream_time * 1000:.1f};desc="{self.api_calls} API calls"']
+        if self.cache_hits or self.cache_misses:
+            ratio = self.cache_hits / (self.cache_hits + self.cache_misses)
+            parts.append(f'cache;desc="{self.cache_hits} hit, {self.cache_misses} miss, ratio {ratio:.2f}"')
+        if self.render_time:
+            parts.append(f'render;dur={self.render_time * 1000:.1f}')
+        parts.append(f'total;dur={total:.1f}')
+        return ', '.join(parts)
+
+
+# Метрики текущего запроса; в потоки пула передаются через copy_context()
+current = contextvars.ContextVar('explorer_request_metrics', default=None)
+
+
+def record_upstream(endpoint, status, duration):
+    """Хук клиентов API: длительность одного запроса к Яндексу"""
+    upstream_requests.observe(duration, endpoint=endpoint, status=status)
+    request_metrics = current.get()
+    if request_metrics is not None:
+        request_metrics.add(upstream_time=duration, api_calls=1)
+
+
+def record_cache(cache, event):
+    """Хук ListingCache: попадание, промах и прочие события кэша"""
+    cache_events.inc(cache=cache, event=event)
+    request_metrics = current.get()
+    if request_metrics is not None:
+        if event in CACHE_HITS:
+            request_metrics.add(cache_hits=1)
+        elif event in CACHE_MISSES:
+            request_metrics.add(cache_misses=1)
+
+
+def record_streamed(kind, size):
+    bytes_streamed.inc(size, kind=kind)
+
+
+def render(request, template_name, context=None, *args, **kwargs):
+    """django.shortcuts.render с замером времени рендеринга шаблона"""
+    started = time.perf_counter()
+    try:
+        return shortcuts.render(request, template_name, context, *args, **kwargs)
+    finally:
+        duration = time.perf_counter() - started
+        template_renders.observe(duration, template=template_name)
+        request_metrics = current.get()
+        if request_metrics is not None:
+            request_metrics.add(render_time=duration)
+
+
+def log_sampled(logger, message, *args):
+    """Отладочный лог для горячего пути: форматируется только при уровне
+    DEBUG и для доли DEBUG_LOG_SAMPLE_RATE вызовов, длинные значения
+    обрезаются до DEBUG_LOG_MAX_CHARS символов.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= getattr(settings, 'DEBUG_LOG_SAMPLE_RATE', 0.01):
+        return
+    limit = getattr(settings, 'DEBUG_LOG_MAX_CHARS', 2000)
+    logger.debug(message, *(_truncate(repr(arg), limit) for arg in args))
+
+
+class MetricsMiddleware:
+    """Замеряет запрос целиком и добавляет заголовок Server-Timing
+    (время запросов к API, их число, попадания в кэш, рендеринг шаблона).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics = RequestMetrics()
+        token = current.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self._finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = current.set(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self._finish(request, response, request_metrics)
+
+    def _finish(self, request, response, request_metrics):
+        match = getattr(request, 'resolver_match', None)
+        http_requests.observe(
+            time.perf_counter() - request_metrics.started,
+            view=match.url_name if match else '',
+            method=request.method,
+            status=response.status_code,
+        )
+        response['Server-Timing'] = request_metrics.server_timing()
+        return response
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _truncate(text, limit):
+    return text if len(text) <= limit else f'{text[:limit]}... ({len(text)} chars)'
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:31
+
+from django.db import migrations, models
+
+
+FTS_TABLE = 'explorer_indexeditem_fts'
+
+CREATE_FTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, content='explorer_indexeditem', content_rowid='id', tokenize='unicode61'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON explorer_indexeditem BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON explorer_indexeditem BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name ON explorer_indexeditem BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+]
+
+DROP_FTS = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def create_fts(apps, schema_editor):
+    # Полнотекстовый поиск по именам есть только в SQLite (FTS5)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_FTS:
+        schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_FTS:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexedShare',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_key', models.CharField(max_length=255, unique=True)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('crawled_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IndexedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_key', models.CharField(max_length=255)),
+                ('path', models.CharField(max_length=1024)),
+                ('parent', models.CharField(max_length=1024)),
+                ('name', models.CharField(max_length=255)),
+                ('type', models.CharField(max_length=8)),
+                ('mime_type', models.CharField(blank=True, default='', max_length=255)),
+                ('media_type', models.CharField(blank=True, default='', max_length=64)),
+                ('size', models.BigIntegerField(default=0)),
+                ('modified', models.DateTimeField(blank=True, null=True)),
+                ('md5', models.CharField(blank=True, default='', max_length=32)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['public_key', 'parent'], name='explorer_item_parent_idx'), models.Index(fields=['public_key', 'name'], name='explorer_item_name_idx'), models.Index(fields=['public_key', 'mime_type'], name='explorer_item_mime_idx'), models.Index(fields=['public_key', 'size'], name='explorer_item_size_idx'), models.Index(fields=['public_key', 'modified'], name='explorer_item_modified_idx')],
+                'constraints': [models.UniqueConstraint(fields=('public_key', 'path'), name='explorer_item_key_path_uniq')],
+            },
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
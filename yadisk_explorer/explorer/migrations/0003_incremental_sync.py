@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0002_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexedshare',
+            name='root_modified',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexedshare',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='IndexChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_key', models.CharField(max_length=255)),
+                ('path', models.CharField(max_length=1024)),
+                ('kind', models.CharField(choices=[('added', 'added'), ('removed', 'removed'), ('changed', 'changed')], max_length=8)),
+                ('detected_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['public_key', 'detected_at'], name='explorer_change_key_date_idx')],
+            },
+        ),
+    ]
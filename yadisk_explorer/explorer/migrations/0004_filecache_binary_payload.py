@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+def clear_cache(apps, schema_editor):
+    # Содержимое кэша перезаписывается в новом формате при следующих запросах
+    apps.get_model('explorer', 'FileCache').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0003_incremental_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_cache, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='filecache',
+            name='data',
+        ),
+        migrations.AddField(
+            model_name='filecache',
+            name='payload',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='filecache',
+            name='encoding',
+            field=models.CharField(choices=[('json', 'json'), ('zlib', 'zlib'), ('zstd', 'zstd')], default='json', max_length=4),
+        ),
+        migrations.AddIndex(
+            model_name='filecache',
+            index=models.Index(fields=['expires_at'], name='explorer_cache_expires_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0004_filecache_binary_payload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FolderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_key', models.CharField(max_length=255)),
+                ('path', models.CharField(max_length=1024)),
+                ('file_count', models.PositiveIntegerField(default=0)),
+                ('dir_count', models.PositiveIntegerField(default=0)),
+                ('total_size', models.BigIntegerField(default=0)),
+                ('oldest_modified', models.DateTimeField(blank=True, null=True)),
+                ('newest_modified', models.DateTimeField(blank=True, null=True)),
+                ('mime_types', models.JSONField(default=dict)),
+                ('media_types', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('public_key', 'path'), name='explorer_stats_key_path_uniq')],
+            },
+        ),
+    ]
@@ -1,30 +1,197 @@
+import json
+import logging
+import zlib
+
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from datetime import timedelta
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Ошибки разбора повреждённой записи FileCache
+DECODE_ERRORS = (ValueError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
 
 class FileCache(models.Model):
+    """Запись кэша в БД: JSON, при большом размере — сжатый zlib или zstd"""
+    RAW = 'json'
+    ZLIB = 'zlib'
+    ZSTD = 'zstd'
+    ENCODING_CHOICES = [(RAW, 'json'), (ZLIB, 'zlib'), (ZSTD, 'zstd')]
+
     cache_key = models.CharField(max_length=255, unique=True)
-    data = models.JSONField()
+    payload = models.BinaryField()
+    encoding = models.CharField(max_length=4, choices=ENCODING_CHOICES, default=RAW)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='explorer_cache_expires_idx'),
+        ]
+
     @classmethod
     def set(cls, key, value, ttl=3600):
-        expires_at = timezone.now() + timedelta(seconds=ttl)
-        cls.objects.update_or_create(
+        """Сохраняет значение одним INSERT ... ON CONFLICT DO UPDATE"""
+        payload, encoding = cls.encode(value)
+        entry = cls(
             cache_key=key,
-            defaults={'data': value, 'expires_at': expires_at}
+            payload=payload,
+            encoding=encoding,
+            expires_at=timezone.now() + timedelta(seconds=ttl),
+        )
+        cls.objects.bulk_create(
+            [entry],
+            update_conflicts=True,
+            unique_fields=['cache_key'],
+            update_fields=['payload', 'encoding', 'expires_at'],
         )
 
     @classmethod
-    def get(cls, key):
+    def get(cls, key, include_expired=False):
+        """Значение по ключу; include_expired — в том числе истёкшее, но ещё не удалённое.
+
+        Повреждённая запись удаляется, чтобы её перезаписал следующий промах.
+        """
+        entries = cls.objects.filter(cache_key=key)
+        if not include_expired:
+            entries = entries.filter(expires_at__gt=timezone.now())
+        row = entries.values_list('id', 'payload', 'encoding').first()
+        if row is None:
+            return None
+        entry_id, payload, encoding = row
         try:
-            entry = cls.objects.get(cache_key=key, expires_at__gt=timezone.now())
-            return entry.data
-        except cls.DoesNotExist:
+            return cls.decode(payload, encoding)
+        except DECODE_ERRORS as e:
+            logger.warning(f"Unreadable cache entry {key}, deleting: {e}")
+            cls.objects.filter(id=entry_id).delete()
             return None
 
     @classmethod
-    def clear_expired(cls):
-        cls.objects.filter(expires_at__lte=timezone.now()).delete()
\ No newline at end of file
+    def clear_expired(cls, batch_size=1000):
+        """Удаляет истёкшие записи пачками по batch_size, возвращает их число"""
+        now = timezone.now()
+        deleted = 0
+        while True:
+            ids = list(cls.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            cls.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+            if len(ids) < batch_size:
+                return deleted
+
+    @classmethod
+    def encode(cls, value):
+        """(байты, кодировка) для значения; сжимаются только большие значения"""
+        raw = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(raw) < getattr(settings, 'FILE_CACHE_COMPRESS_MIN_SIZE', 4096):
+            return raw, cls.RAW
+
+        compression = getattr(settings, 'FILE_CACHE_COMPRESSION', cls.ZLIB)
+        if compression == cls.ZSTD and zstandard is not None:
+            return zstandard.ZstdCompressor().compress(raw), cls.ZSTD
+        if compression in (cls.ZLIB, cls.ZSTD):
+            return zlib.compress(raw, 6), cls.ZLIB
+        return raw, cls.RAW
+
+    @classmethod
+    def decode(cls, payload, encoding):
+        payload = bytes(payload)
+        if encoding == cls.ZLIB:
+            payload = zlib.decompress(payload)
+        elif encoding == cls.ZSTD:
+            if zstandard is None:
+                raise ValueError("zstandard is not installed")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        return json.loads(payload)
+
+
+class IndexedShare(models.Model):
+    """Публичная папка, обойдённая и сохранённая в локальный поисковый индекс"""
+    public_key = models.CharField(max_length=255, unique=True)
+    item_count = models.PositiveIntegerField(default=0)
+    crawled_at = models.DateTimeField(null=True, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+    root_modified = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class IndexedItem(models.Model):
+    """Файл или папка из листинга публичной папки"""
+    public_key = models.CharField(max_length=255)
+    path = models.CharField(max_length=1024)
+    parent = models.CharField(max_length=1024)
+    name = models.CharField(max_length=255)
+    type = models.CharField(max_length=8)
+    mime_type = models.CharField(max_length=255, blank=True, default='')
+    media_type = models.CharField(max_length=64, blank=True, default='')
+    size = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(null=True, blank=True)
+    md5 = models.CharField(max_length=32, blank=True, default='')
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['public_key', 'path'], name='explorer_item_key_path_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['public_key', 'parent'], name='explorer_item_parent_idx'),
+            models.Index(fields=['public_key', 'name'], name='explorer_item_name_idx'),
+            models.Index(fields=['public_key', 'mime_type'], name='explorer_item_mime_idx'),
+            models.Index(fields=['public_key', 'size'], name='explorer_item_size_idx'),
+            models.Index(fields=['public_key', 'modified'], name='explorer_item_modified_idx'),
+        ]
+
+
+class IndexChange(models.Model):
+    """Изменение в папке, обнаруженное при инкрементальной синхронизации"""
+    ADDED = 'added'
+    REMOVED = 'removed'
+    CHANGED = 'changed'
+    KIND_CHOICES = [(ADDED, 'added'), (REMOVED, 'removed'), (CHANGED, 'changed')]
+
+    public_key = models.CharField(max_length=255)
+    path = models.CharField(max_length=1024)
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    detected_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['public_key', 'detected_at'], name='explorer_change_key_date_idx'),
+        ]
+
+
+class FolderStats(models.Model):
+    """Сводка по поддереву папки из индекса: файлы, папки, размер, даты.
+
+    Считается при обходе и синхронизации (explorer.stats), поэтому
+    отдаётся одним запросом по (public_key, path) без обхода дерева.
+    mime_types и media_types — {тип: {"count": N, "size": байты}}.
+    """
+    public_key = models.CharField(max_length=255)
+    path = models.CharField(max_length=1024)
+    file_count = models.PositiveIntegerField(default=0)
+    dir_count = models.PositiveIntegerField(default=0)
+    total_size = models.BigIntegerField(default=0)
+    oldest_modified = models.DateTimeField(null=True, blank=True)
+    newest_modified = models.DateTimeField(null=True, blank=True)
+    mime_types = models.JSONField(default=dict)
+    media_types = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['public_key', 'path'], name='explorer_stats_key_path_uniq'),
+        ]
+
+    @property
+    def top_media_types(self):
+        """Пять самых объёмных media_type: [(тип, {"count", "size"})]"""
+        return sorted(self.media_types.items(), key=lambda entry: entry[1]['size'], reverse=True)[:5]
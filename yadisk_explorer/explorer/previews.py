@@ -0,0 +1,131 @@
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+
+from .blob_cache import BlobCache
+from .client import yandex_client
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Размеры превью, которые принимает API: буквенные или ШИРИНАxВЫСОТА
+SIZE_RE = re.compile(r'S|M|L|XL|XXL|XXXL|\d{1,4}x\d{0,4}|x\d{1,4}')
+KEY_RE = re.compile(r'[0-9a-f]{32}-(?:' + SIZE_RE.pattern + ')')
+
+# Сигнатуры форматов, в которых API отдаёт превью
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG', 'image/png'),
+    (b'GIF8', 'image/gif'),
+)
+
+
+class PreviewCache:
+    """Превью файлов, скачанные сервером и сохранённые на диск по md5 и размеру.
+
+    Ссылки на превью из ответа API живут недолго и требуют запроса из
+    браузера к Яндексу на каждую картинку; здесь превью скачиваются один раз
+    через общий пул соединений. Одновременные запросы одного превью
+    (в том числе фоновая предзагрузка) объединяются в один.
+    """
+
+    def __init__(self, store=None, workers=None):
+        self.store = store or BlobCache(
+            root=getattr(settings, 'PREVIEW_CACHE_DIR', settings.BASE_DIR / 'preview_cache'),
+            max_bytes=getattr(settings, 'PREVIEW_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+            max_file_size=getattr(settings, 'PREVIEW_MAX_FILE_SIZE', 2 * 1024 * 1024),
+            key_re=KEY_RE,
+        )
+        self.workers = workers or getattr(settings, 'PREVIEW_PREFETCH_WORKERS', 8)
+        self._flight = SingleFlight()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def key_for(self, md5, size):
+        """Ключ превью или None для некорректных md5 и размера"""
+        key = f'{md5}-{size}'
+        return key if KEY_RE.fullmatch(key) else None
+
+    def get(self, md5, size):
+        """Путь к превью в кэше или None"""
+        key = self.key_for(md5, size)
+        return self.store.get(key) if key else None
+
+    def fetch(self, md5, size, url, token=None):
+        """Скачивает превью по ссылке API в кэш (если его там нет) и возвращает путь"""
+        key = self.key_for(md5, size)
+        if key is None:
+            raise ValueError("Некорректные md5 или размер превью")
+        path, _ = self._flight.do(key, lambda: self.store.get(key) or self._download(key, url, token))
+        return path
+
+    def prefetch(self, items, token=None, size=None):
+        """Параллельно скачивает в фоне превью элементов страницы листинга.
+
+        Берутся только файлы с md5 и ссылкой на превью нужного размера,
+        которых ещё нет в кэше. Возвращает список Future.
+        """
+        size = size or getattr(settings, 'PREVIEW_SIZE', 'S')
+        futures = []
+        for item in items:
+            md5, url = item.get('md5'), item.get('preview')
+            if not md5 or not url or preview_size(url) != size or self.get(md5, size) is not None:
+                continue
+            futures.append(self.executor.submit(self._prefetch_one, md5, size, url, token))
+        return futures
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='preview')
+        return self._executor
+
+    def _prefetch_one(self, md5, size, url, token):
+        try:
+            return self.fetch(md5, size, url, token)
+        except Exception as e:
+            logger.warning(f"Preview prefetch failed for {md5}: {e}")
+            return None
+
+    def _download(self, key, url, token):
+        response = yandex_client.open_download(url, token=token)
+        writer = self.store.writer(key, verify=False)
+        try:
+            if response.status_code != 200:
+                raise ValueError(f"Превью недоступно ({response.status_code})")
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                writer.write(chunk)
+            writer.commit()
+        finally:
+            writer.abort()
+            response.close()
+        path = self.store.get(key)
+        if path is None:
+            raise ValueError("Превью слишком большое для кэша")
+        return path
+
+
+def preview_size(url):
+    """Размер превью из ссылки API (параметр size), по умолчанию S"""
+    return parse_qs(urlparse(url).query).get('size', ['S'])[0]
+
+
+def image_content_type(path):
+    """Content-Type превью по первым байтам файла"""
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return 'application/octet-stream'
+
+
+preview_cache = PreviewCache()
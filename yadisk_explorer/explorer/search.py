@@ -0,0 +1,177 @@
+import logging
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import stats
+from .models import IndexedItem, IndexedShare
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'explorer_indexeditem_fts'
+BATCH_SIZE = 500
+UPDATE_FIELDS = ['parent', 'name', 'type', 'mime_type', 'media_type', 'size', 'modified', 'md5', 'indexed_at']
+
+
+def make_item(public_key, item, parent):
+    """IndexedItem из элемента ответа API (или записи индекса AsyncCrawler)"""
+    return IndexedItem(
+        public_key=public_key,
+        path=item['path'],
+        parent=parent,
+        name=item['name'],
+        type=item['type'],
+        mime_type=item.get('mime_type') or '',
+        media_type=item.get('media_type') or '',
+        size=item.get('size') or 0,
+        modified=parse_datetime(item['modified']) if item.get('modified') else None,
+        md5=item.get('md5') or '',
+        indexed_at=timezone.now(),
+    )
+
+
+def index_listing(public_key, data):
+    """Добавляет в индекс элементы одной страницы ответа API листинга.
+
+    Если страница содержит папку целиком, её дети, которых в ответе нет
+    (удалённые или переименованные на Диске), убираются из индекса вместе
+    с поддеревьями. Вызывается только при реальном запросе к API, поэтому
+    попадания в кэш листингов индекс не трогают. Ошибки БД не прерывают
+    запрос пользователя.
+
+    Индекс обойдённых папок (IndexedShare) ведут только index_crawl и
+    ShareSyncer: это снимок, с которым сверяется синхронизация, и правка его
+    из просмотра скрыла бы от неё изменения.
+    """
+    embedded = data.get('_embedded', {})
+    items = embedded.get('items', [])
+    total = embedded.get('total')
+    complete = not embedded.get('offset') and total is not None and len(items) >= total
+    if not items and not complete:
+        return
+    parent = data.get('path') or embedded.get('path') or '/'
+    try:
+        if IndexedShare.objects.filter(public_key=public_key).exists():
+            return
+        with transaction.atomic():
+            if complete:
+                _prune_children(public_key, parent, {item['path'] for item in items})
+            upsert_items([make_item(public_key, item, parent) for item in items])
+    except DatabaseError as e:
+        logger.warning(f"Search index update failed for {public_key}: {e}")
+
+
+def _prune_children(public_key, parent, keep):
+    """Удаляет из индекса детей папки parent, которых нет в keep, с их поддеревьями"""
+    children = IndexedItem.objects.filter(public_key=public_key, parent=parent)
+    gone = [(path, type) for path, type in children.values_list('path', 'type') if path not in keep]
+    if not gone:
+        return
+    condition = Q(path__in=[path for path, _ in gone])
+    for path, type in gone:
+        if type == 'dir':
+            condition |= subtree_q(path)
+    IndexedItem.objects.filter(public_key=public_key).filter(condition).delete()
+
+
+def index_crawl(public_key, index):
+    """Заменяет индекс папки результатом полного обхода (AsyncCrawler.crawl)
+    и пересчитывает сводки по всем её папкам"""
+    items = [
+        make_item(public_key, dict(entry, path=path), entry['parent'])
+        for path, entry in index.items()
+    ]
+    with transaction.atomic():
+        IndexedItem.objects.filter(public_key=public_key).delete()
+        IndexedItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+        stats.rebuild(public_key, (
+            (item.path, item.parent, item.type, item.size, item.modified, item.mime_type, item.media_type)
+            for item in items
+        ))
+        IndexedShare.objects.update_or_create(
+            public_key=public_key,
+            defaults={'item_count': len(items), 'crawled_at': timezone.now()},
+        )
+    return len(items)
+
+
+def search(public_key, query=None, type=None, mime_type=None, media_type=None,
+           min_size=None, max_size=None, modified_after=None, modified_before=None,
+           path_prefix=None, limit=100):
+    """Поиск по индексу одной публичной папки; все условия объединяются через И"""
+    items = IndexedItem.objects.filter(public_key=public_key)
+
+    if query:
+        items = _match_name(items, query)
+    if type:
+        items = items.filter(type=type)
+    if mime_type:
+        # "image/" — все изображения, "image/png" — точное совпадение
+        if mime_type.endswith('/'):
+            items = items.filter(mime_type__startswith=mime_type)
+        else:
+            items = items.filter(mime_type=mime_type)
+    if media_type:
+        items = items.filter(media_type=media_type)
+    if min_size is not None:
+        items = items.filter(size__gte=min_size)
+    if max_size is not None:
+        items = items.filter(size__lte=max_size)
+    if modified_after is not None:
+        items = items.filter(modified__gte=modified_after)
+    if modified_before is not None:
+        items = items.filter(modified__lt=modified_before)
+    if path_prefix and path_prefix != '/':
+        items = items.filter(subtree_q(path_prefix))
+
+    return items.order_by('path')[:limit]
+
+
+def file_md5(public_key, path):
+    """md5 файла по индексу или '', если файл не проиндексирован"""
+    md5 = IndexedItem.objects.filter(public_key=public_key, path=path, type='file').values_list('md5', flat=True).first()
+    return md5 or ''
+
+
+def subtree_q(path):
+    """Условие «путь лежит внутри папки path».
+
+    Диапазон по пути вместо LIKE, чтобы использовался индекс (public_key, path).
+    """
+    prefix = path.rstrip('/') + '/'
+    return Q(path__gte=prefix, path__lt=prefix[:-1] + chr(ord('/') + 1))
+
+
+def _match_name(items, query):
+    if connection.vendor == 'sqlite' and _has_fts():
+        # Каждое слово запроса — префиксный поиск по токенам имени
+        terms = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in query.split())
+        return items.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [terms]
+        ))
+    return items.filter(name__icontains=query)
+
+
+_fts_available = {}
+
+
+def _has_fts():
+    # Проверяем наличие таблицы один раз на алиас БД
+    if connection.alias not in _fts_available:
+        with connection.cursor() as cursor:
+            _fts_available[connection.alias] = FTS_TABLE in connection.introspection.table_names(cursor)
+    return _fts_available[connection.alias]
+
+
+def upsert_items(items):
+    """Вставляет элементы или обновляет существующие по (public_key, path)"""
+    IndexedItem.objects.bulk_create(
+        items,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['public_key', 'path'],
+        update_fields=UPDATE_FIELDS,
+    )
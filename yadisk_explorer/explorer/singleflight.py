@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один.
+
+    Первый вызов (лидер) выполняет функцию, остальные ждут его и получают
+    тот же результат или то же исключение. Синхронные вызовы объединяются
+    между потоками процесса, асинхронные — в пределах цикла событий.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+
+    def do(self, key, fn):
+        """Выполняет fn() один раз на ключ; возвращает (результат, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def ado(self, key, afn):
+        """Асинхронный вариант do(): afn — корутинная функция.
+
+        Вызов выполняется отдельной задачей, поэтому отмена запроса лидера
+        не прерывает ожидающих.
+        """
+        task_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            shared = task is not None
+            if not shared:
+                task = self._tasks[task_key] = asyncio.ensure_future(afn())
+                task.add_done_callback(lambda _: self._forget(task_key))
+        return await asyncio.shield(task), shared
+
+    def _forget(self, task_key):
+        with self._lock:
+            self._tasks.pop(task_key, None)
+
+
+class ProcessLock:
+    """Межпроцессная блокировка по ключу на файлах (flock).
+
+    Включается настройкой SINGLE_FLIGHT_LOCK_DIR; без неё и на платформах
+    без fcntl ничего не блокирует. Если блокировку не удалось получить за
+    SINGLE_FLIGHT_LOCK_TIMEOUT секунд, работа продолжается без неё.
+
+    Файл блокировки называется по полному хэшу ключа, так что разные ключи
+    друг друга не ждут. Файлы пустые и не удаляются (удаление файла под
+    flock ломает блокировку), их можно чистить вместе с перезапуском.
+    """
+
+    def __init__(self, key, lock_dir=None, timeout=None):
+        lock_dir = lock_dir or getattr(settings, 'SINGLE_FLIGHT_LOCK_DIR', None)
+        self.timeout = timeout if timeout is not None else getattr(settings, 'SINGLE_FLIGHT_LOCK_TIMEOUT', 15)
+        self.path = None
+        if lock_dir and fcntl is not None:
+            digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+            self.path = Path(lock_dir) / digest[:2] / f'{digest}.lock'
+        self._file = None
+        self.locked = False
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def acquire(self):
+        """Ждёт блокировку не дольше timeout секунд; возвращает locked"""
+        if self.enabled and not self.locked:
+            deadline = time.monotonic() + self.timeout
+            while not self._try_acquire() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        return self.locked
+
+    async def __aenter__(self):
+        if self.enabled:
+            deadline = time.monotonic() + self.timeout
+            while not self._try_acquire() and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def _try_acquire(self):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, 'a+b')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.locked = True
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if self.locked:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self.locked = False
+        self._file.close()
+        self._file = None
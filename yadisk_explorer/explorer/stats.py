@@ -0,0 +1,256 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from . import search
+from .cache import LRUCache
+from .models import FolderStats, IndexedItem
+
+ROOT = '/'
+ROW_FIELDS = ('path', 'parent', 'type', 'size', 'modified', 'mime_type', 'media_type')
+UPDATE_FIELDS = [
+    'file_count', 'dir_count', 'total_size', 'oldest_modified', 'newest_modified',
+    'mime_types', 'media_types', 'updated_at',
+]
+
+# Недавно прочитанные сводки (в том числе их отсутствие), чтобы листинг
+# папки не обращался к БД. Пересчёт в этом процессе сбрасывает их сразу,
+# в других процессах они обновятся через FOLDER_STATS_CACHE_TTL секунд
+memo = LRUCache(max_entries=getattr(settings, 'FOLDER_STATS_CACHE_MAX_ENTRIES', 10000), max_bytes=None)
+
+
+class Aggregate:
+    """Сводка по поддереву папки (FolderStats в памяти).
+
+    Складывается из файлов и сводок подпапок, поэтому строится снизу вверх
+    за один проход по индексу, а при изменениях пересчитывается только
+    путь от изменённой папки до корня.
+    """
+
+    __slots__ = ('files', 'dirs', 'size', 'oldest', 'newest', 'mime_types', 'media_types')
+
+    def __init__(self):
+        self.files = 0
+        self.dirs = 0
+        self.size = 0
+        self.oldest = None
+        self.newest = None
+        self.mime_types = {}
+        self.media_types = {}
+
+    def add_file(self, size, modified, mime_type, media_type):
+        size = size or 0
+        self.files += 1
+        self.size += size
+        self._add_dates(modified, modified)
+        _add_type(self.mime_types, mime_type or 'unknown', 1, size)
+        _add_type(self.media_types, media_type or 'unknown', 1, size)
+
+    def add_dir(self):
+        self.dirs += 1
+
+    def merge(self, other):
+        """Добавляет сводку подпапки (саму подпапку учитывает add_dir)"""
+        self.files += other.files
+        self.dirs += other.dirs
+        self.size += other.size
+        self._add_dates(other.oldest, other.newest)
+        for counts, other_counts in ((self.mime_types, other.mime_types), (self.media_types, other.media_types)):
+            for name, entry in other_counts.items():
+                _add_type(counts, name, entry['count'], entry['size'])
+
+    @classmethod
+    def from_model(cls, stats):
+        aggregate = cls()
+        aggregate.files = stats.file_count
+        aggregate.dirs = stats.dir_count
+        aggregate.size = stats.total_size
+        aggregate.oldest = stats.oldest_modified
+        aggregate.newest = stats.newest_modified
+        aggregate.mime_types = stats.mime_types
+        aggregate.media_types = stats.media_types
+        return aggregate
+
+    def to_model(self, public_key, path):
+        return FolderStats(
+            public_key=public_key,
+            path=path,
+            file_count=self.files,
+            dir_count=self.dirs,
+            total_size=self.size,
+            oldest_modified=self.oldest,
+            newest_modified=self.newest,
+            mime_types=self.mime_types,
+            media_types=self.media_types,
+        )
+
+    def _add_dates(self, oldest, newest):
+        if oldest is not None and (self.oldest is None or oldest < self.oldest):
+            self.oldest = oldest
+        if newest is not None and (self.newest is None or newest > self.newest):
+            self.newest = newest
+
+
+def _add_type(counts, name, count, size):
+    entry = counts.get(name)
+    if entry is None:
+        counts[name] = {'count': count, 'size': size}
+    else:
+        entry['count'] += count
+        entry['size'] += size
+
+
+def normalize_path(path):
+    """Путь папки в виде индекса: без префикса disk: и завершающего /"""
+    if path.startswith('disk:'):
+        path = path[len('disk:'):]
+    return path.rstrip('/') or ROOT
+
+
+def ancestors(path):
+    """Папки, содержащие path: '/a/b/c' → ['/a/b', '/a', '/']"""
+    path = normalize_path(path)
+    if path == ROOT:
+        return []
+    parts = path.split('/')[1:-1]
+    return ['/' + '/'.join(parts[:i]) for i in range(len(parts), 0, -1)] + [ROOT]
+
+
+def _depth(path):
+    return path.count('/') if path != ROOT else 0
+
+
+def rebuild(public_key, rows=None):
+    """Пересчитывает сводки всех папок одной публичной папки.
+
+    rows — кортежи ROW_FIELDS; по умолчанию читаются из индекса.
+    Возвращает число сохранённых сводок.
+    """
+    if rows is None:
+        rows = IndexedItem.objects.filter(public_key=public_key).values_list(*ROW_FIELDS).iterator(chunk_size=2000)
+
+    own = defaultdict(Aggregate)
+    parents = {}
+    for path, parent, type, size, modified, mime_type, media_type in rows:
+        parent = normalize_path(parent)
+        if type == 'dir':
+            parents[path] = parent
+            own[parent].add_dir()
+        else:
+            own[parent].add_file(size, modified, mime_type, media_type)
+    # Пустые папки и корень тоже получают сводку
+    for path in (ROOT, *parents):
+        own.setdefault(path, Aggregate())
+
+    # Снизу вверх: к моменту слияния в родителя сводка папки уже полная
+    for path in sorted(parents, key=_depth, reverse=True):
+        own[parents[path]].merge(own[path])
+
+    FolderStats.objects.filter(public_key=public_key).delete()
+    FolderStats.objects.bulk_create(
+        [aggregate.to_model(public_key, path) for path, aggregate in own.items()],
+        batch_size=search.BATCH_SIZE,
+    )
+    transaction.on_commit(memo.clear)
+    return len(own)
+
+
+def update(public_key, changed, removed=()):
+    """Пересчитывает сводки после синхронизации.
+
+    changed — добавленные и изменённые пути, removed — удалённые (индекс
+    уже обновлён). Сводки удалённых поддеревьев удаляются, а пересчитываются
+    только изменённые папки и папки на пути к изменениям, от глубоких к
+    корню: каждая — по прямым потомкам и уже готовым сводкам подпапок.
+    """
+    for path in removed:
+        FolderStats.objects.filter(search.subtree_q(path) | Q(path=path), public_key=public_key).delete()
+
+    paths = {ROOT}
+    for path in (*changed, *removed):
+        paths.update(ancestors(path))
+    paths.update(changed)
+    # Пересчитываются только папки, оставшиеся в индексе (изменённые
+    # папки — сами, изменённые файлы — через родителей)
+    candidates = {ROOT}
+    candidates.update(IndexedItem.objects.filter(
+        public_key=public_key, path__in=list(paths), type='dir',
+    ).values_list('path', flat=True))
+
+    computed = {}
+    for folder in sorted(candidates, key=_depth, reverse=True):
+        computed[folder] = _folder_aggregate(public_key, folder, computed)
+
+    FolderStats.objects.bulk_create(
+        [aggregate.to_model(public_key, path) for path, aggregate in computed.items()],
+        batch_size=search.BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['public_key', 'path'],
+        update_fields=UPDATE_FIELDS,
+    )
+    transaction.on_commit(memo.clear)
+    return len(computed)
+
+
+def _folder_aggregate(public_key, folder, computed):
+    """Сводка папки по прямым потомкам; сводки подпапок — из computed или БД"""
+    aggregate = Aggregate()
+    subdirs = []
+    children = IndexedItem.objects.filter(public_key=public_key, parent=folder).values_list(*ROW_FIELDS)
+    for path, _, type, size, modified, mime_type, media_type in children:
+        if type == 'dir':
+            aggregate.add_dir()
+            if path in computed:
+                aggregate.merge(computed[path])
+            else:
+                subdirs.append(path)
+        else:
+            aggregate.add_file(size, modified, mime_type, media_type)
+
+    if subdirs:
+        for stats in FolderStats.objects.filter(public_key=public_key, path__in=subdirs):
+            aggregate.merge(Aggregate.from_model(stats))
+    return aggregate
+
+
+def get_stats(public_key, path):
+    """Сводка папки или None, если папка не проиндексирована"""
+    key = (public_key, normalize_path(path))
+    entry = memo.get(key)
+    if entry is None:
+        entry = (FolderStats.objects.filter(public_key=public_key, path=key[1]).first(),)
+        _remember(key, entry)
+    return entry[0]
+
+
+async def aget_stats(public_key, path):
+    key = (public_key, normalize_path(path))
+    entry = memo.get(key)
+    if entry is None:
+        entry = (await FolderStats.objects.filter(public_key=public_key, path=key[1]).afirst(),)
+        _remember(key, entry)
+    return entry[0]
+
+
+def _remember(key, entry):
+    # Кортеж, чтобы отличить закэшированное «сводки нет» от промаха
+    memo.set(key, entry, getattr(settings, 'FOLDER_STATS_CACHE_TTL', 30))
+
+
+def serialize(stats):
+    """Сводка для JSON API"""
+    if stats is None:
+        return None
+    return {
+        'path': stats.path,
+        'file_count': stats.file_count,
+        'dir_count': stats.dir_count,
+        'total_size': stats.total_size,
+        'oldest_modified': stats.oldest_modified.isoformat() if stats.oldest_modified else None,
+        'newest_modified': stats.newest_modified.isoformat() if stats.newest_modified else None,
+        'mime_types': stats.mime_types,
+        'media_types': stats.media_types,
+        'updated_at': stats.updated_at.isoformat(),
+    }
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import search, stats
+from .crawler import AsyncCrawler
+from .models import FolderStats, IndexChange, IndexedItem, IndexedShare
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SyncResult:
+    public_key: str
+    added: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    api_calls: int = 0
+    # Новые и изменённые IndexedItem, которые нужно записать в индекс
+    upserts: list = field(default_factory=list, repr=False)
+
+    @property
+    def has_changes(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+class ShareSyncer:
+    """Инкрементальная синхронизация индекса публичной папки с API.
+
+    Сохранённый снимок (IndexedItem) сравнивается с текущими листингами:
+    файлы — по md5 и modified, папки — по modified. Папка с прежним
+    modified считается неизменной и повторно не запрашивается, так что
+    число запросов пропорционально числу изменённых папок, а не размеру
+    дерева. Найденные изменения пишутся в IndexChange.
+
+    Снимком считается только индекс, построенный index_crawl или прошлой
+    синхронизацией. Строки, добавленные просмотром папки, которая ещё не
+    обойдена, снимком не являются: первая синхронизация такой папки обходит
+    её целиком и заменяет их.
+    """
+
+    def __init__(self, crawler=None):
+        self.crawler = crawler or AsyncCrawler()
+
+    def sync(self, public_key):
+        """Синхронная обёртка над async_sync()"""
+        return self.crawler.run(self.async_sync(public_key))
+
+    async def async_sync(self, public_key):
+        share = await IndexedShare.objects.filter(public_key=public_key).afirst()
+        if share is not None:
+            snapshot = await self._load_snapshot(public_key)
+        else:
+            snapshot = {'items': {}, 'children': {}}
+        result = SyncResult(public_key)
+        self.crawler.start()
+        calls_before = self.crawler.api_calls
+
+        root = await self._sync_root(public_key, share, snapshot, result)
+
+        result.api_calls = self.crawler.api_calls - calls_before
+        await sync_to_async(self._save)(public_key, root, result, replace=share is None)
+        return result
+
+    async def _sync_root(self, public_key, share, snapshot, result):
+        data, items = await self.crawler.fetch_dir(public_key, '/')
+        root_modified = parse_datetime(data['modified']) if data.get('modified') else None
+
+        if share is not None and snapshot and share.root_modified and share.root_modified == root_modified:
+            return root_modified
+
+        await self._sync_dir(public_key, '/', items, snapshot, result)
+        return root_modified
+
+    async def _sync_dir(self, public_key, path, items, snapshot, result):
+        stored_children = snapshot['children'].get(path, set())
+        descend = []
+
+        for item in items:
+            stored = snapshot['items'].get(item['path'])
+            modified = parse_datetime(item['modified']) if item.get('modified') else None
+
+            if stored is None:
+                result.added.append(item['path'])
+                result.upserts.append(search.make_item(public_key, item, path))
+                if item['type'] == 'dir':
+                    descend.append(item['path'])
+                continue
+
+            stored_type, stored_md5, stored_modified = stored
+            if item['type'] != stored_type:
+                changed = True
+            elif item['type'] == 'file':
+                changed = (item.get('md5') or '') != stored_md5 or modified != stored_modified
+            else:
+                changed = modified != stored_modified
+
+            if changed and stored_type == 'dir' and item['type'] != 'dir':
+                # Папку заменили файлом: старое поддерево удаляем
+                result.removed.append(item['path'])
+            if changed:
+                result.changed.append(item['path'])
+                result.upserts.append(search.make_item(public_key, item, path))
+                if item['type'] == 'dir':
+                    descend.append(item['path'])
+
+        current = {item['path'] for item in items}
+        result.removed.extend(sorted(stored_children - current))
+
+        await asyncio.gather(*(
+            self._sync_subdir(public_key, subdir, snapshot, result) for subdir in descend
+        ))
+
+    async def _sync_subdir(self, public_key, path, snapshot, result):
+        _, items = await self.crawler.fetch_dir(public_key, path)
+        await self._sync_dir(public_key, path, items, snapshot, result)
+
+    async def _load_snapshot(self, public_key):
+        items = {}
+        children = defaultdict(set)
+        rows = IndexedItem.objects.filter(public_key=public_key).values_list(
+            'path', 'parent', 'type', 'md5', 'modified'
+        )
+        async for path, parent, type, md5, modified in rows:
+            items[path] = (type, md5, modified)
+            children[parent].add(path)
+        return {'items': items, 'children': children}
+
+    def _save(self, public_key, root_modified, result, replace=False):
+        now = timezone.now()
+        with transaction.atomic():
+            if replace:
+                IndexedItem.objects.filter(public_key=public_key).delete()
+            for path in result.removed:
+                # Сам элемент и всё его поддерево
+                IndexedItem.objects.filter(
+                    Q(path=path) | search.subtree_q(path), public_key=public_key
+                ).delete()
+
+            if result.upserts:
+                search.upsert_items(result.upserts)
+
+            # Сводки по папкам: при первой синхронизации строятся целиком,
+            # дальше пересчитываются только папки на пути к изменениям
+            if not FolderStats.objects.filter(public_key=public_key).exists():
+                stats.rebuild(public_key)
+            elif result.has_changes:
+                stats.update(public_key, result.added + result.changed, result.removed)
+
+            IndexChange.objects.bulk_create([
+                IndexChange(public_key=public_key, path=path, kind=kind)
+                for kind, paths in (
+                    (IndexChange.ADDED, result.added),
+                    (IndexChange.REMOVED, result.removed),
+                    (IndexChange.CHANGED, result.changed),
+                )
+                for path in paths
+            ], batch_size=search.BATCH_SIZE)
+
+            IndexedShare.objects.update_or_create(
+                public_key=public_key,
+                defaults={
+                    'item_count': IndexedItem.objects.filter(public_key=public_key).count(),
+                    'root_modified': root_modified,
+                    'synced_at': now,
+                },
+            )
+        logger.info(
+            f"Synced {public_key}: +{len(result.added)} -{len(result.removed)} "
+            f"~{len(result.changed)} in {result.api_calls} API calls"
+        )
@@ -1,3 +1,2689 @@
-from django.test import TestCase
+"""Тесты explorer и бенчмарки на локальной имитации API Яндекс.Диска.
 
-# Create your tests here.
+FakeDisk подключается к пулу соединений yandex_client как транспорт
+requests и отвечает на public/resources и public/resources/download
+(а также на сами ссылки скачивания) без сети: размер и глубина дерева,
+задержка и доля ошибок задаются параметрами.
+
+Бенчмарки печатают результаты в stderr, а их проверки ловят регрессии
+вроде буферизации файла целиком. Они долгие и зависят от скорости машины,
+поэтому по умолчанию пропускаются.
+
+Запуск бенчмарков: EXPLORER_BENCHMARKS=1 python manage.py test explorer --tag benchmark
+Масштаб (размеры папок и файлов, число запросов): EXPLORER_BENCH_SCALE=4
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import re
+import runpy
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, quote, urlparse
+
+import httpx
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory, Client, RequestFactory, SimpleTestCase, TransactionTestCase, override_settings, tag,
+)
+from django.test.utils import CaptureQueriesContext
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import search, stats
+from .async_views import AsyncDownloadView, AsyncIndexView
+from .auth import EXPIRES_KEY, REFRESH_TOKEN_KEY, TOKEN_KEY, TokenRefreshMiddleware, _user_info
+from .blob_cache import BlobCache
+from .cache import LRUCache, ListingCache, download_link_cache, listing_cache, preview_link_cache
+from .client import (
+    BASE_API_URL, DOWNLOAD_API_URL, AsyncYandexClient, YandexClient, async_yandex_client, yandex_client,
+)
+from .crawler import AsyncCrawler
+from .exceptions import AuthenticationFailed, ResourceNotFound, UpstreamUnavailable
+from .listing import FolderLister, ListingFilter, Row, sort_passes
+from .metrics import Registry, RequestMetrics, log_sampled
+from .models import FileCache, FolderStats, IndexChange, IndexedItem, IndexedShare
+from .previews import KEY_RE, PreviewCache
+from .search import index_crawl
+from .singleflight import ProcessLock, SingleFlight
+from .sync import ShareSyncer
+from .throttle import CircuitBreaker, RateLimiter
+from .views import DownloadView, IndexView, PreviewView, YandexDiskView
+from .warmup import CacheWarmer, start_scheduler
+from .zipstream import stream_zip
+
+BENCHMARKS = os.getenv('EXPLORER_BENCHMARKS', '').lower() in ('1', 'true', 'yes')
+SCALE = float(os.getenv('EXPLORER_BENCH_SCALE', '1'))
+DOWNLOAD_HOST = 'https://downloader.disk.test'
+MB = 1024 * 1024
+
+
+class _ZeroStream(io.RawIOBase):
+    """Тело ответа заданного размера, генерируемое по мере чтения"""
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.remaining)
+        buffer[:n] = bytes(n)
+        self.remaining -= n
+        return n
+
+
+class FakeDisk(BaseAdapter):
+    """Имитация публичной папки Яндекс.Диска для транспорта requests.
+
+    В каждой папке files_per_folder файлов и, пока не достигнута depth,
+    folders_per_folder подпапок. Каждый запрос ждёт latency секунд и с
+    вероятностью error_rate получает 503 с Retry-After: 0.
+    """
+
+    ETAG = '"fake-etag"'
+    PREVIEW = b'\x89PNG\r\n\x1a\n' + bytes(100)
+
+    def __init__(self, files_per_folder=100, folders_per_folder=0, depth=0, file_size=1024,
+                 latency=0.0, error_rate=0.0, seed=0):
+        super().__init__()
+        self.files_per_folder = files_per_folder
+        self.folders_per_folder = folders_per_folder
+        self.depth = depth
+        self.file_size = file_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = {'listing': 0, 'download_link': 0, 'download': 0, 'preview': 0, 'error': 0}
+        # Заголовки запросов к ссылкам скачивания (Range, If-Range)
+        self.download_headers = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def install(self):
+        session = yandex_client.session
+        session.mount(BASE_API_URL, self)
+        session.mount(DOWNLOAD_HOST, self)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        url = urlparse(request.url)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if failed:
+                self.calls['error'] += 1
+        if failed:
+            return self._json(request, 503, {'message': 'Service unavailable'}, {'Retry-After': '0'})
+
+        if request.url.startswith(f'{DOWNLOAD_HOST}/preview/'):
+            self._count('preview')
+            return self._response(request, 200, io.BytesIO(self.PREVIEW), {'Content-Type': 'image/png'})
+        if request.url.startswith(DOWNLOAD_HOST):
+            self._count('download')
+            self.download_headers.append(dict(request.headers))
+            return self._download(request, int(params.get('size', self.file_size)))
+        if request.url.startswith(DOWNLOAD_API_URL):
+            self._count('download_link')
+            href = f"{DOWNLOAD_HOST}{quote(params['path'])}?size={self.file_size}"
+            return self._json(request, 200, {'href': href, 'method': 'GET'})
+
+        self._count('listing')
+        return self._listing(request, params)
+
+    def close(self):
+        pass
+
+    def httpx_transport(self):
+        """Тот же FakeDisk как транспорт httpx для AsyncYandexClient"""
+        def handle(request):
+            prepared = requests.Request(request.method, str(request.url), headers=dict(request.headers)).prepare()
+            response = self.send(prepared)
+            return httpx.Response(response.status_code, headers=dict(response.headers), content=response.raw.read())
+
+        return httpx.MockTransport(handle)
+
+    def walk_size(self):
+        """Число элементов во всём дереве"""
+        dirs = sum(self.folders_per_folder ** level for level in range(self.depth + 1))
+        return dirs * self.files_per_folder + dirs - 1
+
+    def _listing(self, request, params):
+        if params.get('public_key') == 'missing':
+            return self._json(request, 404, {'message': 'Не удалось найти запрошенный ресурс.'})
+
+        path = params.get('path', '/')
+        if path.startswith('disk:'):
+            path = path[len('disk:'):]
+        if path.endswith('.bin'):
+            # Метаинформация файла: md5 и ссылка на превью
+            size = params.get('preview_size', 'S')
+            return self._json(request, 200, {
+                'name': path.rsplit('/', 1)[-1],
+                'type': 'file',
+                'path': path,
+                'md5': hashlib.md5(path.encode()).hexdigest(),
+                'preview': f'{DOWNLOAD_HOST}/preview{quote(path)}?size={size}',
+            })
+        items = self._children(path)
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 20))
+        return self._json(request, 200, {
+            'name': path.rstrip('/').split('/')[-1] or 'disk',
+            'type': 'dir',
+            'path': path,
+            'modified': self._modified(path),
+            '_embedded': {
+                'items': items[offset:offset + limit],
+                'total': len(items),
+                'offset': offset,
+                'limit': limit,
+                'path': path,
+            },
+        })
+
+    def _download(self, request, size):
+        """Файл из нулей с поддержкой Range и If-Range (ETag у всех файлов один)"""
+        headers = {'Content-Type': 'application/octet-stream', 'Accept-Ranges': 'bytes', 'ETag': self.ETAG}
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', request.headers.get('Range', ''))
+        if match is None or request.headers.get('If-Range', self.ETAG) != self.ETAG:
+            return self._response(request, 200, _ZeroStream(size), dict(headers, **{'Content-Length': str(size)}))
+
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        if start >= size:
+            return self._response(request, 416, io.BytesIO(), dict(headers, **{'Content-Range': f'bytes */{size}'}))
+        return self._response(request, 206, _ZeroStream(end - start + 1), dict(headers, **{
+            'Content-Range': f'bytes {start}-{end}/{size}',
+            'Content-Length': str(end - start + 1),
+        }))
+
+    def _modified(self, path):
+        return '2024-01-01T00:00:00+00:00'
+
+    def _children(self, path):
+        prefix = path.rstrip('/')
+        level = len([part for part in prefix.split('/') if part])
+        items = []
+        if level < self.depth:
+            items += [{
+                'name': f'dir{i}',
+                'type': 'dir',
+                'path': f'{prefix}/dir{i}',
+                'modified': '2024-01-01T00:00:00+00:00',
+            } for i in range(self.folders_per_folder)]
+        items += [{
+            'name': f'file{i}.bin',
+            'type': 'file',
+            'path': f'{prefix}/file{i}.bin',
+            'size': self.file_size,
+            'md5': hashlib.md5(f'{prefix}/file{i}.bin'.encode()).hexdigest(),
+            'mime_type': 'application/octet-stream',
+            'media_type': 'data',
+            'modified': '2024-01-01T00:00:00+00:00',
+        } for i in range(self.files_per_folder)]
+        return items
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def _json(self, request, status, data, headers=None):
+        return self._response(
+            request, status, io.BytesIO(json.dumps(data).encode('utf-8')),
+            dict({'Content-Type': 'application/json'}, **(headers or {})),
+        )
+
+    def _response(self, request, status, raw, headers):
+        response = Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.raw = raw
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+
+class TreeDisk(FakeDisk):
+    """FakeDisk с изменяемым деревом {папка: {имя: md5}}; имена подпапок — с «/» на конце.
+
+    touch() меняет modified папки и всех её предков, как правка на Диске.
+    Размеры файлов — из sizes по пути, по умолчанию file_size.
+    """
+
+    def __init__(self, tree, **kwargs):
+        super().__init__(**kwargs)
+        self.tree = tree
+        self.versions = {}
+        self.sizes = {}
+
+    def touch(self, path):
+        while True:
+            self.versions[path] = self.versions.get(path, 0) + 1
+            if path == '/':
+                return
+            path = path.rsplit('/', 1)[0] or '/'
+
+    def _modified(self, path):
+        return f'2024-01-{1 + self.versions.get(path, 0):02d}T00:00:00+00:00'
+
+    def _children(self, path):
+        prefix = path.rstrip('/')
+        items = []
+        for name, md5 in self.tree.get(path, {}).items():
+            child = f"{prefix}/{name.rstrip('/')}"
+            if name.endswith('/'):
+                items.append({'name': name.rstrip('/'), 'type': 'dir', 'path': child, 'modified': self._modified(child)})
+            else:
+                items.append({
+                    'name': name, 'type': 'file', 'path': child, 'md5': md5,
+                    'size': self.sizes.get(child, self.file_size),
+                    'modified': '2024-01-01T00:00:00+00:00',
+                })
+        return items
+
+
+class CountingFetch:
+    """fetch() для кэшей: считает вызовы и возвращает номер вызова"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if self.delay:
+            time.sleep(self.delay)
+        return {'call': call}
+
+
+def wait_for(condition, timeout=5.0):
+    """Ждёт, пока condition() станет истинным (фоновые потоки кэшей)"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Условие не выполнилось за отведённое время")
+        time.sleep(0.01)
+
+
+class CountingLimiter(RateLimiter):
+    """RateLimiter без ограничений, который считает выданные слоты"""
+
+    def __init__(self):
+        super().__init__(rate=0, token_rate=0)
+        self.acquired = 0
+
+    def acquire(self, token=None):
+        self.acquired += 1
+        super().acquire(token)
+
+    async def aacquire(self, token=None):
+        self.acquired += 1
+        await super().aacquire(token)
+
+
+def fake_async_client(disk, **kwargs):
+    """AsyncYandexClient, чьи запросы обслуживает FakeDisk"""
+    kwargs.setdefault('limiter', CountingLimiter())
+    kwargs.setdefault('breaker', CircuitBreaker())
+    api = AsyncYandexClient(**kwargs)
+    api._build_client = lambda: httpx.AsyncClient(transport=disk.httpx_transport(), follow_redirects=True)
+    return api
+
+
+class LocalServer:
+    """HTTP-сервер на localhost в фоновом потоке.
+
+    respond(handler) возвращает (статус, заголовки, тело). Сервер запоминает
+    пути запросов и порты клиентов: по портам видно переиспользование
+    keep-alive соединений.
+    """
+
+    def __init__(self, respond):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests.append((self.path, self.client_address[1]))
+                status, headers, body = respond(self)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.requests = []
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def json_response(data, status=200, headers=None):
+    """Ответ для LocalServer"""
+    return status, dict({'Content-Type': 'application/json'}, **(headers or {})), json.dumps(data).encode('utf-8')
+
+
+class ExplorerTestCase(TransactionTestCase):
+    """Общая подготовка: чистые кэши, пользователь в сессии, FakeDisk по запросу.
+
+    TransactionTestCase, потому что кэш и индекс пишутся в БД из потоков пула.
+    """
+
+    public_url = 'https://disk.yandex.ru/d/bench'
+    public_key = 'bench'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Логи каждого запроса (и ожидаемые ошибки FakeDisk) только засоряют вывод
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    def setUp(self):
+        self._limiter, self._breaker = yandex_client.limiter, yandex_client.breaker
+        # Лимиты частоты настроены на реальный API и здесь только мешают
+        yandex_client.limiter = RateLimiter(rate=0, token_rate=0)
+        yandex_client.breaker = CircuitBreaker()
+        listing_cache.memory.clear()
+        download_link_cache.memory.clear()
+        preview_link_cache.memory.clear()
+        stats.memo.clear()
+        self.client = Client()
+        session = self.client.session
+        session['yandex_user'] = {'name': 'bench', 'email': '', 'login': 'bench'}
+        session['yandex_token'] = 'token'
+        session.save()
+
+    def tearDown(self):
+        yandex_client.close()
+        yandex_client.limiter, yandex_client.breaker = self._limiter, self._breaker
+
+    def fake_disk(self, **kwargs):
+        disk = FakeDisk(**kwargs)
+        disk.install()
+        return disk
+
+    def fake_async_disk(self, **kwargs):
+        """FakeDisk за async_yandex_client (асинхронные представления)"""
+        disk = FakeDisk(**kwargs)
+        patches = [
+            mock.patch.object(async_yandex_client, '_build_client', fake_async_client(disk)._build_client),
+            mock.patch.object(async_yandex_client, 'limiter', RateLimiter(rate=0, token_rate=0)),
+            mock.patch.object(async_yandex_client, 'breaker', CircuitBreaker()),
+            # Клиент привязан к циклу событий теста
+            mock.patch.object(async_yandex_client, '_client', None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        return disk
+
+    def temp_blob_cache(self, **kwargs):
+        """BlobCache во временном каталоге вместо общего кэша скачиваний"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = BlobCache(root=directory.name, **kwargs)
+        for target in ('explorer.views.blob_cache', 'explorer.async_views.blob_cache'):
+            patch = mock.patch(target, cache)
+            patch.start()
+            self.addCleanup(patch.stop)
+        return cache
+
+    def reset_caches(self):
+        listing_cache.memory.clear()
+        download_link_cache.memory.clear()
+        preview_link_cache.memory.clear()
+        stats.memo.clear()
+        FileCache.objects.all().delete()
+
+
+class ListingCacheTests(ExplorerTestCase):
+    params = {'public_key': 'key', 'path': '/', 'offset': 0, 'limit': 20}
+
+    def make_cache(self, **kwargs):
+        return ListingCache(memory=LRUCache(), **kwargs)
+
+    def test_read_through(self):
+        cache = self.make_cache(ttl=60)
+        fetch = CountingFetch()
+
+        self.assertEqual(cache.get_or_fetch(self.params, fetch), {'call': 1})
+        self.assertEqual(cache.get_or_fetch(self.params, fetch), {'call': 1})
+        self.assertEqual(fetch.calls, 1)
+        # Запись переживает процесс: новый экземпляр берёт её из FileCache
+        self.assertEqual(self.make_cache(ttl=60).get_or_fetch(self.params, fetch), {'call': 1})
+        self.assertEqual(fetch.calls, 1)
+
+    def test_stale_entry_is_served_and_refreshed_in_background(self):
+        cache = self.make_cache(ttl=0, stale_ttl=60)
+        fetch = CountingFetch()
+        cache.get_or_fetch(self.params, fetch)
+
+        self.assertEqual(cache.get_or_fetch(self.params, fetch), {'call': 1})
+        wait_for(lambda: not cache._refreshing)
+        self.assertEqual(fetch.calls, 2)
+        self.assertEqual(FileCache.get(cache.key_for(self.params))['data'], {'call': 2})
+        self.assertEqual(cache.stats()['stale'], 1)
+
+    def test_failed_refresh_keeps_stale_entry(self):
+        cache = self.make_cache(ttl=0, stale_ttl=60)
+        cache.get_or_fetch(self.params, CountingFetch())
+
+        def fail():
+            raise ValueError("API error")
+
+        self.assertEqual(cache.get_or_fetch(self.params, fail), {'call': 1})
+        wait_for(lambda: not cache._refreshing)
+        self.assertEqual(cache.stats()['refresh_error'], 1)
+        self.assertEqual(cache.get_or_fetch(self.params, fail), {'call': 1})
+        wait_for(lambda: not cache._refreshing)
+
+    def test_expired_entry_is_fetched_again(self):
+        cache = self.make_cache(ttl=0, stale_ttl=0)
+        fetch = CountingFetch()
+        cache.get_or_fetch(self.params, fetch)
+        self.assertEqual(cache.get_or_fetch(self.params, fetch), {'call': 2})
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_evicts_least_recently_used_by_count(self):
+        cache = LRUCache(max_entries=2, max_bytes=1000)
+        cache.set('a', 1, 60, 1)
+        cache.set('b', 2, 60, 1)
+        cache.get('a')
+        cache.set('c', 3, 60, 1)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_evicts_by_total_size(self):
+        cache = LRUCache(max_entries=10, max_bytes=10)
+        cache.set('a', 1, 60, 6)
+        cache.set('b', 2, 60, 6)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.total_bytes, 6)
+        # Запись больше всего кэша не сохраняется и ничего не вытесняет
+        cache.set('c', 3, 60, 11)
+        self.assertEqual((cache.get('b'), cache.get('c')), (2, None))
+
+    def test_entry_count_limit_only(self):
+        cache = LRUCache(max_entries=2, max_bytes=None)
+        for key in 'abc':
+            cache.set(key, key, 60)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (None, 'b', 'c'))
+
+    def test_expired_entry_is_dropped(self):
+        cache = LRUCache()
+        cache.set('a', 1, 0, 1)
+        cache.set('b', 2, 60, 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual((len(cache), cache.total_bytes), (1, 1))
+
+
+class ListingCacheTiersTests(ExplorerTestCase):
+    params = {'public_key': 'key', 'path': '/', 'offset': 0, 'limit': 20}
+
+    def test_fresh_memory_hit_skips_database(self):
+        cache = ListingCache(memory=LRUCache(), ttl=60)
+        fetch = CountingFetch()
+        cache.get_or_fetch(self.params, fetch)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_or_fetch(self.params, fetch), {'call': 1})
+        self.assertEqual(cache.stats()['memory_hit'], 1)
+
+    def test_not_found_is_cached_for_negative_ttl(self):
+        cache = ListingCache(memory=LRUCache(), negative_ttl=60)
+        calls = []
+
+        def missing():
+            calls.append(1)
+            raise ResourceNotFound("Не найдено")
+
+        for _ in range(2):
+            with self.assertRaisesMessage(ResourceNotFound, "Не найдено"):
+                cache.get_or_fetch(self.params, missing)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['negative_hit'], 1)
+        # Из БД отрицательная запись тоже читается
+        with self.assertRaises(ResourceNotFound):
+            ListingCache(memory=LRUCache(), negative_ttl=60).get_or_fetch(self.params, missing)
+        self.assertEqual(len(calls), 1)
+
+    def test_not_found_expires(self):
+        cache = ListingCache(memory=LRUCache(), negative_ttl=0)
+
+        def missing():
+            raise ResourceNotFound("Не найдено")
+
+        with self.assertRaises(ResourceNotFound):
+            cache.get_or_fetch(self.params, missing)
+        self.assertEqual(cache.get_or_fetch(self.params, CountingFetch()), {'call': 1})
+
+    def test_other_errors_are_not_cached(self):
+        cache = ListingCache(memory=LRUCache())
+
+        def fail():
+            raise ValueError("Ошибка API")
+
+        with self.assertRaises(ValueError):
+            cache.get_or_fetch(self.params, fail)
+        self.assertEqual(cache.get_or_fetch(self.params, CountingFetch()), {'call': 1})
+
+
+def tree_fetch(tree, with_total=True):
+    """fetch_page для FolderLister по словарю {папка: [элементы]}; запросы пишутся в calls"""
+    calls = []
+
+    def fetch_page(params):
+        calls.append((params['path'], params['offset']))
+        items = tree[params['path']]
+        embedded = {'items': items[params['offset']:params['offset'] + params['limit']]}
+        if with_total:
+            embedded['total'] = len(items)
+        return {'_embedded': embedded}
+
+    fetch_page.calls = calls
+    return fetch_page
+
+
+class FolderListerTests(SimpleTestCase):
+    tree = {
+        '/': [{'name': 'a', 'type': 'dir', 'path': '/a'}] + [
+            {'name': f'f{i}', 'type': 'file', 'path': f'/f{i}'} for i in range(25)
+        ],
+        '/a': [{'name': f'g{i}', 'type': 'file', 'path': f'/a/g{i}'} for i in range(5)],
+    }
+
+    def test_walks_all_pages(self):
+        fetch_page = tree_fetch(self.tree)
+        items = list(FolderLister(fetch_page, page_size=10).walk('key', '/', recursive=False))
+        self.assertEqual(items, self.tree['/'])
+        self.assertEqual(sorted(fetch_page.calls), [('/', 0), ('/', 10), ('/', 20)])
+
+    def test_recursive_walk_order_is_deterministic(self):
+        for _ in range(3):
+            items = list(FolderLister(tree_fetch(self.tree), page_size=10).walk('key', '/'))
+            self.assertEqual(items, self.tree['/'] + self.tree['/a'])
+
+    def test_walks_pages_without_total(self):
+        fetch_page = tree_fetch(self.tree, with_total=False)
+        items = list(FolderLister(fetch_page, page_size=10).walk('key', '/', recursive=False))
+        self.assertEqual(len(items), 26)
+        self.assertEqual(fetch_page.calls, [('/', 0), ('/', 10), ('/', 20)])
+
+    def test_page_returns_total(self):
+        items, total = FolderLister(tree_fetch(self.tree), page_size=10).page('key', '/', 20)
+        self.assertEqual((len(items), total), (6, 26))
+
+
+class ListingFilterTests(SimpleTestCase):
+    file = {'name': 'Report.PDF', 'type': 'file', 'size': 500, 'modified': '2024-03-10T12:00:00+00:00'}
+    folder = {'name': 'reports', 'type': 'dir', 'modified': '2024-03-01T00:00:00+00:00'}
+
+    def matches(self, **kwargs):
+        match = ListingFilter(**kwargs)
+        return match(self.file), match(self.folder)
+
+    def test_empty_filter_is_false_and_matches_everything(self):
+        self.assertFalse(ListingFilter())
+        self.assertEqual(self.matches(), (True, True))
+        self.assertTrue(ListingFilter(min_size=0))
+
+    def test_name_is_case_insensitive_substring(self):
+        self.assertEqual(self.matches(name='REPORT'), (True, True))
+        self.assertEqual(self.matches(name='.pdf'), (True, False))
+
+    def test_type(self):
+        self.assertEqual(self.matches(type='dir'), (False, True))
+        self.assertEqual(self.matches(type='file'), (True, False))
+
+    def test_size_bounds_are_inclusive_and_skip_folders(self):
+        self.assertEqual(self.matches(min_size=500, max_size=500), (True, False))
+        self.assertEqual(self.matches(min_size=501), (False, False))
+        self.assertEqual(self.matches(max_size=499), (False, False))
+
+    def test_modified_range_excludes_upper_bound(self):
+        self.assertEqual(self.matches(modified_after=date(2024, 3, 10)), (True, False))
+        self.assertEqual(self.matches(modified_before=date(2024, 3, 10)), (False, True))
+        self.assertEqual(self.matches(modified_after=date(2024, 3, 1), modified_before=date(2024, 3, 11)), (True, True))
+        self.assertFalse(ListingFilter(modified_after=date(2024, 1, 1))({'name': 'x', 'type': 'file'}))
+
+
+class ListingSortTests(SimpleTestCase):
+    tree = {
+        '/': [
+            {'name': 'b.txt', 'type': 'file', 'path': '/b.txt'},
+            {'name': 'z', 'type': 'dir', 'path': '/z'},
+            {'name': 'a.txt', 'type': 'file', 'path': '/a.txt'},
+            {'name': 'y', 'type': 'dir', 'path': '/y'},
+        ],
+        '/y': [{'name': 'c.txt', 'type': 'file', 'path': '/y/c.txt'}],
+        '/z': [],
+    }
+
+    def names(self, sort, **kwargs):
+        lister = FolderLister(tree_fetch(self.tree), page_size=10)
+        return [item['name'] for item in lister.items('key', '/', sort=sort, **kwargs)]
+
+    def test_sort_passes(self):
+        self.assertEqual(sort_passes('type'), [('name', 'dir'), ('name', 'file')])
+        self.assertEqual(sort_passes('-type'), [('name', 'file'), ('name', 'dir')])
+        self.assertEqual(sort_passes('-size'), [('-size', None)])
+        self.assertEqual(sort_passes(None), [(None, None)])
+        self.assertEqual(sort_passes(''), [(None, None)])
+
+    def test_type_sorts_put_folders_or_files_first(self):
+        # Внутри прохода порядок задаёт API (tree_fetch его не меняет)
+        self.assertEqual(self.names('type'), ['z', 'y', 'b.txt', 'a.txt'])
+        self.assertEqual(self.names('-type'), ['b.txt', 'a.txt', 'z', 'y'])
+        self.assertEqual(self.names('type', recursive=True), ['z', 'y', 'b.txt', 'a.txt', 'c.txt'])
+
+    def test_filter_applies_to_every_pass(self):
+        self.assertEqual(self.names('type', match=ListingFilter(name='y')), ['y'])
+
+    def test_row_from_item(self):
+        row = Row.from_item({'name': 'a b.txt', 'type': 'file', 'path': '/dir/a b.txt'}, 'key')
+        self.assertEqual(row, Row('a b.txt', 'file', '/dir/a b.txt', 0, '', 'unknown', '', '', 'key'))
+        self.assertEqual(row.path, '/dir/a%20b.txt')
+        self.assertEqual(row._asdict()['public_key'], 'key')
+
+        item = {
+            'name': 'p.png', 'type': 'file', 'path': '/p.png', 'size': 10, 'modified': '2024-01-01',
+            'media_type': 'image', 'md5': 'm', 'preview': 'https://preview',
+        }
+        self.assertEqual(tuple(Row.from_item(item, 'key'))[3:8], (10, '2024-01-01', 'image', 'm', 'https://preview'))
+
+
+class ListPageTests(SimpleTestCase):
+    tree = FolderListerTests.tree
+
+    def list_page(self, page, **kwargs):
+        fetch_page = tree_fetch(self.tree)
+        lister = FolderLister(fetch_page, page_size=10, max_workers=1)
+        items, has_next = IndexView()._list_page(lister, 'key', '/', page, **kwargs)
+        return [item['name'] for item in items], has_next, fetch_page.calls
+
+    def test_plain_page_uses_api_offset(self):
+        names, has_next, calls = self.list_page(2, recursive=False)
+        self.assertEqual((names[0], len(names), has_next), ('f9', 10, True))
+        self.assertEqual(calls, [('/', 10)])
+        self.assertEqual(self.list_page(3, recursive=False)[:2], (['f19', 'f20', 'f21', 'f22', 'f23', 'f24'], False))
+
+    def test_filtered_pages(self):
+        match = ListingFilter(type='file')
+        names, has_next, _ = self.list_page(1, recursive=False, match=match)
+        self.assertEqual((names[0], len(names), has_next), ('f0', 10, True))
+        names, has_next, _ = self.list_page(3, recursive=False, match=match)
+        self.assertEqual((names, has_next), (['f20', 'f21', 'f22', 'f23', 'f24'], False))
+
+        # f1 и f10–f19: одиннадцатый элемент — на второй странице
+        names, has_next, _ = self.list_page(1, recursive=False, match=ListingFilter(name='f1'))
+        self.assertEqual((len(names), has_next), (10, True))
+        names, has_next, _ = self.list_page(2, recursive=False, match=ListingFilter(name='f1'))
+        self.assertEqual((names, has_next), (['f19'], False))
+
+    def test_recursive_and_type_sorted_pages(self):
+        names, has_next, calls = self.list_page(3, recursive=True)
+        self.assertEqual((names, has_next), (['f19', 'f20', 'f21', 'f22', 'f23', 'f24', 'g0', 'g1', 'g2', 'g3'], True))
+        self.assertEqual(self.list_page(4, recursive=True)[:2], (['g4'], False))
+
+        names, has_next, _ = self.list_page(1, recursive=False, sort='-type')
+        self.assertEqual((names[0], has_next), ('f0', True))
+        self.assertEqual(self.list_page(3, recursive=False, sort='-type')[:2], (['f20', 'f21', 'f22', 'f23', 'f24', 'a'], False))
+
+
+class StreamedListingTests(ExplorerTestCase):
+
+    def stream(self, **data):
+        response = self.client.post('/', dict({'public_url': self.public_url, 'all': '1'}, **data))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, [part.decode('utf-8') for part in response.streaming_content]
+
+    @override_settings(LISTING_STREAM_CHUNK_SIZE=50)
+    def test_all_rows_are_streamed_in_chunks(self):
+        self.fake_disk(files_per_folder=120)
+        response, parts = self.stream(sort='name')
+
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        # Шапка, три пачки строк, хвост страницы
+        self.assertEqual([part.count('<tr>') for part in parts[1:-1]], [50, 50, 20])
+        self.assertIn('file119.bin', parts[3])
+        self.assertIn('</html>', parts[-1])
+
+    @override_settings(LISTING_STREAM_CHUNK_SIZE=50)
+    def test_filter_applies_to_streamed_rows(self):
+        self.fake_disk(files_per_folder=120)
+        _, parts = self.stream(q='file11')
+        self.assertEqual(sum(part.count('<tr>') for part in parts[1:-1]), 11)
+
+    @override_settings(LISTING_STREAM_CHUNK_SIZE=50)
+    def test_error_mid_stream_renders_error_row(self):
+        # Две страницы API: после сбоя второй запросов в полёте не остаётся
+        disk = self.fake_disk(files_per_folder=150)
+        listing = disk._listing
+
+        def failing_listing(request, params):
+            if int(params.get('offset', 0)) >= 100:
+                return disk._json(request, 500, {'message': 'Сбой на второй странице'})
+            return listing(request, params)
+
+        disk._listing = failing_listing
+        _, parts = self.stream()
+
+        self.assertEqual([part.count('<tr>') for part in parts[1:-2]], [50, 50])
+        self.assertRegex(parts[-2], r'^<tr><td colspan="7" class="text-danger">[^<]*Сбой на второй странице</td></tr>$')
+        self.assertIn('</html>', parts[-1])
+
+    def test_error_before_first_chunk_is_regular_page(self):
+        self.fake_disk()
+        response = self.client.post('/', {'public_url': 'https://disk.yandex.ru/d/missing', 'all': '1'})
+        self.assertFalse(response.streaming)
+        self.assertContains(response, 'Не удалось найти запрошенный ресурс')
+
+class BatchListingViewTests(ExplorerTestCase):
+
+    def post(self, urls, **headers):
+        path = '/batch/' if headers else '/batch/?format=json'
+        return self.client.post(path, {'public_urls': urls}, headers=headers)
+
+    def test_partial_failure(self):
+        disk = self.fake_disk(files_per_folder=150)
+        listing = disk._listing
+
+        def listing_with_outage(request, params):
+            if params.get('public_key') == 'down':
+                return disk._json(request, 503, {'message': 'Service unavailable'}, {'Retry-After': '0'})
+            return listing(request, params)
+
+        disk._listing = listing_with_outage
+        urls = [
+            'https://disk.yandex.ru/d/one',
+            'https://example.com/d/other',
+            'https://disk.yandex.ru/d/missing',
+            'https://disk.yandex.ru/d/down',
+            'https://disk.yandex.ru/d/one',
+        ]
+        response = self.post(', '.join(urls))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        # Повторная ссылка отбрасывается, порядок сохраняется
+        self.assertEqual((data['count'], data['failed']), (4, 3))
+        ok, invalid, missing, down = data['results']
+        self.assertEqual(
+            {name: ok[name] for name in ('public_url', 'public_key', 'status', 'error', 'total', 'has_next')},
+            {
+                'public_url': urls[0], 'public_key': 'one', 'status': 'ok', 'error': None,
+                'total': 150, 'has_next': True,
+            },
+        )
+        self.assertEqual(len(ok['items']), settings.LISTING_PAGE_SIZE)
+        self.assertEqual(set(ok['items'][0]), set(YandexDiskView.ITEM_FIELDS))
+        self.assertEqual((ok['items'][0]['name'], ok['items'][0]['public_key']), ('file0.bin', 'one'))
+
+        self.assertEqual((invalid['status'], invalid['public_key'], invalid['items']), ('invalid', None, []))
+        self.assertEqual(invalid['error'], 'Неверная ссылка Яндекс.Диска')
+        self.assertEqual((missing['status'], missing['public_key']), ('not_found', 'missing'))
+        self.assertIn('Не удалось найти запрошенный ресурс', missing['error'])
+        self.assertEqual((down['status'], down['total'], down['items']), ('error', None, []))
+        self.assertIn('недоступен', down['error'])
+
+    def test_html_groups(self):
+        self.fake_disk(files_per_folder=5)
+        response = self.post('https://disk.yandex.ru/d/one\nhttps://disk.yandex.ru/d/missing', Accept='text/html')
+        self.assertEqual(response.status_code, 200)
+        groups = response.context['groups']
+        self.assertEqual([group['status'] for group in groups], ['ok', 'not_found'])
+        self.assertContains(response, 'file4.bin')
+
+    def test_empty_and_separator_only_input(self):
+        for urls in ('', ' ,\n '):
+            with self.subTest(urls=urls):
+                response = self.post(urls)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Не указано ни одной ссылки'})
+
+    @override_settings(BATCH_MAX_LINKS=2)
+    def test_too_many_links(self):
+        disk = self.fake_disk()
+        urls = ' '.join(f'https://disk.yandex.ru/d/key{i}' for i in range(3))
+
+        response = self.post(urls)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Слишком много ссылок: 3, не больше 2 за раз'})
+        self.assertEqual(disk.calls['listing'], 0)
+        response = self.post(urls, Accept='text/html')
+        self.assertEqual(response.context['error'], 'Слишком много ссылок: 3, не больше 2 за раз')
+
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.post('https://disk.yandex.ru/d/one')
+        self.assertEqual(response.status_code, 401)
+
+class IndexViewPaginationTests(ExplorerTestCase):
+
+    def post(self, **data):
+        response = self.client.post('/', dict({'public_url': self.public_url}, **data))
+        self.assertIsNone(response.context['error'])
+        return response.context
+
+    def test_pages_past_first_hundred_items(self):
+        self.fake_disk(files_per_folder=250)
+        first = self.post()
+        self.assertEqual((len(first['files']), first['has_next']), (100, True))
+        last = self.post(page='3')
+        self.assertEqual((len(last['files']), last['has_next']), (50, False))
+        self.assertEqual(last['files'][0]['name'], 'file200.bin')
+
+    def test_recursive_listing_includes_subfolders(self):
+        self.fake_disk(files_per_folder=5, folders_per_folder=2, depth=1)
+        context = self.post(recursive='1')
+        paths = [item['raw_path'] for item in context['files']]
+        self.assertEqual(len(paths), 17)
+        self.assertIn('/dir1/file4.bin', paths)
+        self.assertFalse(context['has_next'])
+
+
+class AsyncCrawlerTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    def test_crawls_whole_tree(self):
+        disk = FakeDisk(files_per_folder=30, folders_per_folder=2, depth=2)
+        api = fake_async_client(disk)
+        crawler = AsyncCrawler(api=api, page_size=10, concurrency=4)
+
+        index = crawler.crawl_sync('key')
+
+        self.assertEqual(len(index), disk.walk_size())
+        self.assertEqual(index['/dir1/dir0/file29.bin']['parent'], '/dir1/dir0')
+        self.assertEqual(index['/dir1']['type'], 'dir')
+        # Каждый запрос обхода прошёл через общий лимитер клиента
+        self.assertEqual(api.limiter.acquired, disk.calls['listing'])
+        self.assertEqual(crawler.api_calls, disk.calls['listing'])
+
+    def test_failures_open_shared_breaker(self):
+        disk = FakeDisk(error_rate=1.0)
+        api = fake_async_client(disk, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+        crawler = AsyncCrawler(api=api, max_retries=4, backoff=0)
+
+        with self.assertRaises(UpstreamUnavailable):
+            crawler.crawl_sync('key')
+        # Два запроса первой попытки (с повтором по Retry-After), третий
+        # размыкает выключатель, остальные попытки отклоняются без запросов
+        self.assertEqual(disk.calls['error'], 3)
+        self.assertEqual(api.breaker.state, CircuitBreaker.OPEN)
+
+    def test_missing_folder(self):
+        api = fake_async_client(FakeDisk())
+        with self.assertRaises(ResourceNotFound):
+            AsyncCrawler(api=api).crawl_sync('missing')
+
+
+class YandexClientPoolTests(SimpleTestCase):
+
+    def test_requests_reuse_keep_alive_connection(self):
+        client = YandexClient(limiter=RateLimiter(rate=0, token_rate=0), breaker=CircuitBreaker())
+        with LocalServer(lambda handler: json_response({'ok': True})) as server:
+            for _ in range(5):
+                response = client.call_api(f'{server.url}/resources', {'path': '/'})
+                self.assertEqual(response.json(), {'ok': True})
+            client.close()
+
+        self.assertEqual(len(server.requests), 5)
+        self.assertEqual(len({port for _, port in server.requests}), 1)
+
+    def test_one_session_per_client(self):
+        client = YandexClient(pool_size=3, retries=1)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            sessions = set(map(id, executor.map(lambda _: client.session, range(32))))
+        self.assertEqual(len(sessions), 1)
+
+        adapter = client.session.get_adapter(BASE_API_URL)
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertEqual(adapter.max_retries.total, 1)
+        client.close()
+        self.assertIsNone(client._session)
+
+    def test_requests_use_default_timeout(self):
+        client = YandexClient(timeout=0.2, retries=0)
+
+        def slow(handler):
+            time.sleep(1)
+            return json_response({})
+
+        with LocalServer(slow) as server:
+            started = time.perf_counter()
+            with self.assertRaises(requests.RequestException):
+                client.get(f'{server.url}/slow')
+            self.assertLess(time.perf_counter() - started, 1)
+            client.close()
+
+
+class AsyncViewsTests(ExplorerTestCase):
+
+    def request(self, method, path, data):
+        request = getattr(AsyncRequestFactory(), method)(path, data)
+        request.session = self.client.session
+        return request
+
+    async def test_index_lists_folder(self):
+        self.fake_async_disk(files_per_folder=150)
+        request = self.request('post', '/', {'public_url': self.public_url})
+
+        response = await AsyncIndexView.as_view()(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'file99.bin')
+        self.assertNotContains(response, 'file100.bin')
+
+    async def test_index_shows_api_error(self):
+        self.fake_async_disk()
+        request = self.request('post', '/', {'public_url': 'https://disk.yandex.ru/d/missing'})
+
+        response = await AsyncIndexView.as_view()(request)
+
+        self.assertContains(response, 'Не удалось найти запрошенный ресурс')
+
+    async def test_download_streams_file(self):
+        disk = self.fake_async_disk(file_size=3 * 1024 * 1024 + 1)
+        request = self.request('get', '/download/', {'public_key': self.public_key, 'path': '/file0.bin', 'proxy': '1'})
+
+        response = await AsyncDownloadView.as_view()(request)
+
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Length'], str(disk.file_size))
+        size = 0
+        async for chunk in response.streaming_content:
+            size += len(chunk)
+        self.assertEqual(size, disk.file_size)
+        self.assertEqual(disk.calls['download'], 1)
+
+    async def test_download_is_cached_for_indexed_md5_only(self):
+        disk = self.fake_async_disk(file_size=1000)
+        cache = self.temp_blob_cache()
+        md5 = hashlib.md5(bytes(1000)).hexdigest()
+        params = {'public_key': self.public_key, 'path': '/file0.bin', 'md5': md5, 'size': '1000', 'proxy': '1'}
+
+        async def download():
+            response = await AsyncDownloadView.as_view()(self.request('get', '/download/', params))
+            if not response.is_async:
+                # Файл из локального кэша
+                return b''.join(response.streaming_content)
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        # md5 не проиндексирован: файл идёт из хранилища и в кэш не пишется
+        self.assertEqual(await download(), bytes(1000))
+        self.assertIsNone(cache.get(md5))
+
+        await sync_to_async(IndexedItem.objects.create)(
+            public_key=self.public_key, path='/file0.bin', parent='/', name='file0.bin', type='file', md5=md5,
+        )
+        for _ in range(2):
+            self.assertEqual(await download(), bytes(1000))
+        self.assertIsNotNone(cache.get(md5))
+        self.assertEqual(disk.calls['download'], 2)
+
+
+class DownloadRangeTests(ExplorerTestCase):
+    file_size = 1000
+
+    def download(self, **headers):
+        return self.client.get('/download/', {
+            'public_key': self.public_key, 'path': '/file0.bin', 'proxy': '1',
+        }, headers=headers)
+
+    def test_full_download(self):
+        self.fake_disk(file_size=self.file_size)
+        response = self.download()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content)), self.file_size)
+        self.assertEqual(response['Content-Length'], str(self.file_size))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], FakeDisk.ETAG)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="file0.bin"')
+
+    def test_range_is_passed_through(self):
+        disk = self.fake_disk(file_size=self.file_size)
+        response = self.download(Range='bytes=100-199')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{self.file_size}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(len(b''.join(response.streaming_content)), 100)
+        self.assertEqual(disk.download_headers[-1]['Range'], 'bytes=100-199')
+
+    def test_if_range_mismatch_returns_whole_file(self):
+        disk = self.fake_disk(file_size=self.file_size)
+        response = self.download(Range='bytes=100-', **{'If-Range': '"other"'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content)), self.file_size)
+        self.assertEqual(disk.download_headers[-1]['If-Range'], '"other"')
+
+    def test_unsatisfiable_range(self):
+        self.fake_disk(file_size=self.file_size)
+        response = self.download(Range=f'bytes={self.file_size}-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{self.file_size}')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_unrelated_headers_are_not_forwarded(self):
+        disk = self.fake_disk(file_size=self.file_size)
+        b''.join(self.download(**{'X-Custom': '1'}).streaming_content)
+        self.assertNotIn('X-Custom', disk.download_headers[-1])
+        self.assertNotIn('Range', disk.download_headers[-1])
+
+
+@override_settings(DOWNLOAD_MODE='redirect')
+class DownloadRedirectTests(ExplorerTestCase):
+
+    def download(self, **params):
+        return self.client.get('/download/', dict({'public_key': self.public_key, 'path': '/file0.bin'}, **params))
+
+    def test_redirects_to_resolved_link(self):
+        disk = self.fake_disk()
+
+        for _ in range(2):
+            response = self.download()
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response['Location'], f'{DOWNLOAD_HOST}/file0.bin?size={disk.file_size}')
+        # Ссылка берётся из кэша, а байты через приложение не идут
+        self.assertEqual(disk.calls['download_link'], 1)
+        self.assertEqual(disk.calls['download'], 0)
+
+    def test_proxy_parameter_streams_file(self):
+        disk = self.fake_disk(file_size=1000)
+        response = self.download(proxy='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content)), 1000)
+        self.assertEqual(disk.calls['download'], 1)
+
+    def index_file(self, md5):
+        IndexedItem.objects.create(
+            public_key=self.public_key, path='/file0.bin', parent='/', name='file0.bin', type='file', md5=md5,
+        )
+
+    def test_cacheable_file_is_proxied_into_local_cache(self):
+        disk = self.fake_disk(file_size=1000)
+        cache = self.temp_blob_cache()
+        md5 = hashlib.md5(bytes(1000)).hexdigest()
+        self.index_file(md5)
+
+        response = self.download(md5=md5, size='1000')
+        self.assertEqual(response.status_code, 200)
+        b''.join(response.streaming_content)
+        self.assertIsNotNone(cache.get(md5))
+
+        response = self.download(md5=md5, size='1000')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content)), 1000)
+        self.assertEqual(disk.calls['download'], 1)
+
+    def test_cached_blob_requires_md5_of_indexed_file(self):
+        disk = self.fake_disk(file_size=1000)
+        cache = self.temp_blob_cache()
+        secret = b'secret' * 10
+        md5 = hashlib.md5(secret).hexdigest()
+        writer = cache.writer(md5)
+        writer.write(secret)
+        writer.commit()
+
+        def download():
+            response = self.download(md5=md5, size='60', proxy='1')
+            return b''.join(response.streaming_content)
+
+        # Файл не проиндексирован, затем проиндексирован с другим md5
+        self.assertEqual(download(), bytes(1000))
+        self.index_file(hashlib.md5(bytes(1000)).hexdigest())
+        self.assertEqual(download(), bytes(1000))
+        self.assertEqual(disk.calls['download'], 2)
+
+    def test_upstream_response_is_closed_on_error(self):
+        self.fake_disk()
+        file_response = mock.Mock(status_code=200, headers={})
+        with mock.patch.object(yandex_client, 'open_download', return_value=file_response), \
+                mock.patch.object(DownloadView, '_stream_response', side_effect=ValueError('broken')):
+            response = self.download(proxy='1')
+
+        self.assertContains(response, 'broken')
+        file_response.close.assert_called_once_with()
+
+    @override_settings(DOWNLOAD_MODE='proxy')
+    def test_proxy_mode_setting(self):
+        self.fake_disk(file_size=10)
+        self.assertEqual(self.download().status_code, 200)
+
+
+class BlobCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+
+    def make_cache(self, **kwargs):
+        return BlobCache(root=self.root, **kwargs)
+
+    def store(self, cache, data):
+        md5 = hashlib.md5(data).hexdigest()
+        writer = cache.writer(md5)
+        for start in range(0, len(data), 64):
+            writer.write(data[start:start + 64])
+        writer.commit()
+        if cache._evicting is not None:
+            cache._evicting.join()
+        return md5
+
+    def test_stores_verified_file(self):
+        cache = self.make_cache()
+        md5 = self.store(cache, b'x' * 200)
+        with open(cache.get(md5), 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 200)
+
+    def test_discards_md5_mismatch_and_oversized_files(self):
+        cache = self.make_cache(max_file_size=100)
+        writer = cache.writer('0' * 32)
+        writer.write(b'data')
+        with self.assertLogs('explorer.blob_cache', logging.WARNING):
+            writer.commit()
+        self.assertIsNone(cache.get('0' * 32))
+
+        data = b'y' * 101
+        md5 = hashlib.md5(data).hexdigest()
+        writer = cache.writer(md5)
+        writer.write(data)
+        writer.commit()
+        self.assertIsNone(cache.get(md5))
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_evicts_least_recently_read(self):
+        cache = self.make_cache(max_bytes=300)
+        first, second, third = (self.store(cache, bytes([i]) * 100) for i in range(3))
+        for key, mtime in ((first, 1000), (second, 2000), (third, 3000)):
+            os.utime(cache.path_for(key), (mtime, mtime))
+        cache.get(first)
+
+        fourth = self.store(cache, b'z' * 100)
+
+        # Освобождается место до 270 байт: уходят два самых давних файла
+        self.assertEqual([cache.get(key) is not None for key in (first, second, third, fourth)],
+                         [True, False, False, True])
+        self.assertEqual(cache._total, 200)
+
+    def test_commit_under_budget_does_not_scan(self):
+        cache = self.make_cache(max_bytes=1000)
+        self.store(cache, b'a' * 100)
+        with mock.patch.object(cache, '_scan', wraps=cache._scan) as scan:
+            self.store(cache, b'b' * 100)
+            # Перезапись того же файла не увеличивает объём
+            self.store(cache, b'b' * 100)
+        scan.assert_not_called()
+        self.assertEqual(cache._total, 200)
+
+
+class StreamZipTests(SimpleTestCase):
+
+    def build(self, members, **kwargs):
+        return zipfile.ZipFile(io.BytesIO(b''.join(stream_zip(members, **kwargs))))
+
+    def test_archive_contents_and_crc(self):
+        contents = {f'dir/file{i}.bin': os.urandom(1000 * i + 1) for i in range(10)}
+        members = [(name, lambda data=data: (data[start:start + 256] for start in range(0, len(data), 256)))
+                   for name, data in contents.items()]
+
+        archive = self.build(members, prefetch=2, max_chunks=1)
+
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), list(contents))
+        for info in archive.infolist():
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(archive.read(info), contents[info.filename])
+
+    def test_member_error_aborts_stream(self):
+        def broken():
+            yield b'partial'
+            raise OSError('connection reset')
+
+        with self.assertRaises(OSError):
+            b''.join(stream_zip([('ok.bin', lambda: [b'data']), ('broken.bin', broken)]))
+
+
+class BulkDownloadTests(ExplorerTestCase):
+
+    def download(self, **data):
+        response = self.client.post('/download/zip/', dict({'public_key': self.public_key}, **data))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return response, zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_folder_archive(self):
+        disk = self.fake_disk(files_per_folder=3, folders_per_folder=2, depth=1, file_size=500)
+        self.temp_blob_cache()
+
+        response, archive = self.download(folder='/')
+
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="files.zip"')
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(sorted(archive.namelist()), sorted(
+            f'{folder}file{i}.bin' for folder in ('', 'dir0/', 'dir1/') for i in range(3)
+        ))
+        self.assertEqual(archive.read('dir1/file2.bin'), bytes(500))
+        self.assertEqual(disk.calls['download'], 9)
+
+    def test_subfolder_archive_uses_relative_names(self):
+        self.fake_disk(files_per_folder=2, folders_per_folder=1, depth=2, file_size=10)
+        self.temp_blob_cache()
+
+        response, archive = self.download(folder='/dir0')
+
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="dir0.zip"')
+        self.assertEqual(sorted(archive.namelist()),
+                         ['dir0/file0.bin', 'dir0/file1.bin', 'file0.bin', 'file1.bin'])
+
+    def test_selected_files(self):
+        self.fake_disk(file_size=100)
+        self.temp_blob_cache()
+
+        _, archive = self.download(paths=['/file1.bin', '/file3.bin'])
+
+        self.assertEqual(archive.namelist(), ['file1.bin', 'file3.bin'])
+        self.assertEqual(archive.read('file3.bin'), bytes(100))
+
+    def test_cached_member_is_not_downloaded(self):
+        disk = self.fake_disk(files_per_folder=1, file_size=100)
+        cache = self.temp_blob_cache()
+        md5 = hashlib.md5(b'/file0.bin').hexdigest()
+        writer = cache.writer(md5, verify=False)
+        writer.write(b'cached')
+        writer.commit()
+
+        _, archive = self.download(folder='/')
+
+        self.assertEqual(archive.read('file0.bin'), b'cached')
+        self.assertEqual(disk.calls['download'], 0)
+
+    def test_empty_selection(self):
+        response = self.client.post('/download/zip/', {'public_key': self.public_key})
+        self.assertContains(response, 'Не выбраны файлы для скачивания')
+
+
+class ListingApiTests(ExplorerTestCase):
+
+    def listing(self, **params):
+        headers = params.pop('headers', {})
+        return self.client.get('/api/listing/', dict({'public_key': self.public_key}, **params), headers=headers)
+
+    def test_cursor_walks_all_pages(self):
+        self.fake_disk(files_per_folder=25)
+        names, cursor = [], None
+        while True:
+            params = {'limit': 10}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.listing(**params).json()
+            names += [item['name'] for item in data['items']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(names, [f'file{i}.bin' for i in range(25)])
+        self.assertEqual(data['total'], 25)
+
+    def test_recursive_cursor(self):
+        self.fake_disk(files_per_folder=2, folders_per_folder=2, depth=1)
+        first = self.listing(recursive='1', limit=4).json()
+        second = self.listing(recursive='1', limit=4, cursor=first['next_cursor']).json()
+
+        paths = [item['raw_path'] for item in first['items'] + second['items']]
+        self.assertEqual(len(paths), 8)
+        self.assertEqual(len(set(paths)), 8)
+        self.assertIsNone(first['total'])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_cursor_is_bound_to_listing(self):
+        self.fake_disk(files_per_folder=5, folders_per_folder=1, depth=1)
+        cursor = self.listing(limit=2).json()['next_cursor']
+
+        response = self.listing(path='/dir0', limit=2, cursor=cursor)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'cursor относится к другому листингу')
+
+        response = self.listing(limit=2, cursor=cursor[:-2] + 'xx')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Некорректный cursor')
+
+    def test_etag_and_not_modified(self):
+        disk = self.fake_disk(files_per_folder=5)
+        response = self.listing(limit=2)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertNotEqual(self.listing(limit=3)['ETag'], etag)
+
+        response = self.listing(limit=2, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        # Содержимое папки изменилось — старый ETag больше не подходит
+        disk.files_per_folder = 6
+        self.reset_caches()
+        response = self.listing(limit=2, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_field_selection(self):
+        self.fake_disk(files_per_folder=1, file_size=42)
+        data = self.listing(fields='name,size').json()
+        self.assertEqual(data['items'], [{'name': 'file0.bin', 'size': 42}])
+
+        response = self.listing(fields='name,owner')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Неизвестные поля: owner')
+
+    def test_errors(self):
+        self.fake_disk()
+        self.assertEqual(self.listing(public_key='missing').status_code, 404)
+        self.assertEqual(self.listing(limit='many').status_code, 400)
+
+        self.client.logout()
+        self.assertEqual(self.listing().status_code, 401)
+
+
+def listing_page(path, names, total=None, offset=0):
+    """Ответ API листинга папки path; имена с «/» на конце — подпапки"""
+    items = [{
+        'name': name.rstrip('/'),
+        'type': 'dir' if name.endswith('/') else 'file',
+        'path': f"{path.rstrip('/')}/{name.rstrip('/')}",
+        'modified': '2024-01-01T00:00:00+00:00',
+    } for name in names]
+    return {'path': path, '_embedded': {
+        'items': items, 'offset': offset, 'path': path,
+        'total': len(names) if total is None else total,
+    }}
+
+
+class SearchIndexTests(ExplorerTestCase):
+
+    def indexed_paths(self):
+        return sorted(IndexedItem.objects.filter(public_key=self.public_key).values_list('path', flat=True))
+
+    def find(self, query):
+        return [item.name for item in search.search(self.public_key, query=query)]
+
+    def test_browsing_fills_index(self):
+        self.fake_disk(files_per_folder=15)
+        self.client.post('/', {'public_url': self.public_url})
+
+        response = self.client.get('/api/search/', {'public_key': self.public_key, 'q': 'file1'})
+
+        self.assertEqual([item['name'] for item in response.json()['items']],
+                         ['file1.bin', 'file10.bin', 'file11.bin', 'file12.bin', 'file13.bin', 'file14.bin'])
+
+    def test_fts_query_is_escaped(self):
+        names = ['say "hi".txt', 'a*b (copy).txt', 'NEAR OR AND.txt', 'report-2024.pdf', 'отчёт за май.docx']
+        search.index_listing(self.public_key, listing_page('/', names))
+
+        self.assertEqual(self.find('"hi'), ['say "hi".txt'])
+        self.assertEqual(self.find('(copy'), ['a*b (copy).txt'])
+        self.assertEqual(self.find('a*b'), ['a*b (copy).txt'])
+        self.assertEqual(self.find('OR NEAR'), ['NEAR OR AND.txt'])
+        self.assertEqual(self.find('rep 20'), ['report-2024.pdf'])
+        self.assertEqual(self.find('ОТЧ'), ['отчёт за май.docx'])
+        self.assertEqual(self.find('-'), [])
+
+    def test_complete_listing_prunes_missing_children(self):
+        search.index_listing(self.public_key, listing_page('/', ['docs/', 'old/', 'a.txt', 'b.txt']))
+        search.index_listing(self.public_key, listing_page('/old', ['sub/', 'c.txt']))
+        search.index_listing(self.public_key, listing_page('/old/sub', ['d.txt']))
+        search.index_listing(self.public_key, listing_page('/docs', ['e.txt']))
+
+        search.index_listing(self.public_key, listing_page('/', ['docs/', 'a.txt']))
+
+        self.assertEqual(self.indexed_paths(), ['/a.txt', '/docs', '/docs/e.txt'])
+        self.assertEqual(self.find('c'), [])
+
+    def test_partial_page_does_not_prune(self):
+        search.index_listing(self.public_key, listing_page('/', ['a.txt', 'b.txt', 'c.txt']))
+
+        search.index_listing(self.public_key, listing_page('/', ['a.txt'], total=3))
+        search.index_listing(self.public_key, listing_page('/', ['c.txt'], total=3, offset=2))
+
+        self.assertEqual(self.indexed_paths(), ['/a.txt', '/b.txt', '/c.txt'])
+
+    def test_emptied_folder_is_pruned(self):
+        search.index_listing(self.public_key, listing_page('/dir', ['a.txt', 'b.txt']))
+        search.index_listing(self.public_key, listing_page('/dir', []))
+        self.assertEqual(self.indexed_paths(), [])
+
+
+class ShareSyncTests(ExplorerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.disk = TreeDisk({
+            '/': {'docs/': None, 'a.txt': 'a1'},
+            '/docs': {'b.txt': 'b1', 'old/': None},
+            '/docs/old': {'c.txt': 'c1', 'deep/': None},
+            '/docs/old/deep': {'d.txt': 'd1'},
+        })
+        self.disk.install()
+
+    def crawler(self):
+        return AsyncCrawler(api=fake_async_client(self.disk), backoff=0)
+
+    def crawl(self):
+        index_crawl(self.public_key, self.crawler().crawl_sync(self.public_key))
+
+    def sync(self):
+        return ShareSyncer(self.crawler()).sync(self.public_key)
+
+    def indexed(self):
+        return dict(IndexedItem.objects.filter(public_key=self.public_key).values_list('path', 'md5'))
+
+    def changes(self):
+        return sorted(IndexChange.objects.filter(public_key=self.public_key).values_list('kind', 'path'))
+
+    def test_unchanged_root_needs_one_request(self):
+        self.crawl()
+        before = self.indexed()
+
+        result = self.sync()
+
+        self.assertFalse(result.has_changes)
+        self.assertEqual(result.api_calls, 1)
+        self.assertEqual(self.indexed(), before)
+        self.assertEqual(self.changes(), [])
+
+    def test_detects_added_removed_and_changed(self):
+        self.crawl()
+        self.disk.tree['/']['a.txt'] = 'a2'
+        self.disk.tree['/docs']['new.txt'] = 'n1'
+        del self.disk.tree['/docs']['old/']
+        self.disk.touch('/docs')
+
+        result = self.sync()
+
+        self.assertEqual(result.added, ['/docs/new.txt'])
+        self.assertEqual(result.removed, ['/docs/old'])
+        self.assertCountEqual(result.changed, ['/docs', '/a.txt'])
+        # Корень и изменившаяся /docs; удалённое поддерево не запрашивается
+        self.assertEqual(result.api_calls, 2)
+        self.assertEqual(self.indexed(), {
+            '/docs': '', '/a.txt': 'a2', '/docs/b.txt': 'b1', '/docs/new.txt': 'n1',
+        })
+        self.assertEqual(self.changes(), [
+            ('added', '/docs/new.txt'), ('changed', '/a.txt'), ('changed', '/docs'), ('removed', '/docs/old'),
+        ])
+
+    def test_browsing_does_not_hide_changes(self):
+        self.crawl()
+        self.disk.tree['/docs']['new.txt'] = 'n1'
+        self.disk.touch('/docs')
+
+        # Просмотр между обходом и синхронизацией не трогает снимок
+        for path in ('/', '/docs'):
+            self.client.post('/', {'public_url': self.public_url, 'path': path})
+        self.assertNotIn('/docs/new.txt', self.indexed())
+
+        result = self.sync()
+
+        self.assertEqual(result.added, ['/docs/new.txt'])
+        self.assertEqual(result.changed, ['/docs'])
+
+    def test_first_sync_replaces_browsed_rows(self):
+        self.client.post('/', {'public_url': self.public_url, 'path': '/docs'})
+        self.assertEqual(set(self.indexed()), {'/docs/b.txt', '/docs/old'})
+
+        result = self.sync()
+
+        self.assertEqual(len(result.added), 7)
+        self.assertEqual(set(self.indexed()), {
+            '/docs', '/a.txt', '/docs/b.txt', '/docs/old', '/docs/old/c.txt', '/docs/old/deep', '/docs/old/deep/d.txt',
+        })
+        self.assertEqual(IndexedShare.objects.get(public_key=self.public_key).item_count, 7)
+
+
+class CacheWarmerTests(ExplorerTestCase):
+
+    def test_warmed_share_is_served_from_cache(self):
+        disk = self.fake_disk(files_per_folder=30, folders_per_folder=2, depth=1)
+        warmer = CacheWarmer(public_keys=[self.public_key])
+
+        self.assertEqual(warmer.warm_share(self.public_key), disk.walk_size())
+        warmed_calls = disk.calls['listing']
+        self.assertGreater(warmed_calls, 0)
+
+        response = self.client.post('/', {'public_url': self.public_url})
+        self.assertContains(response, 'file29.bin')
+        self.assertEqual(disk.calls['listing'], warmed_calls)
+
+    def test_margin_controls_refresh(self):
+        disk = self.fake_disk(files_per_folder=5)
+        warmer = CacheWarmer(public_keys=[self.public_key], margin=0)
+        warmer.warm_share(self.public_key)
+        calls = disk.calls['listing']
+
+        # Свежие записи повторно не запрашиваются
+        warmer.warm_share(self.public_key)
+        self.assertEqual(disk.calls['listing'], calls)
+
+        # Записи, истекающие в пределах margin, обновляются
+        CacheWarmer(public_keys=[self.public_key], margin=10 ** 6).warm_share(self.public_key)
+        self.assertEqual(disk.calls['listing'], 2 * calls)
+
+    def test_run_once_skips_failed_shares_and_purges(self):
+        self.fake_disk(files_per_folder=3)
+        for i in range(5):
+            FileCache.set(f'expired{i}', {'i': i}, ttl=-1)
+        FileCache.set('fresh', {'i': 0})
+
+        warmed, purged = CacheWarmer(public_keys=['missing', self.public_key], batch_size=2).run_once()
+
+        self.assertEqual(warmed, {self.public_key: 3})
+        self.assertEqual(purged, 5)
+        self.assertFalse(FileCache.objects.filter(cache_key__startswith='expired').exists())
+        self.assertEqual(FileCache.get('fresh'), {'i': 0})
+
+    def test_scheduler_is_opt_in(self):
+        with override_settings(WARM_SCHEDULER_ENABLED=False, WARM_PUBLIC_KEYS=[self.public_key]):
+            self.assertIsNone(start_scheduler())
+        with override_settings(WARM_SCHEDULER_ENABLED=True, WARM_PUBLIC_KEYS=[]):
+            self.assertIsNone(start_scheduler())
+
+        with override_settings(WARM_SCHEDULER_ENABLED=True, WARM_PUBLIC_KEYS=[self.public_key]), \
+                mock.patch.object(CacheWarmer, 'start') as start:
+            warmer = start_scheduler()
+        start.assert_called_once_with()
+        self.assertEqual(warmer.public_keys, [self.public_key])
+
+    def test_only_one_process_warms(self):
+        with tempfile.TemporaryDirectory() as lock_dir:
+            # Каждый CacheWarmer открывает свой файл блокировки, как отдельный воркер
+            warmers = [CacheWarmer(public_keys=[self.public_key], lock_dir=lock_dir) for _ in range(2)]
+            runs = [threading.Event(), threading.Event()]
+            for warmer, ran in zip(warmers, runs):
+                warmer.run_once = ran.set
+            first, second = warmers
+
+            first.start(interval=0.05)
+            self.assertTrue(runs[0].wait(5))
+            second.start(interval=0.05)
+            time.sleep(0.3)
+            self.assertFalse(runs[1].is_set())
+
+            # Ведущий остановился — прогрев подхватывает другой процесс
+            first.stop()
+            first._thread.join(5)
+            self.assertTrue(runs[1].wait(5))
+            second.stop()
+            second._thread.join(5)
+
+
+class FileCacheTests(ExplorerTestCase):
+
+    def stored(self, key):
+        return FileCache.objects.values_list('payload', 'encoding').get(cache_key=key)
+
+    def test_small_values_are_stored_raw(self):
+        FileCache.set('small', {'name': 'файл'})
+        payload, encoding = self.stored('small')
+        self.assertEqual(encoding, FileCache.RAW)
+        self.assertEqual(json.loads(bytes(payload)), {'name': 'файл'})
+        self.assertEqual(FileCache.get('small'), {'name': 'файл'})
+
+    @override_settings(FILE_CACHE_COMPRESSION='zlib', FILE_CACHE_COMPRESS_MIN_SIZE=100)
+    def test_zlib_round_trip(self):
+        value = {'items': [{'name': f'file{i}.bin'} for i in range(100)]}
+        FileCache.set('big', value)
+        payload, encoding = self.stored('big')
+        self.assertEqual(encoding, FileCache.ZLIB)
+        self.assertLess(len(payload), len(json.dumps(value)))
+        self.assertEqual(FileCache.get('big'), value)
+
+    @skipUnless(zstandard, 'zstandard is not installed')
+    @override_settings(FILE_CACHE_COMPRESSION='zstd', FILE_CACHE_COMPRESS_MIN_SIZE=100)
+    def test_zstd_round_trip(self):
+        value = {'items': [{'name': f'file{i}.bin'} for i in range(100)]}
+        FileCache.set('big', value)
+        self.assertEqual(self.stored('big')[1], FileCache.ZSTD)
+        self.assertEqual(FileCache.get('big'), value)
+
+    def test_set_overwrites_existing_row(self):
+        FileCache.set('key', {'v': 1}, ttl=-1)
+        self.assertIsNone(FileCache.get('key'))
+        self.assertEqual(FileCache.get('key', include_expired=True), {'v': 1})
+
+        FileCache.set('key', {'v': 2})
+
+        self.assertEqual(FileCache.objects.filter(cache_key='key').count(), 1)
+        self.assertEqual(FileCache.get('key'), {'v': 2})
+
+    def test_corrupt_row_is_deleted(self):
+        FileCache.set('key', {'v': 1})
+        for payload, encoding in ((b'not zlib', FileCache.ZLIB), (b'{broken', FileCache.RAW),
+                                  (b'not zstd', FileCache.ZSTD)):
+            FileCache.objects.filter(cache_key='key').update(payload=payload, encoding=encoding)
+            self.assertIsNone(FileCache.get('key'))
+            self.assertFalse(FileCache.objects.filter(cache_key='key').exists())
+            FileCache.set('key', {'v': 1})
+
+    def test_clear_expired_in_batches(self):
+        for i in range(7):
+            FileCache.set(f'expired{i}', {'i': i}, ttl=-1)
+        FileCache.set('fresh', {'i': 0})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(FileCache.clear_expired(batch_size=2), 7)
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 4)
+        self.assertEqual(list(FileCache.objects.values_list('cache_key', flat=True)), ['fresh'])
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def run_concurrently(self, flight, fn, callers=8):
+        """callers одновременных flight.do(); результаты или исключения по порядку"""
+        release = threading.Event()
+
+        def blocked():
+            release.wait(5)
+            return fn()
+
+        def call():
+            try:
+                return flight.do('key', blocked)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=callers) as executor:
+            futures = [executor.submit(call)]
+            wait_for(lambda: 'key' in flight._calls)
+            futures += [executor.submit(call) for _ in range(callers - 1)]
+            # Остальные вызовы должны успеть встать в ожидание лидера
+            time.sleep(0.1)
+            release.set()
+            return [future.result() for future in futures]
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        fetch = CountingFetch()
+
+        results = self.run_concurrently(flight, fetch)
+
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(results[0], ({'call': 1}, False))
+        self.assertEqual(results[1:], [({'call': 1}, True)] * 7)
+        self.assertEqual(flight._calls, {})
+
+    def test_error_is_raised_in_every_caller(self):
+        flight = SingleFlight()
+        error = UpstreamUnavailable('API недоступен')
+
+        def fail():
+            raise error
+
+        self.assertEqual(self.run_concurrently(flight, fail), [error] * 8)
+        # После ошибки ключ освобождается и следующий вызов выполняется заново
+        self.assertEqual(flight.do('key', lambda: 'ok'), ('ok', False))
+
+    async def test_async_calls_share_one_task(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'data'
+
+        results = await asyncio.gather(*(flight.ado('key', fetch) for _ in range(5)))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [('data', False)] + [('data', True)] * 4)
+        self.assertEqual(flight._tasks, {})
+
+    async def test_cancelled_async_leader_does_not_cancel_waiters(self):
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return 'data'
+
+        leader = asyncio.ensure_future(flight.ado('key', fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.ado('key', fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        self.assertEqual(await waiter, ('data', True))
+
+    def test_process_lock_excludes_other_holders(self):
+        with tempfile.TemporaryDirectory() as lock_dir:
+            with ProcessLock('key', lock_dir=lock_dir) as first:
+                with ProcessLock('key', lock_dir=lock_dir, timeout=0.1) as second:
+                    self.assertTrue(first.locked)
+                    self.assertFalse(second.locked)
+            with ProcessLock('key', lock_dir=lock_dir) as third:
+                self.assertTrue(third.locked)
+        self.assertFalse(ProcessLock('key', lock_dir=None).enabled)
+
+    def test_process_lock_keys_do_not_block_each_other(self):
+        def stripe(key):
+            return int(hashlib.sha256(key.encode('utf-8')).hexdigest(), 16) % 256
+
+        # Ключ, который при распределении по 256 файлам делил бы файл с 'a'
+        neighbour = next(key for key in map(str, range(10000)) if stripe(key) == stripe('a'))
+        with tempfile.TemporaryDirectory() as lock_dir:
+            def acquire(key):
+                with ProcessLock(key, lock_dir=lock_dir, timeout=0) as lock:
+                    return lock.locked
+
+            with ProcessLock('a', lock_dir=lock_dir) as held:
+                self.assertTrue(held.locked)
+                self.assertTrue(acquire(neighbour))
+                # Другой поток процесса тоже не ждёт
+                with ThreadPoolExecutor(1) as pool:
+                    self.assertTrue(pool.submit(acquire, neighbour).result())
+                self.assertFalse(acquire('a'))
+
+
+class ListingCacheSingleFlightTests(ExplorerTestCase):
+    params = {'public_key': 'key', 'path': '/', 'offset': 0, 'limit': 20}
+
+    def test_concurrent_misses_fetch_once(self):
+        cache = ListingCache(memory=LRUCache(), ttl=60)
+        fetch = CountingFetch(delay=0.2)
+
+        def get():
+            try:
+                return cache.get_or_fetch(self.params, fetch)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: get(), range(8)))
+
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(results, [{'call': 1}] * 8)
+
+
+def scripted(*responses):
+    """respond() для LocalServer: ответы по очереди, последний повторяется"""
+    responses = list(responses)
+
+    def respond(handler):
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+
+    return respond
+
+
+class ApiRetryTests(SimpleTestCase):
+    unavailable = json_response({'message': 'Service unavailable'}, 503, {'Retry-After': '0'})
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    def make_client(self, client_class=YandexClient, **kwargs):
+        self.limiter = CountingLimiter()
+        self.breaker = CircuitBreaker(failure_threshold=10, reset_timeout=60)
+        return client_class(limiter=self.limiter, breaker=self.breaker, **kwargs)
+
+    def call(self, client, server):
+        try:
+            return client.call_api(f'{server.url}/resources', {'path': '/'})
+        finally:
+            client.close()
+
+    def test_status_retries_belong_to_call_api(self):
+        client = self.make_client(retries=2)
+        with LocalServer(scripted(self.unavailable)) as server:
+            with self.assertRaises(UpstreamUnavailable) as raised:
+                self.call(client, server)
+
+        # Один повтор call_api; адаптер ответы со статусом не повторяет,
+        # поэтому каждое обращение видно лимитеру и выключателю
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(self.limiter.acquired, 2)
+        self.assertEqual(self.breaker._failures, 2)
+        self.assertEqual(raised.exception.retry_after, 0)
+
+    def test_retry_after_then_success(self):
+        client = self.make_client()
+        rate_limited = json_response({'message': 'Too many requests'}, 429, {'Retry-After': '0'})
+        with LocalServer(scripted(rate_limited, json_response({'ok': True}))) as server:
+            response = self.call(client, server)
+
+        self.assertEqual(response.json(), {'ok': True})
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(self.breaker._failures, 0)
+
+    def test_long_retry_after_fails_fast(self):
+        client = self.make_client(retry_after_max=1)
+        for status in (429, 503):
+            with self.subTest(status=status), LocalServer(scripted(
+                json_response({'message': 'Slow down'}, status, {'Retry-After': '120'})
+            )) as server:
+                started = time.perf_counter()
+                with self.assertRaises(UpstreamUnavailable) as raised:
+                    self.call(client, server)
+                self.assertLess(time.perf_counter() - started, 1)
+                self.assertEqual(len(server.requests), 1)
+                self.assertEqual(raised.exception.retry_after, 120)
+
+                # Лимитер запомнил Retry-After: следующий запрос не уходит в API
+                with self.assertRaises(UpstreamUnavailable):
+                    self.call(client, server)
+                self.assertEqual(len(server.requests), 1)
+            self.limiter = client.limiter = CountingLimiter()
+
+    def test_error_without_retry_after_is_not_retried(self):
+        client = self.make_client()
+        with LocalServer(scripted(json_response({}, 500))) as server:
+            with self.assertRaises(UpstreamUnavailable):
+                self.call(client, server)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_breaker_opens_and_recovers_with_probe(self):
+        client = self.make_client()
+        client.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+        with LocalServer(scripted(json_response({}, 500), json_response({}, 500), json_response({'ok': True}))) as server:
+            for _ in range(2):
+                with self.assertRaises(UpstreamUnavailable):
+                    self.call(client, server)
+            self.assertEqual(client.breaker.state, CircuitBreaker.OPEN)
+
+            with self.assertRaises(UpstreamUnavailable) as raised:
+                self.call(client, server)
+            self.assertEqual(raised.exception.retry_after, 0.2)
+            self.assertEqual(len(server.requests), 2)
+
+            time.sleep(0.25)
+            self.assertEqual(client.breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertEqual(self.call(client, server).json(), {'ok': True})
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_async_client_retries_once(self):
+        client = self.make_client(AsyncYandexClient)
+        with LocalServer(scripted(self.unavailable)) as server:
+            try:
+                with self.assertRaises(UpstreamUnavailable):
+                    await client.call_api(f'{server.url}/resources', {'path': '/'})
+            finally:
+                await client.aclose()
+
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(self.breaker._failures, 2)
+
+
+class UpstreamFailureViewTests(ExplorerTestCase):
+
+    def test_listing_api_returns_503_with_retry_after(self):
+        self.fake_disk(error_rate=1.0)
+        response = self.client.get('/api/listing/', {'public_key': self.public_key})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '0')
+        self.assertIn('503', response.json()['error'])
+
+    def test_open_breaker_retry_after(self):
+        self.fake_disk()
+        yandex_client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        yandex_client.breaker.record_failure()
+
+        response = self.client.get('/api/listing/', {'public_key': self.public_key})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+    def test_stale_listing_is_served_while_api_fails(self):
+        disk = self.fake_disk(files_per_folder=3)
+        cache = ListingCache(memory=LRUCache(), ttl=0, stale_ttl=0)
+        with mock.patch('explorer.views.listing_cache', cache):
+            self.client.get('/api/listing/', {'public_key': self.public_key})
+            disk.error_rate = 1.0
+            response = self.client.get('/api/listing/', {'public_key': self.public_key})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['items']), 3)
+        self.assertEqual(cache.stats()['fallback'], 1)
+
+
+class PreviewViewTests(ExplorerTestCase):
+    md5 = hashlib.md5(b'/file0.bin').hexdigest()
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = PreviewCache(store=BlobCache(root=directory.name, max_file_size=MB, key_re=KEY_RE), workers=2)
+        patch = mock.patch('explorer.views.preview_cache', self.cache)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def preview(self, headers=None, **params):
+        params = dict({'public_key': self.public_key, 'path': '/file0.bin', 'md5': self.md5}, **params)
+        return self.client.get('/preview/', params, headers=headers or {})
+
+    def test_preview_is_downloaded_once(self):
+        disk = self.fake_disk()
+
+        for _ in range(2):
+            response = self.preview()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), FakeDisk.PREVIEW)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertEqual(response['Cache-Control'], PreviewView.CACHE_CONTROL)
+            self.assertEqual(response['ETag'], f'"{self.md5}-S"')
+        self.assertEqual((disk.calls['listing'], disk.calls['preview']), (1, 1))
+
+        self.preview(size='XL')
+        self.assertEqual(disk.calls['preview'], 2)
+
+    def test_if_none_match_skips_api(self):
+        disk = self.fake_disk()
+        response = self.preview(headers={'If-None-Match': f'"{self.md5}-S"'})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], f'"{self.md5}-S"')
+        self.assertEqual(disk.calls['listing'], 0)
+
+    def test_invalid_parameters(self):
+        self.fake_disk()
+        self.assertEqual(self.preview(md5='../etc/passwd').status_code, 400)
+        self.assertEqual(self.preview(size='S/../x').status_code, 400)
+        self.assertEqual(self.preview(path='').status_code, 400)
+
+    def test_md5_must_match_file(self):
+        disk = self.fake_disk()
+        response = self.preview(path='/file1.bin')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(disk.calls['preview'], 0)
+        self.assertIsNone(self.cache.get(self.md5, 'S'))
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.preview().status_code, 403)
+
+    def test_prefetch_downloads_missing_previews_of_page_size(self):
+        disk = self.fake_disk()
+        items = [
+            {'md5': hashlib.md5(f'/file{i}.bin'.encode()).hexdigest(),
+             'preview': f'{DOWNLOAD_HOST}/preview/file{i}.bin?size={size}'}
+            for i, size in enumerate(['S', 'S', 'M'])
+        ]
+
+        futures = self.cache.prefetch(items + [{'md5': 'f' * 32}])
+
+        self.assertEqual(len(futures), 2)
+        self.assertTrue(all(future.result() for future in futures))
+        self.assertEqual(disk.calls['preview'], 2)
+        self.assertEqual(self.cache.prefetch(items), [])
+
+
+class MetricsTests(SimpleTestCase):
+
+    def test_histogram_and_counter_rendering(self):
+        registry = Registry()
+        latency = registry.histogram('test_seconds', 'Время', ('view',), buckets=(0.1, 1.0))
+        events = registry.counter('test_total', 'События', ('kind',))
+        for value in (0.05, 0.5, 2.0):
+            latency.observe(value, view='say "hi"')
+        events.inc(kind='a')
+        events.inc(3, kind='a')
+
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP test_seconds Время',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="say \\"hi\\"",le="0.1"} 1',
+            'test_seconds_bucket{view="say \\"hi\\"",le="1.0"} 2',
+            'test_seconds_bucket{view="say \\"hi\\"",le="+Inf"} 3',
+            'test_seconds_sum{view="say \\"hi\\""} 2.55',
+            'test_seconds_count{view="say \\"hi\\""} 3',
+            '# HELP test_total События',
+            '# TYPE test_total counter',
+            'test_total{kind="a"} 4',
+        ])
+
+    def test_server_timing(self):
+        request_metrics = RequestMetrics()
+        request_metrics.add(upstream_time=0.25, api_calls=2, cache_hits=3, cache_misses=1, render_time=0.01)
+
+        self.assertRegex(request_metrics.server_timing(), re.escape(
+            'upstream;dur=250.0;desc="2 API calls", cache;desc="3 hit, 1 miss, ratio 0.75", render;dur=10.0, '
+        ) + r'total;dur=\d+\.\d$')
+
+    def test_log_sampled(self):
+        logger = logging.getLogger('explorer.tests.sampled')
+        formatted = []
+
+        class Value:
+            def __repr__(self):
+                formatted.append(1)
+                return 'x' * 50
+
+        logger.setLevel(logging.INFO)
+        log_sampled(logger, "value: %s", Value())
+        self.assertEqual(formatted, [])
+
+        logger.setLevel(logging.DEBUG)
+        with override_settings(DEBUG_LOG_SAMPLE_RATE=0):
+            with self.assertNoLogs(logger):
+                log_sampled(logger, "value: %s", Value())
+        with override_settings(DEBUG_LOG_SAMPLE_RATE=1, DEBUG_LOG_MAX_CHARS=10):
+            with self.assertLogs(logger, logging.DEBUG) as logs:
+                log_sampled(logger, "value: %s", Value())
+        self.assertEqual(logs.records[0].getMessage(), 'value: xxxxxxxxxx... (50 chars)')
+        self.assertEqual(len(formatted), 1)
+
+
+class MetricsViewTests(ExplorerTestCase):
+
+    def test_server_timing_header(self):
+        self.fake_disk(files_per_folder=5)
+
+        response = self.client.post('/', {'public_url': self.public_url})
+        self.assertIn('desc="1 API calls"', response['Server-Timing'])
+        self.assertIn('cache;desc="0 hit, 1 miss, ratio 0.00"', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+        response = self.client.post('/', {'public_url': self.public_url})
+        self.assertIn('desc="0 API calls"', response['Server-Timing'])
+        self.assertIn('cache;desc="1 hit, 0 miss, ratio 1.00"', response['Server-Timing'])
+
+    def test_metrics_endpoint(self):
+        self.fake_disk(files_per_folder=5)
+        self.client.post('/', {'public_url': self.public_url})
+
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('explorer_http_request_duration_seconds_count{view="index",method="POST",status="200"}', body)
+        self.assertIn('explorer_upstream_request_duration_seconds_count{endpoint="resources",status="200"}', body)
+        self.assertIn('explorer_template_render_duration_seconds_count{template="index.html"}', body)
+        self.assertIn('explorer_cache_events_total{cache="listing",event="miss"}', body)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer other'}).status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code, 200)
+
+
+class FolderStatsTests(ExplorerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.disk = TreeDisk({
+            '/': {'docs/': None, 'a.txt': 'a1'},
+            '/docs': {'b.txt': 'b1', 'old/': None},
+            '/docs/old': {'c.txt': 'c1', 'deep/': None},
+            '/docs/old/deep': {'d.txt': 'd1'},
+        }, file_size=100)
+        self.disk.install()
+        crawler = AsyncCrawler(api=fake_async_client(self.disk), backoff=0)
+        index_crawl(self.public_key, crawler.crawl_sync(self.public_key))
+
+    def sync(self):
+        return ShareSyncer(AsyncCrawler(api=fake_async_client(self.disk), backoff=0)).sync(self.public_key)
+
+    def summary(self):
+        return {
+            row.path: (row.file_count, row.dir_count, row.total_size, row.mime_types)
+            for row in FolderStats.objects.filter(public_key=self.public_key)
+        }
+
+    def assert_matches_rebuild(self):
+        updated = self.summary()
+        stats.rebuild(self.public_key)
+        self.assertEqual(updated, self.summary())
+
+    def test_crawl_builds_subtree_stats(self):
+        root = stats.get_stats(self.public_key, 'disk:/')
+        self.assertEqual((root.file_count, root.dir_count, root.total_size), (4, 3, 400))
+        self.assertEqual(root.mime_types, {'unknown': {'count': 4, 'size': 400}})
+
+        old = stats.get_stats(self.public_key, '/docs/old/')
+        self.assertEqual((old.file_count, old.dir_count, old.total_size), (2, 1, 200))
+        self.assertEqual(stats.serialize(old)['path'], '/docs/old')
+
+    def test_update_after_add_remove_and_resize(self):
+        self.disk.tree['/docs/old/deep']['e.txt'] = 'e1'
+        self.disk.touch('/docs/old/deep')
+        del self.disk.tree['/docs']['b.txt']
+        self.disk.touch('/docs')
+        self.disk.tree['/']['a.txt'] = 'a2'
+        self.disk.sizes['/a.txt'] = 1000
+        self.disk.touch('/')
+
+        self.sync()
+
+        self.assertEqual(self.summary()['/'][:3], (4, 3, 1300))
+        self.assertEqual(self.summary()['/docs/old/deep'][:3], (2, 0, 200))
+        self.assert_matches_rebuild()
+
+    def test_update_after_removed_subtree(self):
+        del self.disk.tree['/docs']['old/']
+        self.disk.touch('/docs')
+
+        self.sync()
+
+        self.assertEqual(set(self.summary()), {'/', '/docs'})
+        self.assertEqual(self.summary()['/'][:3], (2, 1, 200))
+        self.assert_matches_rebuild()
+
+    def test_unknown_folder(self):
+        self.assertIsNone(stats.get_stats(self.public_key, '/missing'))
+        self.assertIsNone(stats.get_stats('other', '/'))
+        self.assertIsNone(stats.serialize(None))
+
+    def test_stats_are_memoized_until_rebuild(self):
+        self.assertIsNone(stats.get_stats('other', '/'))
+        self.assertEqual(stats.get_stats(self.public_key, '/').file_count, 4)
+        with self.assertNumQueries(0):
+            self.assertIsNone(stats.get_stats('other', '/'))
+            self.assertEqual(stats.get_stats(self.public_key, 'disk:/').file_count, 4)
+
+        stats.rebuild(self.public_key)
+        self.assertEqual(len(stats.memo), 0)
+
+
+class WarmListingTests(ExplorerTestCase):
+
+    def test_warm_listing_request_makes_no_queries(self):
+        self.fake_disk(files_per_folder=30)
+        self.client.post('/', {'public_url': self.public_url})
+        with self.assertNumQueries(0):
+            response = self.client.post('/', {'public_url': self.public_url})
+        self.assertContains(response, 'file29.bin')
+
+
+class UserInfoTests(ExplorerTestCase):
+
+    def reply(self, data, status=200):
+        return mock.Mock(status_code=status, **{'json.return_value': data})
+
+    def callback(self, user_info):
+        token = self.reply({'access_token': 'fresh', 'refresh_token': 'r', 'expires_in': 3600})
+        with mock.patch.object(yandex_client, 'exchange_code', return_value=token), \
+                mock.patch.object(yandex_client, 'get_user_info', return_value=user_info):
+            return self.client.get('/oauth/yandex/callback/', {'code': 'c'})
+
+    def test_profile_is_fetched_once_at_login(self):
+        response = self.callback(self.reply({'login': 'u', 'real_name': 'User', 'default_email': 'u@ya.ru'}))
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertEqual(self.client.session['yandex_user'], {'login': 'u', 'name': 'User', 'email': 'u@ya.ru'})
+
+    def test_rejected_token(self):
+        with self.assertRaises(AuthenticationFailed):
+            _user_info(self.reply({}, status=401))
+        with self.assertRaises(UpstreamUnavailable):
+            _user_info(self.reply({}, status=500))
+        response = self.callback(self.reply({}, status=401))
+        self.assertContains(response, 'OAuth-токен недействителен')
+
+
+class SessionSettingsTests(SimpleTestCase):
+    """Выбор хранилища сессий в settings.py по переменным окружения"""
+
+    def load(self, **env):
+        with mock.patch.dict(os.environ, {'SESSION_BACKEND': '', 'REDIS_URL': ''}):
+            for name in ('SESSION_BACKEND', 'REDIS_URL'):
+                os.environ.pop(name)
+            os.environ.update(env)
+            return runpy.run_path(str(settings.BASE_DIR / 'yadisk_explorer' / 'settings.py'))
+
+    def test_defaults(self):
+        loaded = self.load()
+        self.assertEqual(loaded['SESSION_ENGINE'], 'django.contrib.sessions.backends.cached_db')
+        self.assertEqual(loaded['CACHES']['sessions']['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+
+        loaded = self.load(REDIS_URL='redis://localhost:6379/0')
+        self.assertEqual(loaded['SESSION_ENGINE'], 'django.contrib.sessions.backends.cache')
+        self.assertEqual(loaded['CACHES']['sessions']['BACKEND'], 'django.core.cache.backends.redis.RedisCache')
+
+        loaded = self.load(SESSION_BACKEND='db')
+        self.assertEqual(loaded['SESSION_ENGINE'], 'django.contrib.sessions.backends.db')
+
+    def test_signed_cookies_and_unknown_backends_are_refused(self):
+        for backend in ('signed_cookies', 'file', 'django.contrib.sessions.backends.signed_cookies'):
+            with self.subTest(backend=backend), self.assertRaises(ImproperlyConfigured):
+                self.load(SESSION_BACKEND=backend)
+
+
+class TokenRefreshMiddlewareTests(SimpleTestCase):
+    """Обновление токена в синхронном (__call__) и асинхронном (__acall__) вызове"""
+
+    MODES = ('sync', 'async')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    def session(self, expires_in):
+        session = SessionStore()
+        session.update({
+            TOKEN_KEY: 'old', REFRESH_TOKEN_KEY: 'refresh', EXPIRES_KEY: int(time.time()) + expires_in,
+            'yandex_user': {'login': 'u'},
+        })
+        return session
+
+    def reply(self, status, data=None):
+        return mock.Mock(status_code=status, **{'json.return_value': data or {}})
+
+    def network_error(self, mode):
+        return requests.ConnectionError('down') if mode == 'sync' else httpx.ConnectError('down')
+
+    def refresh(self, mode, session, middleware=None, **kwargs):
+        """Пропускает запрос через middleware; возвращает мок refresh_token"""
+        request = self.request(session)
+        if mode == 'sync':
+            middleware = middleware or TokenRefreshMiddleware(lambda request: HttpResponse())
+            with mock.patch.object(yandex_client, 'refresh_token', **kwargs) as refresh:
+                middleware(request)
+            return refresh
+
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = middleware or TokenRefreshMiddleware(get_response)
+        with mock.patch.object(async_yandex_client, 'refresh_token', new_callable=mock.AsyncMock, **kwargs) as refresh:
+            async_to_sync(middleware)(request)
+        return refresh
+
+    def test_fresh_token_is_not_refreshed(self):
+        for mode in self.MODES:
+            with self.subTest(mode=mode):
+                session = self.session(expires_in=7200)
+                self.assertFalse(self.refresh(mode, session).called)
+                self.assertEqual(session[TOKEN_KEY], 'old')
+
+    def test_successful_refresh_updates_session(self):
+        for mode in self.MODES:
+            with self.subTest(mode=mode):
+                session = self.session(expires_in=60)
+                reply = self.reply(200, {'access_token': 'new', 'refresh_token': 'refresh2', 'expires_in': 7200})
+                refresh = self.refresh(mode, session, return_value=reply)
+
+                refresh.assert_called_once_with('refresh')
+                self.assertEqual((session[TOKEN_KEY], session[REFRESH_TOKEN_KEY]), ('new', 'refresh2'))
+                self.assertGreater(session[EXPIRES_KEY], time.time() + 3600)
+                self.assertEqual(session['yandex_user'], {'login': 'u'})
+
+    def test_rejected_refresh_token_flushes_session(self):
+        for mode in self.MODES:
+            for status in (400, 401):
+                with self.subTest(mode=mode, status=status):
+                    session = self.session(expires_in=60)
+                    self.refresh(mode, session, return_value=self.reply(status))
+                    self.assertNotIn(TOKEN_KEY, session)
+                    self.assertNotIn('yandex_user', session)
+
+    def test_failed_refresh_keeps_valid_token_and_drops_expired(self):
+        for mode in self.MODES:
+            for failure in ({'side_effect': self.network_error(mode)}, {'return_value': self.reply(503)}):
+                with self.subTest(mode=mode, failure=failure):
+                    session = self.session(expires_in=60)
+                    self.refresh(mode, session, **failure)
+                    self.assertEqual(session[TOKEN_KEY], 'old')
+
+                    session = self.session(expires_in=-1)
+                    self.refresh(mode, session, **failure)
+                    self.assertNotIn(TOKEN_KEY, session)
+
+    def request(self, session):
+        request = RequestFactory().get('/')
+        request.session = session
+        return request
+
+    def test_concurrent_refreshes_are_coalesced(self):
+        reply = self.reply(200, {'access_token': 'new', 'expires_in': 7200})
+        sessions = [self.session(expires_in=60) for _ in range(4)]
+        middleware = TokenRefreshMiddleware(lambda request: HttpResponse())
+        release = threading.Event()
+
+        def slow_refresh(refresh_token):
+            release.wait(5)
+            return reply
+
+        with mock.patch.object(yandex_client, 'refresh_token', side_effect=slow_refresh) as refresh, \
+                ThreadPoolExecutor(len(sessions)) as pool:
+            futures = [pool.submit(middleware, self.request(session)) for session in sessions]
+            time.sleep(0.2)
+            release.set()
+            for future in futures:
+                future.result()
+
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual({session[TOKEN_KEY] for session in sessions}, {'new'})
+
+    async def test_concurrent_async_refreshes_are_coalesced(self):
+        reply = self.reply(200, {'access_token': 'new', 'expires_in': 7200})
+        sessions = [self.session(expires_in=60) for _ in range(4)]
+
+        async def get_response(request):
+            return HttpResponse()
+
+        async def slow_refresh(refresh_token):
+            await asyncio.sleep(0.05)
+            return reply
+
+        middleware = TokenRefreshMiddleware(get_response)
+        with mock.patch.object(async_yandex_client, 'refresh_token', side_effect=slow_refresh) as refresh:
+            await asyncio.gather(*(middleware(self.request(session)) for session in sessions))
+
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual({session[TOKEN_KEY] for session in sessions}, {'new'})
+
+
+class RateLimiterTests(SimpleTestCase):
+    """Лимитер с настройками по умолчанию"""
+
+    def test_calls_without_token_use_only_global_bucket(self):
+        limiter = RateLimiter()
+        burst = settings.YANDEX_API_BURST
+        # Лимит одного токена исчерпался бы после YANDEX_API_TOKEN_BURST запросов
+        waits = [limiter._reserve(None) for _ in range(burst + settings.YANDEX_API_RATE_LIMIT)]
+        self.assertEqual(waits[:burst], [0.0] * burst)
+        self.assertLessEqual(max(waits), 1.0 + 0.01)
+        self.assertEqual(limiter._buckets, {})
+
+    def test_token_calls_are_limited_per_token(self):
+        limiter = RateLimiter()
+        for _ in range(settings.YANDEX_API_TOKEN_BURST):
+            self.assertEqual(limiter._reserve('a'), 0.0)
+        self.assertGreater(limiter._reserve('a'), 0.0)
+        self.assertEqual(limiter._reserve('b'), 0.0)
+        self.assertEqual(limiter._reserve(None), 0.0)
+
+    def test_retry_after_without_token_blocks_global_bucket(self):
+        limiter = RateLimiter()
+        limiter.retry_after(None, 60)
+        with self.assertRaises(UpstreamUnavailable):
+            limiter._reserve('a')
+
+
+class DefaultLimiterViewTests(ExplorerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Настоящий лимитер вместо отключённого в ExplorerTestCase
+        yandex_client.limiter = RateLimiter()
+
+    def test_recursive_listing_is_not_capped_by_token_limit(self):
+        disk = self.fake_disk(files_per_folder=1, folders_per_folder=6, depth=2)
+        response = self.client.post('/', {'public_url': self.public_url, 'recursive': '1'})
+        self.assertIsNone(response.context['error'])
+        self.assertEqual(disk.calls['listing'], 43)
+        self.assertIn('/dir5/dir5/file0.bin', [item['raw_path'] for item in response.context['files']])
+        # Запросы без токена не попадают в корзины токенов
+        self.assertEqual(yandex_client.limiter._buckets, {})
+
+
+@tag('benchmark')
+@skipUnless(BENCHMARKS, 'бенчмарки запускаются с EXPLORER_BENCHMARKS=1')
+class BenchmarkCase(ExplorerTestCase):
+    """Бенчмарк: замеры печатаются в stderr"""
+
+    def report(self, name, value, unit):
+        sys.stderr.write(f'\n[bench] {self.__class__.__name__}.{name}: {value:.2f} {unit}')
+
+    def timed(self, fn, repeat):
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    def report_latency(self, name, durations):
+        durations = sorted(durations)
+        self.report(f'{name}.p50', statistics.median(durations) * 1000, 'ms')
+        self.report(f'{name}.p95', durations[int(len(durations) * 0.95) - 1] * 1000, 'ms')
+
+
+class IndexViewBenchmark(BenchmarkCase):
+
+    def post(self, **data):
+        response = self.client.post('/', dict({'public_url': self.public_url}, **data))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['error'])
+        return response
+
+    def test_listing_latency(self):
+        self.fake_disk(files_per_folder=int(500 * SCALE), latency=0.005)
+        repeat = int(20 * SCALE)
+
+        def cold():
+            self.reset_caches()
+            self.post()
+
+        self.report_latency('cold', self.timed(cold, repeat))
+        self.report_latency('warm', self.timed(self.post, repeat))
+
+    def test_recursive_pages_per_second(self):
+        disk = self.fake_disk(files_per_folder=int(150 * SCALE), folders_per_folder=3, depth=3, latency=0.01)
+        # Последняя страница рекурсивного обхода требует пройти всё дерево
+        last_page = disk.walk_size() // settings.LISTING_PAGE_SIZE + 1
+
+        started = time.perf_counter()
+        response = self.post(recursive='1', page=str(last_page))
+        elapsed = time.perf_counter() - started
+
+        self.assertFalse(response.context['has_next'])
+        self.report('pages_per_second', disk.calls['listing'] / elapsed, 'pages/s')
+        self.report('walk_time', elapsed * 1000, 'ms')
+
+    def test_listing_with_upstream_errors(self):
+        disk = self.fake_disk(files_per_folder=int(300 * SCALE), error_rate=0.2, seed=1)
+        ok = 0
+        repeat = int(30 * SCALE)
+        for _ in range(repeat):
+            self.reset_caches()
+            response = self.client.post('/', {'public_url': self.public_url})
+            ok += response.context['error'] is None
+        # 503 с Retry-After повторяется клиентом один раз
+        self.report('success_ratio', ok / repeat, '')
+        self.report('upstream_errors', disk.calls['error'], 'responses')
+        self.assertGreaterEqual(ok / repeat, 0.8)
+
+    def test_streamed_listing(self):
+        disk = self.fake_disk(files_per_folder=int(5000 * SCALE), latency=0.005)
+        chunk_size = settings.LISTING_STREAM_CHUNK_SIZE
+
+        started = time.perf_counter()
+        response = self.client.post('/', {'public_url': self.public_url, 'all': '1', 'sort': '-size'})
+        self.assertEqual(response.status_code, 200)
+        parts = iter(response.streaming_content)
+        next(parts)
+        first_byte = time.perf_counter() - started
+
+        rows = 0
+        largest = 0
+        for part in parts:
+            rows += part.count(b'<tr>')
+            largest = max(largest, len(part))
+        elapsed = time.perf_counter() - started
+        response.close()
+
+        self.assertEqual(rows, disk.files_per_folder)
+        self.report('time_to_first_byte', first_byte * 1000, 'ms')
+        self.report('total_time', elapsed * 1000, 'ms')
+        self.report('largest_part', largest / 1024, 'KiB')
+        # Таблица уходит пачками, а не одной строкой на всю папку
+        self.assertLess(largest, chunk_size * 4096)
+
+
+class YandexDiskViewBenchmark(BenchmarkCase):
+
+    def test_listing_latency(self):
+        self.fake_disk(files_per_folder=int(500 * SCALE), latency=0.005)
+        factory = RequestFactory()
+        view = YandexDiskView.as_view()
+        session = self.client.session
+
+        def post():
+            request = factory.post('/', {'public_url': self.public_url})
+            request.session = session
+            self.assertEqual(view(request).status_code, 200)
+
+        repeat = int(20 * SCALE)
+
+        def cold():
+            self.reset_caches()
+            post()
+
+        self.report_latency('cold', self.timed(cold, repeat))
+        self.report_latency('warm', self.timed(post, repeat))
+
+
+class BatchListingViewBenchmark(BenchmarkCase):
+
+    def test_batch_latency(self):
+        # Задержка заметно больше записи в кэш и индекс, чтобы было видно параллельность
+        latency = 0.2
+        links = int(16 * SCALE)
+        self.fake_disk(files_per_folder=50, latency=latency)
+        urls = [f'https://disk.yandex.ru/d/bench{i}' for i in range(links)] + ['https://disk.yandex.ru/d/missing']
+
+        started = time.perf_counter()
+        response = self.client.post('/batch/?format=json', {'public_urls': '\n'.join(urls)})
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(data['results'][-1]['status'], 'not_found')
+        self.report('batch_time', elapsed * 1000, 'ms')
+        self.report('serial_estimate', (links + 1) * latency * 1000, 'ms')
+        # Ссылки запрашиваются параллельно, а не по очереди
+        self.assertLess(elapsed, (links + 1) * latency / 2)
+
+
+class DownloadViewBenchmark(BenchmarkCase):
+
+    def download(self, path='/file0.bin'):
+        # Без md5 и size файл не попадает в локальный кэш и каждый раз идёт из апстрима
+        response = self.client.get('/download/', {'public_key': self.public_key, 'path': path, 'proxy': '1'})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def consume(self, response):
+        size = 0
+        for chunk in response.streaming_content:
+            size += len(chunk)
+        response.close()
+        return size
+
+    def test_throughput(self):
+        file_size = int(64 * MB * SCALE)
+        self.fake_disk(file_size=file_size)
+
+        started = time.perf_counter()
+        size = self.consume(self.download())
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(size, file_size)
+        self.report('throughput', size / MB / elapsed, 'MB/s')
+
+    def test_memory_per_concurrent_download(self):
+        file_size = int(32 * MB * SCALE)
+        concurrency = 8
+        self.fake_disk(file_size=file_size)
+        responses = [self.download(f'/file{i}.bin') for i in range(concurrency)]
+
+        def consume(response):
+            try:
+                return self.consume(response)
+            finally:
+                connection.close()
+
+        tracemalloc.start()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                sizes = list(executor.map(consume, responses))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(sizes, [file_size] * concurrency)
+        per_download = peak / concurrency
+        self.report('peak_memory_per_download', per_download / 1024, 'KiB')
+        # Отдача потоком держит в памяти несколько блоков, а не файл целиком
+        self.assertLess(per_download, 8 * settings.DOWNLOAD_CHUNK_SIZE)
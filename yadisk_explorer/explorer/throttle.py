@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from .exceptions import UpstreamUnavailable
+
+
+class TokenBucket:
+    """Маркерная корзина: rate запросов в секунду, всплеск до burst.
+
+    block() запрещает запросы на заданное время (Retry-After от API).
+    Корзина без rate ограничивает только через block().
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate or 0
+        self.burst = max(burst or self.rate or 1, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """Берёт маркер и возвращает, сколько ждать до запроса.
+
+        Если ждать пришлось бы дольше max_wait, маркер не берётся и
+        возвращается None.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._blocked_until - now, 0.0)
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens < 1:
+                    wait = max(wait, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            if self.rate:
+                self._tokens -= 1
+            return wait
+
+    def refund(self):
+        """Возвращает маркер, взятый reserve(), если запрос не состоялся"""
+        with self._lock:
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + 1)
+
+    def block(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """Ограничение частоты запросов к API: общее и на каждый OAuth-токен.
+
+    Запрос ждёт свободного маркера в обеих корзинах, но не дольше max_wait
+    секунд, иначе выбрасывается UpstreamUnavailable. Запросы без токена
+    (листинги публичных ссылок, прогрев, обход) учитываются только в общей
+    корзине: общая корзина токена на всех пользователей урезала бы процесс
+    до лимита одного токена. Retry-After из ответа 429 блокирует и корзину
+    токена, и общую: лимит считается на client_id приложения.
+    """
+
+    def __init__(self, rate=None, burst=None, token_rate=None, token_burst=None, max_wait=None, max_tokens=10000):
+        self.global_bucket = TokenBucket(
+            rate if rate is not None else getattr(settings, 'YANDEX_API_RATE_LIMIT', 20),
+            burst or getattr(settings, 'YANDEX_API_BURST', 40),
+        )
+        self.token_rate = token_rate if token_rate is not None else getattr(settings, 'YANDEX_API_TOKEN_RATE_LIMIT', 5)
+        self.token_burst = token_burst or getattr(settings, 'YANDEX_API_TOKEN_BURST', 10)
+        self.max_wait = max_wait if max_wait is not None else getattr(settings, 'YANDEX_API_MAX_WAIT', 5)
+        self.max_tokens = max_tokens
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, token=None):
+        time.sleep(self._reserve(token))
+
+    async def aacquire(self, token=None):
+        await asyncio.sleep(self._reserve(token))
+
+    def retry_after(self, token, seconds):
+        """Учитывает Retry-After: запросы не отправляются ещё seconds секунд"""
+        self.global_bucket.block(seconds)
+        if token:
+            self._bucket(token).block(seconds)
+
+    def _reserve(self, token):
+        wait = self.global_bucket.reserve(self.max_wait)
+        if wait is not None:
+            if not token:
+                return wait
+            token_wait = self._bucket(token).reserve(self.max_wait)
+            if token_wait is not None:
+                return max(wait, token_wait)
+            self.global_bucket.refund()
+        raise UpstreamUnavailable("Превышен лимит запросов к API Яндекс.Диска, повторите позже")
+
+    def _bucket(self, token):
+        # Токены не храним в памяти в открытом виде
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.token_rate, self.token_burst)
+                if len(self._buckets) > self.max_tokens:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+
+class CircuitBreaker:
+    """Автоматический выключатель запросов к API.
+
+    После failure_threshold сбоев подряд (5xx, 429, ошибки соединения)
+    запросы не отправляются reset_timeout секунд, затем пропускается один
+    пробный запрос: успех замыкает цепь, сбой снова размыкает её.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self.failure_threshold = failure_threshold or getattr(settings, 'CIRCUIT_BREAKER_FAILURES', 5)
+        self.reset_timeout = reset_timeout if reset_timeout is not None else getattr(settings, 'CIRCUIT_BREAKER_RESET', 30)
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self.OPEN
+
+    def allow(self):
+        """Можно ли отправить запрос сейчас"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                # Один пробный запрос на интервал; если он не завершился
+                # (например, отклонён лимитером), через интервал будет следующий
+                self._opened_at = now
+                self._probing = True
+                return True
+            return False
+
+    def check(self):
+        """Как allow(), но при разомкнутой цепи выбрасывает UpstreamUnavailable"""
+        if not self.allow():
+            raise UpstreamUnavailable(
+                "API Яндекс.Диска временно недоступен, повторите позже", retry_after=self.reset_timeout
+            )
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+def retry_after_seconds(headers):
+    """Значение Retry-After в секундах (число или HTTP-дата) или None"""
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - timezone.now()).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+api_rate_limiter = RateLimiter()
+api_circuit_breaker = CircuitBreaker()
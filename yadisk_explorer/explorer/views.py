@@ -1,16 +1,44 @@
+import hashlib
+import json
 import logging
-from django.shortcuts import render, redirect
+import math
+import mimetypes
+import re
+from django.conf import settings
+from django.core import signing
+from django.shortcuts import redirect
+from django.template.loader import get_template, render_to_string
+from django.utils.html import format_html
 from django.views import View
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import parse_etags, quote_etag
+from datetime import datetime, time, timezone as dt_timezone
 from urllib.parse import urlparse, unquote, quote
+from functools import partial
+from itertools import islice
+
 import requests
 
+from .auth import TOKEN_KEY, fetch_user_info, token_session_data
+from .blob_cache import blob_cache
+from .cache import download_link_cache, listing_cache, preview_link_cache
+from .client import BASE_API_URL, DOWNLOAD_API_URL, yandex_client
+from .exceptions import ResourceNotFound, UpstreamUnavailable
+from . import metrics, search, stats
+from .listing import FolderLister, ListingFilter, Row
+from .metrics import log_sampled, render
+from .models import IndexedShare
+from .previews import SIZE_RE, image_content_type, preview_cache
+from .zipstream import stream_zip
+
 logger = logging.getLogger(__name__)
 
 
 class YandexDiskView(View):
-    BASE_API_URL = "https://cloud-api.yandex.net/v1/disk/public/resources"
-    DOWNLOAD_API_URL = "https://cloud-api.yandex.net/v1/disk/public/resources/download"
+    BASE_API_URL = BASE_API_URL
+    DOWNLOAD_API_URL = DOWNLOAD_API_URL
 
     def get(self, request):
         if 'yandex_user' not in request.session:
@@ -22,7 +50,12 @@ class YandexDiskView(View):
             return redirect('index')
 
         public_url = request.POST.get('public_url', '').strip()
+        path = request.POST.get('path', '').strip() or '/'
+        page = self._get_page(request)
+        recursive = bool(request.POST.get('recursive'))
+        public_key = None
         files = []
+        has_next = False
         error = None
 
         if public_url:
@@ -30,24 +63,10 @@ class YandexDiskView(View):
                 # Извлекаем public_key из URL
                 public_key = self._extract_public_key(public_url)
 
-                # Получаем метаинформацию
-                params = {
-                    'public_key': public_key,
-                    'path': '',  # Корень публичной папки
-                    'limit': 100,  # Лимит файлов
-                    'sort': '-modified'  # Сортировка по дате изменения
-                }
-
-                response = requests.get(
-                    self.BASE_API_URL,
-                    params=params,
-                    headers=self._get_headers(request)
-                )
-
-                self._check_response(response)
-
-                data = response.json()
-                files = self._parse_files(data, public_key)
+                # Сортировка по дате изменения
+                lister = FolderLister(partial(self._fetch_page, token=request.session.get('yandex_token')))
+                items, has_next = self._list_page(lister, public_key, path, page, recursive, sort='-modified')
+                files = [self._parse_item(item, public_key) for item in items]
 
             except Exception as e:
                 error = str(e)
@@ -57,9 +76,138 @@ class YandexDiskView(View):
             'user': request.session['yandex_user'],
             'files': files,
             'public_url': public_url,
+            'public_key': public_key,
+            'path': path,
+            'page': page,
+            'recursive': recursive,
+            'has_next': has_next,
             'error': error
         })
 
+    def _fetch_page(self, params, token=None):
+        """Одна страница листинга через кэш листингов"""
+        def fetch():
+            response = yandex_client.get_public_resource(params, token=token)
+            self._check_response(response)
+            data = response.json()
+            search.index_listing(params['public_key'], data)
+            return data
+
+        return listing_cache.get_or_fetch(params, fetch)
+
+    def _get_page(self, request):
+        """Номер запрошенной страницы листинга (с 1)"""
+        try:
+            return max(int(request.POST.get('page', 1)), 1)
+        except ValueError:
+            return 1
+
+    def _list_page(self, lister, public_key, path, page, recursive, sort=None, match=None):
+        """Возвращает элементы одной страницы и признак наличия следующей.
+
+        В рекурсивном режиме, с фильтром или сортировкой по типу страница
+        вырезается из генератора обхода, так что запрашиваются только
+        страницы API, нужные для этого среза.
+        """
+        limit = lister.page_size
+        offset = (page - 1) * limit
+
+        if recursive or match or sort in self.TYPE_SORTS:
+            items = lister.items(public_key, path, sort=sort, recursive=recursive, match=match)
+            items = list(islice(items, offset, offset + limit + 1))
+            return items[:limit], len(items) > limit
+
+        items, total = lister.page(public_key, path, offset, limit, sort=sort)
+        if total is not None:
+            return items, offset + limit < total
+        return items, len(items) == limit
+
+    # Сортировка листинга: значение для API ('-' — по убыванию) и подпись
+    SORT_CHOICES = (
+        ('name', 'Имя, А–Я'),
+        ('-name', 'Имя, Я–А'),
+        ('type', 'Сначала папки'),
+        ('-type', 'Сначала файлы'),
+        ('size', 'Размер, по возрастанию'),
+        ('-size', 'Размер, по убыванию'),
+        ('modified', 'Дата, сначала старые'),
+        ('-modified', 'Дата, сначала новые'),
+    )
+    # Сортировки, которых нет в API: выполняются проходами обхода
+    TYPE_SORTS = ('type', '-type')
+    # Параметры формы, задающие вид листинга (сохраняются при пагинации)
+    LISTING_QUERY_FIELDS = ('sort', 'q', 'type', 'min_size', 'max_size', 'modified_after', 'modified_before', 'all')
+    # Место строк таблицы в index.html при потоковом выводе
+    ROWS_MARKER = '<!-- listing rows -->'
+
+    def _listing_query(self, request):
+        """Параметры сортировки, фильтра и режима вывода из формы"""
+        return {name: request.POST.get(name, '').strip() for name in self.LISTING_QUERY_FIELDS}
+
+    def _get_sort(self, query):
+        sort = query.get('sort')
+        return sort if sort in dict(self.SORT_CHOICES) else None
+
+    def _get_filter(self, query):
+        """ListingFilter из параметров формы; ValueError при неверных значениях"""
+        return ListingFilter(
+            name=query.get('q') or None,
+            type=query.get('type') if query.get('type') in ('file', 'dir') else None,
+            min_size=self._parse_size(query.get('min_size'), 'Размер от'),
+            max_size=self._parse_size(query.get('max_size'), 'Размер до'),
+            modified_after=self._parse_day(query.get('modified_after'), 'Изменён не раньше'),
+            modified_before=self._parse_day(query.get('modified_before'), 'Изменён раньше'),
+        )
+
+    def _parse_size(self, value, label):
+        if not value:
+            return None
+        try:
+            return max(int(value), 0)
+        except ValueError:
+            raise ValueError(f"{label}: размер должен быть числом байт")
+
+    def _parse_day(self, value, label):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"{label}: неверный формат даты")
+        return day
+
+    def _stream_listing(self, request, context, rows):
+        """Страница листинга потоком: шапка сразу, затем строки таблицы
+        пачками по LISTING_STREAM_CHUNK_SIZE по мере прихода страниц API.
+
+        rows — генератор Row; в памяти держится только текущая пачка.
+        Первая пачка запрашивается до ответа, чтобы ошибка (например, 404)
+        показалась обычной страницей.
+        """
+        chunk_size = getattr(settings, 'LISTING_STREAM_CHUNK_SIZE', 200)
+        first = list(islice(rows, chunk_size))
+        head, tail = render_to_string('index.html', dict(context, streaming=True), request).split(self.ROWS_MARKER)
+        rows_template = get_template('listing_rows.html')
+        rows_context = {name: context[name] for name in ('public_url', 'recursive')}
+
+        def body():
+            yield head
+            chunk = first
+            try:
+                while chunk:
+                    yield rows_template.render(dict(rows_context, files=chunk), request)
+                    chunk = list(islice(rows, chunk_size))
+            except Exception as e:
+                logger.error(f"Error streaming listing: {e}")
+                yield format_html('<tr><td colspan="7" class="text-danger">{}</td></tr>', str(e))
+            finally:
+                rows.close()
+            yield tail
+
+        response = StreamingHttpResponse(body(), content_type='text/html; charset=utf-8')
+        # Строки должны доходить до браузера сразу, без буферизации в nginx
+        response['X-Accel-Buffering'] = 'no'
+        return response, first
+
     def _extract_public_key(self, url):
         """Извлекает public_key из URL Яндекс.Диска"""
         parsed = urlparse(url)
@@ -74,18 +222,11 @@ class YandexDiskView(View):
         else:
             raise ValueError("Не удалось извлечь public_key из ссылки")
 
-    def _get_headers(self, request):
-        """Возвращает заголовки для API запросов"""
-        return {
-            'Authorization': f'OAuth {request.session.get("yandex_token", "")}',
-            'Accept': 'application/json'
-        }
-
     def _check_response(self, response):
         """Проверяет ответ API на ошибки"""
         if response.status_code == 404:
             error_msg = response.json().get('message', 'Ресурс не найден')
-            raise ValueError(
+            raise ResourceNotFound(
                 f"{error_msg}. Убедитесь, что:\n"
                 "1. Ссылка корректная и публичная\n"
                 "2. Папка/файл явно опубликованы (не просто расшарены)"
@@ -95,107 +236,339 @@ class YandexDiskView(View):
             raise ValueError(f"Ошибка API ({response.status_code}): {error_msg}")
 
     def _parse_files(self, data, public_key):
-        """Парсит список файлов из ответа API"""
+        """Парсит список файлов и папок из ответа API"""
         items = []
         if '_embedded' in data and 'items' in data['_embedded']:
             for item in data['_embedded']['items']:
-                if item['type'] == 'file':  # Только файлы
-                    items.append({
-                        'name': item['name'],
-                        'path': quote(item['path']),
-                        'size': item.get('size', 0),
-                        'modified': item.get('modified', ''),
-                        'media_type': item.get('mime_type', 'unknown'),
-                        'public_key': public_key,
-                        'preview': item.get('preview', ''),
-                        'md5': item.get('md5', '')
-                    })
+                items.append(self._parse_item(item, public_key))
         return items
 
+    # Поля элемента, которые возвращает _parse_item
+    ITEM_FIELDS = (
+        'name', 'type', 'path', 'raw_path', 'size', 'modified',
+        'media_type', 'public_key', 'preview', 'md5',
+    )
 
-class IndexView(View):
-    def get(self, request):
-        if 'yandex_user' not in request.session:
-            return render(request, 'login.html')
-        return render(request, 'index.html')
+    def _parse_item(self, item, public_key):
+        """Парсит один элемент листинга"""
+        return {
+            'name': item['name'],
+            'type': item['type'],
+            'path': quote(item['path']),
+            'raw_path': item['path'],
+            'size': item.get('size', 0),
+            'modified': item.get('modified', ''),
+            'media_type': item.get('mime_type', 'unknown'),
+            'public_key': public_key,
+            'preview': item.get('preview', ''),
+            'md5': item.get('md5', '')
+        }
+
+
+class IndexView(YandexDiskView):
+    ROOT_PATH = 'disk:/'  # Важно: путь должен начинаться с disk:/
 
     def post(self, request):
         if 'yandex_user' not in request.session:
             return redirect('index')
 
         public_url = request.POST.get('public_url', '').strip()
+        path = request.POST.get('path', '').strip() or self.ROOT_PATH
+        page = self._get_page(request)
+        recursive = bool(request.POST.get('recursive'))
+        query = self._listing_query(request)
+        public_key = None
         files = []
+        has_next = False
         error = None
+        context = {
+            'user': request.session['yandex_user'],
+            'public_url': public_url,
+            'path': path,
+            'page': page,
+            'recursive': recursive,
+            'listing_query': query,
+            'sort_choices': self.SORT_CHOICES,
+        }
 
         if public_url:
             try:
                 # Извлекаем public_key из URL
-                parsed = urlparse(public_url)
-                if 'disk.yandex.ru' not in parsed.netloc:
-                    raise ValueError("Неверная ссылка Яндекс.Диска")
-
-                path_parts = parsed.path.split('/')
-                if len(path_parts) >= 3 and path_parts[1] == 'd':
-                    public_key = path_parts[2]
-                else:
-                    raise ValueError("Неверный формат ссылки. Пример: https://disk.yandex.ru/d/AbCdEfGhIjKlMn")
+                public_key = self._parse_public_url(public_url)
+                context['public_key'] = public_key
+                # Готовая сводка по папке из индекса, если папка обойдена
+                context['stats'] = stats.get_stats(public_key, path)
+                sort = self._get_sort(query)
+                match = self._get_filter(query)
 
                 # Запрос метаинформации
-                api_url = "https://cloud-api.yandex.net/v1/disk/public/resources"
-                params = {
-                    'public_key': public_key,
-                    'path': 'disk:/'  # Важно: путь должен начинаться с disk:/
-                }
+                def fetch_page(params):
+                    return listing_cache.get_or_fetch(params, partial(self._fetch_listing, params))
 
-                logger.debug(f"Requesting Yandex API with params: {params}")
+                lister = FolderLister(fetch_page)
+                if query['all']:
+                    rows = self._iter_rows(lister, public_key, path, recursive, sort, match)
+                    response, first = self._stream_listing(request, context, rows)
+                    # Превью первой пачки скачиваются в фоне, пока браузер грузит HTML
+                    preview_cache.prefetch([row._asdict() for row in first], token=request.session.get('yandex_token'))
+                    return response
 
-                response = requests.get(api_url, params=params)
+                items, has_next = self._list_page(lister, public_key, path, page, recursive, sort, match)
+                files = [self._parse_item(item, public_key) for item in items]
+                # Превью страницы скачиваются в фоне, пока браузер грузит HTML
+                preview_cache.prefetch(items, token=request.session.get('yandex_token'))
 
-                if response.status_code != 200:
-                    error_msg = response.json().get('message', 'Неизвестная ошибка API')
-                    logger.error(f"API error: {error_msg} (status: {response.status_code})")
-                    raise ValueError(f"Ошибка API: {error_msg}")
+            except Exception as e:
+                error = str(e)
+                logger.error(f"Error processing request: {error}")
 
-                data = response.json()
-                logger.debug(f"API response: {data}")
+        return render(request, 'index.html', dict(
+            context,
+            files=files,
+            public_key=public_key,
+            has_next=has_next,
+            error=error,
+        ))
 
-                if '_embedded' not in data:
-                    raise ValueError("Папка пуста или не является публичной")
+    def _iter_rows(self, lister, public_key, path, recursive, sort, match):
+        """Генератор строк таблицы для потокового вывода"""
+        for item in lister.items(public_key, path, sort=sort, recursive=recursive, match=match):
+            yield Row.from_item(item, public_key)
 
-                files = self._parse_files(data, public_key)
+    def _parse_public_url(self, public_url):
+        """Извлекает public_key из ссылки вида https://disk.yandex.ru/d/<key>"""
+        parsed = urlparse(public_url)
+        if 'disk.yandex.ru' not in parsed.netloc:
+            raise ValueError("Неверная ссылка Яндекс.Диска")
 
-            except Exception as e:
-                error = str(e)
-                logger.error(f"Error processing request: {error}")
+        path_parts = parsed.path.split('/')
+        if len(path_parts) >= 3 and path_parts[1] == 'd':
+            return path_parts[2]
+        raise ValueError("Неверный формат ссылки. Пример: https://disk.yandex.ru/d/AbCdEfGhIjKlMn")
 
-        return render(request, 'index.html', {
+    def _fetch_listing(self, params):
+        """Одна страница листинга напрямую из API (с обновлением поискового индекса)"""
+        logger.debug("Requesting Yandex API with params: %s", params)
+        response = yandex_client.get_public_resource(params)
+        data = self._check_listing_response(response)
+        search.index_listing(params['public_key'], data)
+        return data
+
+    def _check_listing_response(self, response):
+        """Проверяет ответ API листинга и возвращает его JSON"""
+        if response.status_code == 404:
+            error_msg = response.json().get('message', 'Ресурс не найден')
+            raise ResourceNotFound(f"Ошибка API: {error_msg}")
+        if response.status_code != 200:
+            error_msg = response.json().get('message', 'Неизвестная ошибка API')
+            logger.error(f"API error: {error_msg} (status: {response.status_code})")
+            raise ValueError(f"Ошибка API: {error_msg}")
+
+        data = response.json()
+        log_sampled(logger, "API response: %s", data)
+
+        if '_embedded' not in data:
+            raise ValueError("Папка пуста или не является публичной")
+        return data
+
+    def _parse_item(self, item, public_key):
+        return {
+            'name': item['name'],
+            'type': item['type'],
+            'path': quote(item['path']),  # Кодируем путь для URL
+            'raw_path': item['path'],
+            'size': item.get('size', 0),
+            'public_key': public_key,
+            'media_type': item.get('media_type', 'unknown'),
+            'modified': item.get('modified', ''),
+            'preview': item.get('preview', ''),
+            'md5': item.get('md5', '')
+        }
+
+
+class BatchListingView(IndexView):
+    """Первые страницы нескольких публичных папок за один запрос.
+
+    Ссылки (по строке, через пробел или запятую) запрашиваются параллельно
+    в пуле из BATCH_LISTING_WORKERS потоков, так что ответ приходит примерно
+    за время самого медленного листинга. Ошибка одной ссылки не мешает
+    остальным и показывается в её группе. С format=json (или Accept:
+    application/json) результат отдаётся в JSON.
+    """
+
+    http_method_names = ['get', 'post', 'options']
+    URL_SEPARATORS = re.compile(r'[\s,]+')
+
+    def get(self, request):
+        if 'yandex_user' not in request.session:
+            return redirect('index')
+        return render(request, 'batch.html', {
             'user': request.session['yandex_user'],
-            'files': files,
-            'public_url': public_url,
-            'error': error
+            'max_links': self._max_links(),
         })
 
-    def _parse_files(self, data, public_key):
-        items = []
-        if '_embedded' in data and 'items' in data['_embedded']:
-            for item in data['_embedded']['items']:
-                if item['type'] == 'file':
-                    items.append({
-                        'name': item['name'],
-                        'path': quote(item['path']),  # Кодируем путь для URL
-                        'size': item.get('size', 0),
-                        'public_key': public_key,
-                        'media_type': item.get('media_type', 'unknown'),
-                        'modified': item.get('modified', '')
-                    })
-        return items
+    def post(self, request):
+        wants_json = self._wants_json(request)
+        if 'yandex_user' not in request.session:
+            if wants_json:
+                return JsonResponse({'error': 'Требуется авторизация'}, status=401)
+            return redirect('index')
+
+        raw_urls = request.POST.get('public_urls', '')
+        urls = list(dict.fromkeys(url for url in self.URL_SEPARATORS.split(raw_urls) if url))
+        groups = []
+        error = None
+        if not urls:
+            error = "Не указано ни одной ссылки"
+        elif len(urls) > self._max_links():
+            error = f"Слишком много ссылок: {len(urls)}, не больше {self._max_links()} за раз"
+        else:
+            groups = self._list_links(urls)
+
+        if wants_json:
+            if error:
+                return JsonResponse({'error': error}, status=400)
+            return JsonResponse({
+                'count': len(groups),
+                'failed': sum(group['error'] is not None for group in groups),
+                'results': [self._serialize_group(group) for group in groups],
+            }, json_dumps_params={'ensure_ascii': False})
+
+        return render(request, 'batch.html', {
+            'user': request.session['yandex_user'],
+            'max_links': self._max_links(),
+            'public_urls': raw_urls,
+            'groups': groups,
+            'error': error,
+        })
+
+    def _list_links(self, urls):
+        """Группы результатов в порядке ссылок: элементы или ошибка на каждую"""
+        groups = []
+        for url in urls:
+            group = {
+                'public_url': url,
+                'public_key': None,
+                'files': [],
+                'total': None,
+                'has_next': False,
+                'status': 'ok',
+                'error': None,
+            }
+            try:
+                group['public_key'] = self._extract_public_key(url)
+            except ValueError as e:
+                group.update(status='invalid', error=str(e))
+            groups.append(group)
+
+        def fetch_page(params):
+            return listing_cache.get_or_fetch(params, partial(self._fetch_listing, params))
+
+        lister = FolderLister(fetch_page, max_workers=getattr(settings, 'BATCH_LISTING_WORKERS', 8))
+        pending = [group for group in groups if group['public_key']]
+        results = lister.page_many([group['public_key'] for group in pending], self.ROOT_PATH)
+
+        for group, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Batch listing failed for {group['public_url']}: {result}")
+                status = 'not_found' if isinstance(result, ResourceNotFound) else 'error'
+                group.update(status=status, error=str(result))
+                continue
+            items, total = result
+            group['files'] = [self._parse_item(item, group['public_key']) for item in items]
+            group['total'] = total
+            group['has_next'] = total is not None and len(items) < total
+        return groups
+
+    def _serialize_group(self, group):
+        data = {name: group[name] for name in ('public_url', 'public_key', 'status', 'error', 'total', 'has_next')}
+        data['items'] = group['files']
+        return data
+
+    def _wants_json(self, request):
+        return request.GET.get('format') == 'json' or 'application/json' in request.headers.get('Accept', '')
+
+    def _max_links(self):
+        return getattr(settings, 'BATCH_MAX_LINKS', 100)
+
+
+class PreviewView(YandexDiskView):
+    """Превью файла из локального кэша; при промахе скачивается сервером.
+
+    Адрес превью содержит md5 файла, поэтому ответ неизменен и кэшируется
+    браузером надолго.
+    """
+
+    CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+    def get(self, request):
+        if 'yandex_user' not in request.session:
+            return HttpResponse(status=403)
+
+        public_key = request.GET.get('public_key', '')
+        file_path = unquote(request.GET.get('path', ''))
+        md5 = request.GET.get('md5', '')
+        size = request.GET.get('size') or settings.PREVIEW_SIZE
+        key = preview_cache.key_for(md5, size) if SIZE_RE.fullmatch(size) else None
+        if not public_key or not file_path or key is None:
+            return HttpResponse(status=400)
+
+        etag = quote_etag(key)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return self._cache_headers(HttpResponseNotModified(), etag)
+
+        path = preview_cache.get(md5, size)
+        if path is None:
+            token = request.session.get('yandex_token')
+            try:
+                url = self._preview_link(public_key, file_path, md5, size, token)
+                path = preview_cache.fetch(md5, size, url, token)
+            except ResourceNotFound:
+                return HttpResponse(status=404)
+            except Exception as e:
+                logger.warning(f"Preview error for {file_path}: {e}")
+                return HttpResponse(status=502)
+
+        response = FileResponse(open(path, 'rb'), content_type=image_content_type(path))
+        return self._cache_headers(response, etag)
+
+    def _preview_link(self, public_key, file_path, md5, size, token):
+        """Свежая ссылка на превью из API (через кэш ссылок)"""
+        params = {'public_key': public_key, 'path': file_path, 'preview_size': size}
+
+        def fetch():
+            response = yandex_client.get_public_resource(dict(params, fields='preview,md5'), token=token)
+            self._check_response(response)
+            data = response.json()
+            if not data.get('preview'):
+                raise ResourceNotFound("У файла нет превью")
+            return {'href': data['preview'], 'md5': data.get('md5', '')}
+
+        link = preview_link_cache.get_or_fetch(params, fetch)
+        # Ключ кэша берётся из запроса, поэтому md5 должен совпадать с файлом
+        if link['md5'] != md5:
+            raise ResourceNotFound("md5 не совпадает с файлом")
+        return link['href']
+
+    def _cache_headers(self, response, etag):
+        response['Cache-Control'] = self.CACHE_CONTROL
+        response['ETag'] = etag
+        return response
 
 
 class DownloadView(YandexDiskView):
+    # Заголовки, которые пробрасываются между клиентом и хранилищем Яндекса
+    RANGE_REQUEST_HEADERS = ('Range', 'If-Range')
+    PASSTHROUGH_RESPONSE_HEADERS = (
+        'Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified',
+    )
+    PASSTHROUGH_STATUSES = (200, 206, 416)
+
     def get(self, request):
         if 'yandex_user' not in request.session:
             return redirect('index')
 
+        file_response = None
         try:
             file_path = unquote(request.GET.get('path', ''))
             public_key = request.GET.get('public_key', '')
@@ -203,52 +576,149 @@ class DownloadView(YandexDiskView):
             if not file_path or not public_key:
                 raise ValueError("Не указаны path и public_key")
 
-            # 1. Получаем временную ссылку для скачивания
-            download_params = {
+            # Небольшие файлы отдаём из локального кэша по md5
+            md5 = self._verified_md5(public_key, file_path, request.GET.get('md5', ''))
+            cached_path = blob_cache.get(md5)
+            if cached_path is not None:
+                return self._cached_file_response(cached_path, file_path)
+
+            token = request.session.get('yandex_token')
+            link_params = {
                 'public_key': public_key,
-                'path': file_path
+                'path': file_path,
+                'md5': md5
             }
 
-            response = requests.get(
-                self.DOWNLOAD_API_URL,
-                params=download_params,
-                headers=self._get_headers(request),
-                timeout=10
-            )
+            # 1. Получаем временную ссылку для скачивания (из кэша, если есть)
+            def fetch():
+                response = yandex_client.get_download_link(public_key, file_path, token=token)
+                return self._check_download_link(response)
 
-            self._check_response(response)
-            download_url = response.json().get('href')
+            download_url = download_link_cache.get_or_fetch(link_params, fetch)['href']
 
-            if not download_url:
-                raise ValueError("Не удалось получить ссылку для скачивания")
+            cacheable = self._is_cacheable(request, md5)
+            if self._download_mode(request) == 'redirect' and not cacheable:
+                # Байты идут клиенту напрямую из хранилища Яндекса
+                return redirect(download_url)
 
-            # 2. Скачиваем файл по полученной ссылке
-            file_response = requests.get(
-                download_url,
-                stream=True,
-                headers=self._get_headers(request),
-                timeout=30
+            # 2. Открываем поток по полученной ссылке (с Range/If-Range клиента)
+            file_response = yandex_client.open_download(
+                download_url, token=token, headers=self._range_headers(request)
             )
-            file_response.raise_for_status()
+            if file_response.status_code not in self.PASSTHROUGH_STATUSES:
+                # Ссылка могла истечь раньше срока — не держим её в кэше
+                download_link_cache.invalidate(link_params)
+                file_response.raise_for_status()
+            if file_response.status_code == 416:
+                file_response.close()
 
-            # Определяем имя файла и тип содержимого
-            filename, content_type = self._get_file_info(file_response, file_path)
-
-            # Отправляем файл пользователю
-            response = HttpResponse(
-                file_response.iter_content(chunk_size=8192),
-                content_type=content_type
+            # Отдаём файл потоком: байты читаются из апстрима по мере отправки
+            return self._stream_response(
+                file_response,
+                file_path,
+                self._iter_file(file_response, self._cache_writer(file_response, md5, cacheable))
             )
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            return response
 
         except Exception as e:
+            if file_response is not None:
+                file_response.close()
             logger.error(f"Download error: {str(e)}")
             return render(request, 'index.html', {
                 'user': request.session['yandex_user'],
                 'error': str(e)
             })
 
+    def _verified_md5(self, public_key, file_path, md5):
+        """md5 из запроса, если он совпадает с md5 файла в индексе, иначе ''.
+
+        md5 приходит от клиента: без проверки по нему можно получить любой
+        файл из кэша или старое содержимое изменившегося файла.
+        """
+        if md5 and md5 == search.file_md5(public_key, file_path):
+            return md5
+        return ''
+
+    def _download_mode(self, request):
+        """redirect — 302 на прямую ссылку, proxy — отдача потоком через нас"""
+        if request.GET.get('proxy'):
+            return 'proxy'
+        return settings.DOWNLOAD_MODE
+
+    def _check_download_link(self, response):
+        """Проверяет ответ на запрос ссылки и возвращает {'href': ...}"""
+        self._check_response(response)
+        download_url = response.json().get('href')
+
+        if not download_url:
+            raise ValueError("Не удалось получить ссылку для скачивания")
+        return {'href': download_url}
+
+    def _range_headers(self, request):
+        """Заголовки докачки из запроса клиента для передачи в апстрим"""
+        return {
+            name: request.headers[name]
+            for name in self.RANGE_REQUEST_HEADERS
+            if name in request.headers
+        }
+
+    def _stream_response(self, file_response, file_path, body):
+        """StreamingHttpResponse со статусом и заголовками ответа апстрима"""
+        filename, content_type = self._get_file_info(file_response, file_path)
+
+        if file_response.status_code == 416:
+            # Запрошенный диапазон вне файла: тела нет, только Content-Range
+            body = []
+
+        response = StreamingHttpResponse(
+            body,
+            status=file_response.status_code,
+            content_type=content_type
+        )
+        for name in self.PASSTHROUGH_RESPONSE_HEADERS:
+            if name in file_response.headers:
+                response[name] = file_response.headers[name]
+        response.setdefault('Accept-Ranges', 'bytes')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def _iter_file(self, file_response, writer=None):
+        try:
+            for chunk in file_response.iter_content(chunk_size=settings.DOWNLOAD_CHUNK_SIZE):
+                if writer is not None:
+                    writer.write(chunk)
+                metrics.record_streamed('download', len(chunk))
+                yield chunk
+            if writer is not None:
+                writer.commit()
+        finally:
+            if writer is not None:
+                writer.abort()
+            file_response.close()
+
+    def _is_cacheable(self, request, md5):
+        """Файл достаточно мал, чтобы сохранить его в локальный кэш"""
+        return (
+            'Range' not in request.headers
+            and blob_cache.is_cacheable(md5, request.GET.get('size'))
+        )
+
+    def _cache_writer(self, file_response, md5, cacheable):
+        """BlobWriter для полного (не частичного) ответа или None"""
+        if cacheable and file_response.status_code == 200:
+            return blob_cache.writer(md5)
+        return None
+
+    def _cached_file_response(self, cached_path, file_path):
+        """Отдаёт файл из локального кэша (через sendfile, если сервер умеет)"""
+        filename = unquote(file_path.split('/')[-1] or 'file')
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return FileResponse(
+            open(cached_path, 'rb'),
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type
+        )
+
     def _get_file_info(self, response, fallback_path):
         """Определяет имя файла и тип содержимого"""
         # Из заголовков
@@ -263,6 +733,300 @@ class DownloadView(YandexDiskView):
         return filename, content_type
 
 
+class BulkDownloadView(DownloadView):
+    """Скачивание нескольких файлов (или целой папки) одним ZIP-архивом"""
+
+    http_method_names = ['post', 'options']
+
+    def post(self, request):
+        if 'yandex_user' not in request.session:
+            return redirect('index')
+
+        try:
+            public_key, paths, folder = self._read_selection(request)
+            members = self._zip_members(public_key, paths, folder, request.session.get('yandex_token'))
+            return self._zip_response(stream_zip(members), folder)
+
+        except Exception as e:
+            logger.error(f"Bulk download error: {str(e)}")
+            return render(request, 'index.html', {
+                'user': request.session['yandex_user'],
+                'error': str(e)
+            })
+
+    def _read_selection(self, request):
+        """public_key, выбранные пути и папка из формы"""
+        public_key = request.POST.get('public_key', '')
+        paths = [unquote(path) for path in request.POST.getlist('paths') if path]
+        folder = request.POST.get('folder', '')
+
+        if not public_key or not (paths or folder):
+            raise ValueError("Не выбраны файлы для скачивания")
+        return public_key, paths, folder
+
+    def _zip_response(self, body, folder):
+        name = folder.rstrip('/').split('/')[-1] if folder else ''
+        if not name or name == 'disk:':
+            name = 'files'
+        response = StreamingHttpResponse(body, content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{name}.zip"'
+        return response
+
+    def _zip_members(self, public_key, paths, folder, token):
+        """Генератор (имя в архиве, opener) для выбранных файлов или папки"""
+        if folder:
+            lister = FolderLister(partial(self._fetch_page, token=token))
+            prefix = '' if folder in ('/', IndexView.ROOT_PATH) else folder.rstrip('/')
+            for item in lister.walk(public_key, folder):
+                if item.get('type') != 'file':
+                    continue
+                arcname = item['path'][len(prefix):].lstrip('/')
+                yield arcname, partial(self._member_chunks, public_key, item['path'], item.get('md5', ''), token)
+        else:
+            for path in paths:
+                yield path.lstrip('/'), partial(self._member_chunks, public_key, path, '', token)
+
+    def _member_chunks(self, public_key, path, md5, token):
+        """Содержимое одного файла: из локального кэша или из хранилища Яндекса.
+
+        md5 берётся только из листинга папки на сервере, не из запроса.
+        """
+        cached_path = blob_cache.get(md5)
+        if cached_path is not None:
+            with open(cached_path, 'rb') as f:
+                yield from iter(partial(f.read, settings.DOWNLOAD_CHUNK_SIZE), b'')
+            return
+
+        link_params = {'public_key': public_key, 'path': path, 'md5': md5}
+
+        def fetch():
+            response = yandex_client.get_download_link(public_key, path, token=token)
+            return self._check_download_link(response)
+
+        download_url = download_link_cache.get_or_fetch(link_params, fetch)['href']
+        file_response = yandex_client.open_download(download_url, token=token)
+        if file_response.status_code != 200:
+            download_link_cache.invalidate(link_params)
+            file_response.close()
+            file_response.raise_for_status()
+        yield from self._iter_file(file_response)
+
+
+class ListingApiView(YandexDiskView):
+    """JSON-листинг публичной папки с курсорной пагинацией.
+
+    GET-параметры: public_key (или public_url), path, limit, cursor,
+    fields (через запятую) и recursive. Курсор — подписанная непрозрачная
+    строка со смещением. stats — сводка по поддереву папки из индекса
+    (None, если папка не обойдена). Для нерекурсивного листинга отдаётся ETag,
+    зависящий от modified/md5 папки, и 304 на совпавший If-None-Match.
+    """
+
+    http_method_names = ['get', 'options']
+    CURSOR_SALT = 'explorer.listing.cursor'
+    MAX_LIMIT = 1000
+
+    def get(self, request):
+        if 'yandex_user' not in request.session:
+            return JsonResponse({'error': 'Требуется авторизация'}, status=401)
+
+        try:
+            public_key = request.GET.get('public_key', '').strip()
+            if not public_key:
+                public_key = self._extract_public_key(request.GET.get('public_url', '').strip())
+
+            path = request.GET.get('path', '').strip() or '/'
+            recursive = request.GET.get('recursive', '') in ('1', 'true')
+            limit = self._get_limit(request)
+            offset = self._decode_cursor(request.GET.get('cursor'), public_key, path, recursive)
+            fields = self._get_fields(request)
+
+            lister = FolderLister(partial(self._fetch_page, token=request.session.get('yandex_token')))
+            if recursive:
+                items = list(islice(lister.walk(public_key, path), offset, offset + limit + 1))
+                has_next = len(items) > limit
+                items = items[:limit]
+                total = None
+                etag = None
+            else:
+                data = lister.fetch(public_key, path, offset, limit)
+                embedded = data.get('_embedded', {})
+                items = embedded.get('items', [])
+                total = embedded.get('total')
+                has_next = offset + limit < total if total is not None else len(items) == limit
+                etag = self._etag(data, public_key, path, offset, limit, fields)
+
+                if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                    response = HttpResponse(status=304)
+                    response['ETag'] = etag
+                    return response
+
+        except ResourceNotFound as e:
+            return JsonResponse({'error': str(e)}, status=404)
+        except UpstreamUnavailable as e:
+            logger.warning(f"Listing API upstream unavailable: {str(e)}")
+            # Лимитер отклоняет запросы, которым пришлось бы ждать дольше YANDEX_API_MAX_WAIT
+            retry_after = e.retry_after if e.retry_after is not None else getattr(settings, 'YANDEX_API_MAX_WAIT', 5)
+            response = JsonResponse({'error': str(e)}, status=503)
+            response['Retry-After'] = str(math.ceil(retry_after))
+            return response
+        except ValueError as e:
+            logger.error(f"Listing API error: {str(e)}")
+            return JsonResponse({'error': str(e)}, status=400)
+
+        response = JsonResponse({
+            'public_key': public_key,
+            'path': path,
+            'total': total,
+            'stats': stats.serialize(stats.get_stats(public_key, path)),
+            'items': [self._select_fields(self._parse_item(item, public_key), fields) for item in items],
+            'next_cursor': self._encode_cursor(public_key, path, recursive, offset + limit) if has_next else None,
+        }, json_dumps_params={'ensure_ascii': False})
+        if etag:
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _get_limit(self, request):
+        try:
+            limit = int(request.GET.get('limit', settings.LISTING_PAGE_SIZE))
+        except ValueError:
+            raise ValueError("limit должен быть числом")
+        return min(max(limit, 1), self.MAX_LIMIT)
+
+    def _get_fields(self, request):
+        """Список запрошенных полей элемента или None (все поля)"""
+        raw = request.GET.get('fields', '').strip()
+        if not raw:
+            return None
+        fields = [field.strip() for field in raw.split(',') if field.strip()]
+        unknown = set(fields) - set(self.ITEM_FIELDS)
+        if unknown:
+            raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+        return fields
+
+    def _select_fields(self, item, fields):
+        if fields is None:
+            return item
+        return {field: item[field] for field in fields}
+
+    def _encode_cursor(self, public_key, path, recursive, offset):
+        return signing.dumps([public_key, path, recursive, offset], salt=self.CURSOR_SALT, compress=True)
+
+    def _decode_cursor(self, cursor, public_key, path, recursive):
+        """Смещение из курсора; курсор действителен только для того же листинга"""
+        if not cursor:
+            return 0
+        try:
+            cursor_key, cursor_path, cursor_recursive, offset = signing.loads(cursor, salt=self.CURSOR_SALT)
+        except (signing.BadSignature, ValueError, TypeError):
+            raise ValueError("Некорректный cursor")
+        if (cursor_key, cursor_path, cursor_recursive) != (public_key, path, recursive):
+            raise ValueError("cursor относится к другому листингу")
+        return offset
+
+    def _etag(self, data, public_key, path, offset, limit, fields):
+        """ETag страницы: меняется вместе с modified/md5 папки"""
+        raw = json.dumps([
+            public_key, path, offset, limit, fields,
+            data.get('modified'), data.get('md5'), data.get('_embedded', {}).get('total'),
+        ])
+        return quote_etag(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+class SearchApiView(View):
+    """Поиск по локальному индексу обойдённой публичной папки (без запросов к API)"""
+
+    http_method_names = ['get', 'options']
+    MAX_LIMIT = 1000
+
+    def get(self, request):
+        if 'yandex_user' not in request.session:
+            return JsonResponse({'error': 'Требуется авторизация'}, status=401)
+
+        public_key = request.GET.get('public_key', '').strip()
+        if not public_key:
+            return JsonResponse({'error': 'Не указан public_key'}, status=400)
+
+        try:
+            items = search.search(
+                public_key,
+                query=request.GET.get('q', '').strip() or None,
+                type=request.GET.get('type') or None,
+                mime_type=request.GET.get('mime_type') or None,
+                media_type=request.GET.get('media_type') or None,
+                min_size=self._get_int(request, 'min_size'),
+                max_size=self._get_int(request, 'max_size'),
+                modified_after=self._get_datetime(request, 'modified_after'),
+                modified_before=self._get_datetime(request, 'modified_before'),
+                path_prefix=request.GET.get('path') or None,
+                limit=min(self._get_int(request, 'limit') or 100, self.MAX_LIMIT),
+            )
+            results = [self._serialize(item) for item in items]
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        share = IndexedShare.objects.filter(public_key=public_key).first()
+        return JsonResponse({
+            'public_key': public_key,
+            'crawled_at': share.crawled_at.isoformat() if share and share.crawled_at else None,
+            'count': len(results),
+            'items': results,
+        }, json_dumps_params={'ensure_ascii': False})
+
+    def _get_int(self, request, name):
+        value = request.GET.get(name)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"{name} должен быть числом")
+
+    def _get_datetime(self, request, name):
+        """Дата (YYYY-MM-DD) или дата-время в ISO 8601"""
+        value = request.GET.get(name)
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(f"{name}: неверный формат даты")
+            parsed = datetime.combine(day, time.min)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        return parsed
+
+    def _serialize(self, item):
+        return {
+            'name': item.name,
+            'type': item.type,
+            'path': quote(item.path),
+            'raw_path': item.path,
+            'size': item.size,
+            'modified': item.modified.isoformat() if item.modified else '',
+            'media_type': item.mime_type or 'unknown',
+            'public_key': item.public_key,
+            'md5': item.md5,
+        }
+
+
+class MetricsView(View):
+    """Метрики процесса в формате Prometheus.
+
+    Если задан METRICS_TOKEN, требуется заголовок Authorization: Bearer <токен>.
+    """
+
+    http_method_names = ['get']
+
+    def get(self, request):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse(status=403)
+        return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class YandexAuthView(View):
     def get(self, request):
         auth_url = (
@@ -281,35 +1045,37 @@ class YandexAuthCallbackView(View):
             return render(request, 'error.html', {'error': 'Authorization failed'})
 
         # Получаем токен
-        token_url = "https://oauth.yandex.ru/token"
-        data = {
-            'grant_type': 'authorization_code',
-            'code': code,
-            'client_id': settings.YANDEX_CLIENT_ID,
-            'client_secret': settings.YANDEX_CLIENT_SECRET
-        }
-        response = requests.post(token_url, data=data)
+        try:
+            response = yandex_client.exchange_code(code)
+        except requests.RequestException as e:
+            logger.error(f"Token request failed: {e}")
+            return render(request, 'error.html', {'error': 'Сервис авторизации Яндекса недоступен'})
 
         if response.status_code != 200:
             return render(request, 'error.html', {'error': 'Token request failed'})
 
-        access_token = response.json().get('access_token')
-        request.session['yandex_token'] = access_token
+        session_data = token_session_data(response.json())
+        request.session.update(session_data)
 
         # Получаем информацию о пользователе
-        user_info = requests.get(
-            "https://login.yandex.ru/info",
-            headers={'Authorization': f'OAuth {access_token}'}
-        ).json()
+        try:
+            user_info = fetch_user_info(session_data[TOKEN_KEY])
+        except ValueError as e:
+            logger.error(f"User info request failed: {e}")
+            return render(request, 'error.html', {'error': str(e)})
 
-        request.session['yandex_user'] = {
+        request.session['yandex_user'] = self._session_user(user_info)
+
+        return redirect('index')
+
+    def _session_user(self, user_info):
+        """Данные пользователя, которые храним в сессии"""
+        return {
             'login': user_info.get('login'),
             'name': user_info.get('real_name'),
             'email': user_info.get('default_email')
         }
 
-        return redirect('index')
-
 
 class LogoutView(View):
     def get(self, request):
@@ -0,0 +1,105 @@
+import logging
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.db import connection
+
+from .cache import listing_cache
+from .listing import FolderLister
+from .models import FileCache
+from .singleflight import ProcessLock
+from .views import IndexView
+
+logger = logging.getLogger(__name__)
+
+
+class CacheWarmer:
+    """Прогрев кэша листингов для заранее известных публичных папок.
+
+    Обходит каждую папку целиком теми же запросами, что и IndexView, и
+    обновляет записи, которые истекают в ближайшие margin секунд, так что
+    запросы пользователей попадают в свежий кэш. Очистка истёкших записей
+    FileCache выполняется здесь же пачками, вне обработки запросов.
+
+    Фоновый прогрев (start) выполняет только один процесс сервера — тот,
+    что держит блокировку в WARM_SCHEDULER_LOCK_DIR. Остальные проверяют
+    её каждый интервал и подхватывают прогрев, если ведущий завершился.
+    """
+
+    LEADER_LOCK_KEY = 'cache-warmer'
+
+    def __init__(self, public_keys=None, concurrency=None, margin=None, batch_size=None, lock_dir=None):
+        self.public_keys = list(public_keys or getattr(settings, 'WARM_PUBLIC_KEYS', []))
+        self.concurrency = concurrency or getattr(settings, 'LISTING_MAX_WORKERS', 4)
+        self.margin = margin if margin is not None else getattr(settings, 'WARM_REFRESH_MARGIN', 60)
+        self.batch_size = batch_size or getattr(settings, 'CACHE_PURGE_BATCH_SIZE', 1000)
+        self.lock_dir = lock_dir or getattr(settings, 'WARM_SCHEDULER_LOCK_DIR', None)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Один проход: прогрев всех папок и очистка истёкших записей"""
+        warmed = {}
+        for public_key in self.public_keys:
+            try:
+                warmed[public_key] = self.warm_share(public_key)
+            except Exception as e:
+                logger.warning(f"Cache warm-up failed for {public_key}: {e}")
+        purged = self.purge_expired()
+        logger.info(f"Cache warm-up: {sum(warmed.values())} items in {len(warmed)} shares, {purged} expired purged")
+        return warmed, purged
+
+    def warm_share(self, public_key):
+        """Обходит папку, обновляя истекающие страницы; возвращает число элементов"""
+        view = IndexView()
+
+        def fetch_page(params):
+            return listing_cache.warm(params, partial(view._fetch_listing, params), margin=self.margin)
+
+        lister = FolderLister(fetch_page, max_workers=self.concurrency)
+        return sum(1 for _ in lister.walk(public_key, IndexView.ROOT_PATH))
+
+    def purge_expired(self):
+        """Удаляет истёкшие записи FileCache пачками по batch_size"""
+        return FileCache.clear_expired(batch_size=self.batch_size)
+
+    def start(self, interval=None):
+        """Запускает периодический прогрев в фоновом потоке процесса"""
+        interval = interval or getattr(settings, 'WARM_INTERVAL', 240)
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name='cache-warmer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, interval):
+        # Без каталога блокировок (или fcntl) прогревает каждый процесс
+        leader = ProcessLock(self.LEADER_LOCK_KEY, lock_dir=self.lock_dir, timeout=0)
+        try:
+            while not self._stop.is_set():
+                if leader.acquire() or not leader.enabled:
+                    try:
+                        self.run_once()
+                    except Exception as e:
+                        logger.error(f"Cache warm-up error: {e}")
+                    finally:
+                        connection.close()
+                self._stop.wait(interval)
+        finally:
+            leader.release()
+
+
+def start_scheduler():
+    """Запускает прогрев кэша в текущем процессе, если он включён в настройках"""
+    if not getattr(settings, 'WARM_SCHEDULER_ENABLED', False):
+        return None
+    warmer = CacheWarmer()
+    if not warmer.public_keys:
+        logger.warning("WARM_SCHEDULER_ENABLED is set but WARM_PUBLIC_KEYS is empty")
+        return None
+    warmer.start()
+    return warmer
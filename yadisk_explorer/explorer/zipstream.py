@@ -0,0 +1,121 @@
+import io
+import queue
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+_DONE = object()
+
+
+class _ZipBuffer(io.RawIOBase):
+    """Несжимаемый «файл», в который пишет ZipFile; байты забираются drain()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _MemberReader:
+    """Читает один элемент архива в фоне в ограниченную очередь блоков"""
+
+    def __init__(self, opener, max_chunks, stop):
+        self.opener = opener
+        self.stop = stop
+        self.chunks = queue.Queue(maxsize=max_chunks)
+
+    def run(self):
+        try:
+            for chunk in self.opener():
+                if not self._put(chunk):
+                    return
+            self._put(_DONE)
+        except Exception as e:
+            self._put(e)
+        finally:
+            connection.close()
+
+    def __iter__(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+def stream_zip(members, prefetch=None, max_chunks=None):
+    """Генератор байтов ZIP-архива, собираемого на лету.
+
+    members — итерируемое пар (имя в архиве, opener), где opener() возвращает
+    итератор блоков содержимого. Следующие prefetch элементов скачиваются
+    заранее в фоновых потоках, каждый — не более чем на max_chunks блоков,
+    так что память ограничена независимо от размера архива. Данные пишутся
+    без сжатия (ZIP_STORED) с дескрипторами данных, архив целиком нигде не
+    хранится.
+    """
+    prefetch = prefetch or getattr(settings, 'ZIP_PREFETCH_MEMBERS', 4)
+    max_chunks = max_chunks or getattr(settings, 'ZIP_PREFETCH_CHUNKS', 8)
+
+    members = iter(members)
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    ahead = deque()
+    buffer = _ZipBuffer()
+
+    def schedule():
+        while len(ahead) < prefetch:
+            member = next(members, None)
+            if member is None:
+                return
+            arcname, opener = member
+            reader = _MemberReader(opener, max_chunks, stop)
+            executor.submit(reader.run)
+            ahead.append((arcname, reader))
+
+    try:
+        with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            schedule()
+            while ahead:
+                arcname, reader = ahead.popleft()
+                schedule()
+                with archive.open(arcname, mode='w', force_zip64=True) as dest:
+                    for chunk in reader:
+                        dest.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+                yield buffer.drain()
+        yield buffer.drain()
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
@@ -12,5 +12,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yadisk_explorer.settings')
+# Под ASGI по умолчанию используются асинхронные варианты представлений
+os.environ.setdefault('USE_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Фоновый прогрев кэша (WARM_SCHEDULER_ENABLED), только в процессах сервера;
+# прогревает один из них (WARM_SCHEDULER_LOCK_DIR)
+from explorer.warmup import start_scheduler  # noqa: E402
+
+start_scheduler()
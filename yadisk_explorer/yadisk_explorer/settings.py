@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 
@@ -55,8 +56,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'explorer.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'explorer.auth.TokenRefreshMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -91,9 +94,56 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL: читатели не блокируют запись кэша и индекса из фоновых потоков;
+        # IMMEDIATE берёт блокировку записи в начале транзакции, а не при
+        # первом UPDATE, поэтому конкурентные писатели ждут, а не падают
+        # с "database is locked"
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Тестовая база в файле, а не в памяти: в общей памяти SQLite
+        # блокирует таблицы без ожидания, и запись кэша из потоков падает
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Хранилище сессий: cache (по умолчанию при REDIS_URL: проверка входа без
+# запросов к БД), cached_db (по умолчанию без Redis: чтение из кэша процесса,
+# запись в БД) или db. Подписанные cookie не поддерживаются: в сессии
+# хранится OAuth-токен
+REDIS_URL = os.getenv('REDIS_URL', '')
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cache' if REDIS_URL else 'cached_db')
+SESSION_ENGINES = {
+    'cache': 'django.contrib.sessions.backends.cache',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'db': 'django.contrib.sessions.backends.db',
+}
+if SESSION_BACKEND not in SESSION_ENGINES:
+    raise ImproperlyConfigured(f"SESSION_BACKEND должен быть одним из: {', '.join(SESSION_ENGINES)}")
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Кэш сессий: Redis, если задан REDIS_URL (общий для всех воркеров), иначе
+# память процесса. Без Redis SESSION_BACKEND=cache подходит только для
+# одного процесса: воркеры не видят сессии друг друга
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -138,7 +188,79 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MAX_CACHE_FILE_SIZE = 5 * 1024 * 1024
 
-# Логирование
+# Локальный кэш скачанных файлов по md5 (файлы до MAX_CACHE_FILE_SIZE)
+FILE_CACHE_DIR = BASE_DIR / 'file_cache'
+FILE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Записи FileCache больше FILE_CACHE_COMPRESS_MIN_SIZE байт сжимаются:
+# zlib, zstd (нужен пакет zstandard, иначе zlib) или '' — без сжатия
+FILE_CACHE_COMPRESSION = os.getenv('FILE_CACHE_COMPRESSION', 'zlib')
+FILE_CACHE_COMPRESS_MIN_SIZE = 4096
+
+# Превью файлов: размер по умолчанию (как в листингах API), локальный
+# кэш на диске и число потоков фоновой предзагрузки превью страницы
+PREVIEW_SIZE = 'S'
+PREVIEW_CACHE_DIR = BASE_DIR / 'preview_cache'
+PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024
+PREVIEW_MAX_FILE_SIZE = 2 * 1024 * 1024
+PREVIEW_PREFETCH_WORKERS = 8
+
+# Кэш листингов: сколько запись считается свежей и сколько ещё
+# может отдаваться устаревшей, пока обновляется в фоне (секунды)
+LISTING_CACHE_TTL = 300
+LISTING_CACHE_STALE_TTL = 3600
+# Ответы 404 кэшируются отдельно и недолго
+LISTING_CACHE_NEGATIVE_TTL = 60
+# Сводки по папкам (и их отсутствие) держатся в памяти процесса столько
+# секунд (не больше FOLDER_STATS_CACHE_MAX_ENTRIES папок): повторный листинг
+# папки не читает их из БД
+FOLDER_STATS_CACHE_TTL = 30
+FOLDER_STATS_CACHE_MAX_ENTRIES = 10000
+# Первый уровень кэша листингов в памяти процесса
+LISTING_MEMORY_CACHE_MAX_ENTRIES = 1024
+LISTING_MEMORY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Одинаковые одновременные запросы к API объединяются в один в пределах
+# процесса; с каталогом блокировок — и между процессами одного сервера
+SINGLE_FLIGHT_LOCK_DIR = os.getenv('SINGLE_FLIGHT_LOCK_DIR', '')
+SINGLE_FLIGHT_LOCK_TIMEOUT = 15
+
+# Размер страницы API при обходе папок и число параллельных запросов
+LISTING_PAGE_SIZE = 100
+LISTING_MAX_WORKERS = 4
+# Режим «все элементы одной страницей»: строки таблицы отдаются потоком
+# пачками этого размера
+LISTING_STREAM_CHUNK_SIZE = 200
+
+# Пакетный листинг (/batch/): сколько ссылок принимается за раз и сколько
+# из них запрашивается параллельно
+BATCH_MAX_LINKS = 100
+BATCH_LISTING_WORKERS = 8
+
+# Асинхронный обход деревьев (explorer.crawler): одновременные запросы и
+# число повторов при сбоях API. Частоту ограничивает общий лимитер API
+CRAWLER_CONCURRENCY = 16
+CRAWLER_MAX_RETRIES = 4
+
+# Прогрев кэша листингов (manage.py warm_cache или фоновый поток сервера
+# при WARM_SCHEDULER_ENABLED): папки через запятую, период прогрева,
+# за сколько секунд до устаревания обновлять запись
+WARM_PUBLIC_KEYS = [key.strip() for key in os.getenv('WARM_PUBLIC_KEYS', '').split(',') if key.strip()]
+WARM_SCHEDULER_ENABLED = os.getenv('WARM_SCHEDULER_ENABLED', '0').lower() in ('1', 'true', 'yes')
+WARM_INTERVAL = 240
+WARM_REFRESH_MARGIN = 60
+# Фоновый прогрев выполняет только один процесс сервера: держатель
+# блокировки в этом каталоге. Пустое значение — прогревает каждый воркер
+# (тогда лучше выключить WARM_SCHEDULER_ENABLED и запускать warm_cache из cron)
+WARM_SCHEDULER_LOCK_DIR = os.getenv('WARM_SCHEDULER_LOCK_DIR', str(BASE_DIR / 'locks'))
+# Размер пачки при удалении истёкших записей FileCache
+CACHE_PURGE_BATCH_SIZE = 1000
+
+# Логирование. Отладочные логи горячего пути (ответы API) пишутся только
+# для доли запросов DEBUG_LOG_SAMPLE_RATE и обрезаются до DEBUG_LOG_MAX_CHARS
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG')
+DEBUG_LOG_SAMPLE_RATE = 0.01
+DEBUG_LOG_MAX_CHARS = 2000
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -150,7 +272,7 @@ LOGGING = {
     'loggers': {
         '': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': True,
         },
     },
@@ -158,4 +280,49 @@ LOGGING = {
 
 # Таймауты для запросов
 YANDEX_API_TIMEOUT = 10
-DOWNLOAD_TIMEOUT = 30
\ No newline at end of file
+DOWNLOAD_TIMEOUT = 30
+# Запросы к oauth.yandex.ru и login.yandex.ru при входе и обновлении токена
+YANDEX_AUTH_TIMEOUT = 5
+# За сколько секунд до истечения OAuth-токен обновляется по refresh_token
+YANDEX_TOKEN_REFRESH_MARGIN = 3600
+# Размер блока при потоковой отдаче скачиваемых файлов
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# redirect — отвечать 302 на прямую ссылку Яндекса, proxy — отдавать файл
+# потоком через приложение (можно форсировать параметром ?proxy=1)
+DOWNLOAD_MODE = os.getenv('DOWNLOAD_MODE', 'redirect')
+# Сколько секунд переиспользовать полученную ссылку на скачивание
+DOWNLOAD_HREF_TTL = 1800
+# ZIP-архивы: сколько файлов скачивать заранее и сколько блоков
+# (по DOWNLOAD_CHUNK_SIZE) каждого держать в памяти
+ZIP_PREFETCH_MEMBERS = 4
+ZIP_PREFETCH_CHUNKS = 8
+
+# Пул keep-alive соединений к API Яндекса (на процесс) и число повторов
+# идемпотентных запросов при обрывах соединения
+YANDEX_HTTP_POOL_SIZE = 10
+YANDEX_HTTP_RETRIES = 2
+# Пул асинхронного клиента (один на цикл событий ASGI-воркера)
+YANDEX_ASYNC_POOL_SIZE = 100
+
+# Лимиты запросов к REST API Диска (в секунду, с допустимым всплеском):
+# общий на процесс и на каждый OAuth-токен (запросы без токена учитываются
+# только в общем). Дольше YANDEX_API_MAX_WAIT секунд запрос слота
+# (или Retry-After) не ждёт
+YANDEX_API_RATE_LIMIT = 20
+YANDEX_API_BURST = 40
+YANDEX_API_TOKEN_RATE_LIMIT = 5
+YANDEX_API_TOKEN_BURST = 10
+YANDEX_API_MAX_WAIT = 5
+# Ответ 429/503 повторяется, только если Retry-After не больше стольких
+# секунд; при большей паузе ошибка возвращается сразу
+YANDEX_API_RETRY_AFTER_MAX = 2
+# После стольких сбоев подряд запросы к API приостанавливаются на
+# CIRCUIT_BREAKER_RESET секунд; листинги в это время отдаются из кэша
+CIRCUIT_BREAKER_FAILURES = 5
+CIRCUIT_BREAKER_RESET = 30
+
+# Метрики Prometheus на /metrics; с токеном — только с Authorization: Bearer
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Асинхронные представления (explorer.async_views); asgi.py включает их по умолчанию
+USE_ASYNC_VIEWS = os.getenv('USE_ASYNC_VIEWS', '0').lower() in ('1', 'true', 'yes')
\ No newline at end of file
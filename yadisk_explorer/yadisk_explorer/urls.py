@@ -15,13 +15,31 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
 from django.urls import path
-from explorer.views import IndexView, YandexAuthView, YandexAuthCallbackView, DownloadView, LogoutView
+from explorer.views import (
+    BatchListingView, BulkDownloadView, DownloadView, IndexView, ListingApiView, LogoutView, MetricsView, PreviewView, SearchApiView,
+    YandexAuthCallbackView, YandexAuthView,
+)
+
+if settings.USE_ASYNC_VIEWS:
+    from explorer.async_views import (
+        AsyncBulkDownloadView as BulkDownloadView,
+        AsyncDownloadView as DownloadView,
+        AsyncIndexView as IndexView,
+        AsyncYandexAuthCallbackView as YandexAuthCallbackView,
+    )
 
 urlpatterns = [
     path('', IndexView.as_view(), name='index'),
     path('oauth/yandex/', YandexAuthView.as_view(), name='yandex_auth'),
     path('oauth/yandex/callback/', YandexAuthCallbackView.as_view(), name='yandex_auth_callback'),
     path('download/', DownloadView.as_view(), name='download'),
+    path('download/zip/', BulkDownloadView.as_view(), name='download_zip'),
+    path('preview/', PreviewView.as_view(), name='preview'),
+    path('batch/', BatchListingView.as_view(), name='batch'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('api/listing/', ListingApiView.as_view(), name='api_listing'),
+    path('api/search/', SearchApiView.as_view(), name='api_search'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
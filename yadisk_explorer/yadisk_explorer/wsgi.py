@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yadisk_explorer.settings')
 
 application = get_wsgi_application()
+
+# Фоновый прогрев кэша (WARM_SCHEDULER_ENABLED), только в процессах сервера;
+# прогревает один из них (WARM_SCHEDULER_LOCK_DIR)
+from explorer.warmup import start_scheduler  # noqa: E402
+
+start_scheduler()